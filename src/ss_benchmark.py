@@ -0,0 +1,1022 @@
+#!/usr/bin/env python
+
+# The MIT License (MIT)
+#
+# Copyright (c) 2016 Personal Robots Group
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import argparse # to parse command line arguments
+import json # for Opal command properties
+import logging # to quiet log messages while benchmarking
+import multiprocessing # to measure memory use in a fresh process
+import os # for process cpu times
+import random # for generating benchmark data
+import shutil # for cleaning up benchmark files
+import sqlite3 # for benchmark databases
+import tempfile # for benchmark files
+import threading # for feeding commands to the game loop
+import time # for timing
+import Queue # for queuing messages for the game loop
+import resource # for peak memory use
+from collections import OrderedDict # sheets of a generated spreadsheet
+
+def ss_benchmark():
+    """ Run performance benchmarks for parts of the social stories game
+    and print the results.
+    """
+    parser = argparse.ArgumentParser(
+            formatter_class=argparse.RawDescriptionHelpFormatter,
+            description="Run performance benchmarks for the SAR Social"
+            " Stories game. Each benchmark reports numbers for the current"
+            " code and, where it makes sense, for the approach it"
+            " replaced.")
+    subparsers = parser.add_subparsers(dest='benchmark')
+
+    loop_parser = subparsers.add_parser('game_loop', help="""Measure CPU
+            used by the main game loop while it is idle (before START or
+            while paused) and the latency from a game command being queued
+            to the game loop acting on it.""")
+    loop_parser.add_argument('-n', '--trials', dest='trials', action='store',
+            type=int, default=20, help="Number of PAUSE/CONTINUE trials. "
+            + "Defaults to 20.")
+    loop_parser.add_argument('-i', '--idle', dest='idle', action='store',
+            type=float, default=0.25, help="Seconds to stay paused in each "
+            + "trial. Defaults to 0.25.")
+
+    db_parser = subparsers.add_parser('db_queries', help="""Measure how long
+            the database queries the game makes take on a database filled
+            with generated progress for many sessions, before and after
+            migrating the database to the current schema (which adds
+            indexes).""")
+    db_parser.add_argument('-s', '--sessions', dest='sessions',
+            action='store', type=int, default=10000, help="Number of "
+            + "sessions of progress to generate. Defaults to 10000.")
+    db_parser.add_argument('-p', '--participants', dest='participants',
+            action='store', type=int, default=100, help="Number of "
+            + "participants the sessions are spread over. Defaults to 100.")
+    db_parser.add_argument('-t', '--stories', dest='stories',
+            action='store', type=int, default=40, help="Number of stories "
+            + "in the generated catalog. Defaults to 40.")
+    db_parser.add_argument('-n', '--trials', dest='trials', action='store',
+            type=int, default=50, help="Number of times to run each query. "
+            + "Defaults to 50.")
+
+    write_parser = subparsers.add_parser('db_writes', help="""Measure the
+            latency of recording a response to a question and of recording
+            a story played, with the old database settings (rollback journal,
+            commit and sync after every write) and with the current
+            settings and group commit modes.""")
+    write_parser.add_argument('-n', '--trials', dest='trials',
+            action='store', type=int, default=200, help="Number of "
+            + "responses to record. Defaults to 200.")
+    write_parser.add_argument('-d', '--dir', dest='dir', action='store',
+            type=str, default=None, help="Directory to put the benchmark "
+            + "database in, so you can measure the storage the game really "
+            + "uses. Defaults to a temporary directory.")
+
+    insert_parser = subparsers.add_parser('response_inserts', help="""Measure
+            how many responses per second can be recorded, with the old
+            insert that looked up the story played and question with
+            nested subqueries and with the current insert that uses ids
+            the database manager already knows.""")
+    insert_parser.add_argument('-n', '--trials', dest='trials',
+            action='store', type=int, default=5000, help="Number of "
+            + "responses to record. Defaults to 5000.")
+
+    ingest_parser = subparsers.add_parser('ingest', help="""Measure how long
+            reading and processing a large generated story spreadsheet
+            takes and the peak memory (RSS) used, when reading whole
+            workbooks into memory and when streaming one sheet at a time.
+            Requires pyexcel and pyexcel-ods.""")
+    ingest_parser.add_argument('-s', '--stories', dest='stories',
+            action='store', type=int, default=200, help="Number of stories "
+            + "(sheets) in the generated spreadsheet. Defaults to 200.")
+    ingest_parser.add_argument('-c', '--chars', dest='chars',
+            action='store', type=int, default=2000, help="Number of "
+            + "characters of text in each story and scene description cell. "
+            + "Defaults to 2000.")
+
+    memory_parser = subparsers.add_parser('memory_catalog', help="""Measure
+            how long connecting to the database takes and how long the
+            database queries the game makes take, with the story catalog
+            read from the database file and with it copied into memory
+            (the "memory_catalog" database option).""")
+    memory_parser.add_argument('-s', '--sessions', dest='sessions',
+            action='store', type=int, default=10000, help="Number of "
+            + "sessions of progress to generate. Defaults to 10000.")
+    memory_parser.add_argument('-p', '--participants', dest='participants',
+            action='store', type=int, default=100, help="Number of "
+            + "participants the sessions are spread over. Defaults to 100.")
+    memory_parser.add_argument('-t', '--stories', dest='stories',
+            action='store', type=int, default=40, help="Number of stories "
+            + "in the generated catalog. Defaults to 40.")
+    memory_parser.add_argument('-n', '--trials', dest='trials',
+            action='store', type=int, default=50, help="Number of times to "
+            + "connect and to run each query. Defaults to 50.")
+
+    opal_parser = subparsers.add_parser('opal_loads', help="""Measure how
+            long it takes for a level-10 story's scene (four scene graphics
+            and five answer options) to be ready on a stand-in for the
+            Opal game that takes a while to handle each message, and how
+            many objects are lost, when each object is sent in its own
+            LOAD_OBJECT command and when they are batched. Runs on an
+            in-process bus unless told to use ROS.""")
+    opal_parser.add_argument('-n', '--trials', dest='trials', action='store',
+            type=int, default=20, help="Number of scenes to load. Defaults "
+            + "to 20.")
+    opal_parser.add_argument('-m', '--message_ms', dest='message_ms',
+            action='store', type=float, default=20, help="How long the "
+            + "stand-in game takes to handle each message, in ms. Defaults "
+            + "to 20.")
+    opal_parser.add_argument('-r', '--ros', dest='ros', action='store_true',
+            default=False, help="Use ROS instead of an in-process bus. "
+            + "Requires roscore to be running and sar_opal_msgs.")
+
+    encode_parser = subparsers.add_parser('command_encoding', help="""Measure
+            how many Opal and robot commands per second ss_ros can turn
+            into ROS messages, with the old chain of substring checks and
+            with the current command tables. Uses the plain message structs
+            of the in-process bus unless told to use ROS messages.""")
+    encode_parser.add_argument('-n', '--trials', dest='trials',
+            action='store', type=int, default=100000, help="Number of "
+            + "commands to encode. Defaults to 100000.")
+    encode_parser.add_argument('-r', '--ros', dest='ros',
+            action='store_true', default=False, help="Use ROS messages "
+            + "instead of plain message structs. Requires roscore to be "
+            + "running and the sar_* message packages.")
+
+    # Parse the args we got, and print them out.
+    args = parser.parse_args()
+    print("Args received: " + str(args))
+
+    # Keep the benchmarked code's log messages out of the results.
+    logging.disable(logging.CRITICAL)
+
+    if args.benchmark == "game_loop":
+        benchmark_game_loop(args.trials, args.idle)
+    elif args.benchmark == "db_queries":
+        benchmark_db_queries(args.sessions, args.participants, args.stories,
+            args.trials)
+    elif args.benchmark == "db_writes":
+        benchmark_db_writes(args.trials, args.dir)
+    elif args.benchmark == "response_inserts":
+        benchmark_response_inserts(args.trials)
+    elif args.benchmark == "ingest":
+        benchmark_ingest(args.stories, args.chars)
+    elif args.benchmark == "memory_catalog":
+        benchmark_memory_catalog(args.sessions, args.participants,
+            args.stories, args.trials)
+    elif args.benchmark == "opal_loads":
+        benchmark_opal_loads(args.trials, args.message_ms, args.ros)
+    elif args.benchmark == "command_encoding":
+        benchmark_command_encoding(args.trials, args.ros)
+
+
+def _cpu_time():
+    """ Return the user + system CPU time used by this process. """
+    times = os.times()
+    return times[0] + times[1]
+
+
+def _report(name, values, unit):
+    """ Print the mean, min, and max of a list of measurements. """
+    if not values:
+        print(name + ": no measurements")
+        return
+    print("%s: mean %.3f %s, min %.3f %s, max %.3f %s (n=%d)" % (name,
+        sum(values) / len(values), unit, min(values), unit, max(values), unit,
+        len(values)))
+
+
+class _stub_ros():
+    """ Stands in for ss_ros so the game loop can run without sending
+    game state messages.
+    """
+    def send_game_state(self, state, performance=None):
+        pass
+
+
+class _stub_script_handler():
+    """ Stands in for the script handler. Records when the game loop
+    acts on PAUSE and CONTINUE commands, and plays "script lines" that
+    take a little time each while the game is running.
+    """
+    def __init__(self):
+        self.paused = threading.Event()
+        self.resumed = threading.Event()
+        self.resume_time = None
+        self.finished = False
+
+    def set_start_level(self, level):
+        pass
+
+    def pause_game_timer(self):
+        self.paused.set()
+
+    def resume_game_timer(self):
+        self.resume_time = time.time()
+        self.resumed.set()
+
+    def iterate_once(self):
+        if self.finished:
+            raise StopIteration
+        time.sleep(0.001)
+
+
+def _legacy_game_loop(queue, script_handler):
+    """ The game loop as it was before it blocked on the queue: poll
+    the queue without waiting, whether or not there is anything else to
+    do.
+    """
+    started = False
+    paused = False
+    while True:
+        try:
+            msg = queue.get(False)
+        except Queue.Empty:
+            pass
+        else:
+            if "START" in msg and not started:
+                started = True
+            elif "PAUSE" in msg and not paused:
+                paused = True
+                script_handler.pause_game_timer()
+            elif "CONTINUE" in msg and paused:
+                paused = False
+                script_handler.resume_game_timer()
+        if started and not paused:
+            try:
+                script_handler.iterate_once()
+            except StopIteration:
+                return
+
+
+def _drive_game_loop(queue, script_handler, trials, idle, results):
+    """ Feed commands to a running game loop: start the game, then
+    repeatedly pause it, stay idle for a while, and continue it again.
+    Record CPU use while idle and how long the loop took to act on each
+    CONTINUE.
+    """
+    queue.put("START")
+    for i in range(0, trials):
+        script_handler.paused.clear()
+        queue.put("PAUSE")
+        script_handler.paused.wait(5)
+        # Measure CPU used by the whole process while the game is idle.
+        cpu_start = _cpu_time()
+        wall_start = time.time()
+        time.sleep(idle)
+        results["idle_cpu"].append(100 * (_cpu_time() - cpu_start)
+                / (time.time() - wall_start))
+        # Measure how long it takes for the loop to resume.
+        script_handler.resumed.clear()
+        sent = time.time()
+        queue.put("CONTINUE")
+        script_handler.resumed.wait(5)
+        results["latency"].append(1000 * (script_handler.resume_time - sent))
+    script_handler.finished = True
+
+
+def benchmark_game_loop(trials, idle):
+    """ Compare the old busy-polling game loop with the current one. """
+    from ss_game_node import ss_game_node
+
+    for name in ["before (busy poll)", "after (blocking wait)"]:
+        queue = Queue.Queue()
+        script_handler = _stub_script_handler()
+        results = {"idle_cpu": [], "latency": []}
+        driver = threading.Thread(target=_drive_game_loop, args=(queue,
+            script_handler, trials, idle, results))
+        driver.start()
+        if name.startswith("before"):
+            _legacy_game_loop(queue, script_handler)
+        else:
+            game_node = ss_game_node(log_config=None)
+            game_node._queue = queue
+            game_node._ros_ss = _stub_ros()
+            game_node.run_game(script_handler)
+        driver.join()
+
+        print("Game loop " + name + ":")
+        _report("    idle CPU", results["idle_cpu"], "%")
+        _report("    command-to-action latency", results["latency"], "ms")
+
+
+def _benchmark_transport(ros):
+    """ Get a transport for ss_ros: ROS, which starts our ROS node, or
+    an in-process bus.
+    """
+    if ros:
+        from ss_rospy_transport import ss_rospy_transport
+        return ss_rospy_transport()
+    from ss_transport import ss_local_transport
+    return ss_local_transport()
+
+
+class _stand_in_opal_game():
+    """ Stands in for the Opal game: subscribes to Opal commands, takes
+    a while to handle each one (as the game on a tablet does), and notes
+    when all the objects it expects have been loaded.
+    """
+    def __init__(self, message_seconds, transport):
+        self._load_object = transport.OpalCommand.LOAD_OBJECT
+        self._message_seconds = message_seconds
+        self.ready = threading.Event()
+        self.reset(0)
+        transport.subscribe('/sar/opal_command', transport.OpalCommand,
+            self.on_opal_command)
+
+    def reset(self, expected):
+        self.expected = expected
+        self.loaded = 0
+        self.ready_time = None
+        self.ready.clear()
+
+    def on_opal_command(self, msg):
+        time.sleep(self._message_seconds)
+        if msg.command == self._load_object:
+            objects = json.loads(msg.properties)
+            self.loaded += len(objects) if isinstance(objects, list) else 1
+            if self.loaded >= self.expected and not self.ready.is_set():
+                self.ready_time = time.time()
+                self.ready.set()
+
+
+def _story_scene_loads(scenes, answers):
+    """ Get the SETUP_STORY_SCENE properties, scene graphics, and
+    answer options the game loads for a story, as JSON strings.
+    """
+    setup = json.dumps({"numScenes": scenes, "scenesInOrder": True,
+        "numAnswers": answers})
+    scene_objects = [json.dumps({"name": "scenes/story-" + str(i) + ".png",
+        "tag": "PlayObject", "slot": i, "draggable": False,
+        "isAnswerSlot": False}) for i in range(1, scenes + 1)]
+    answer_objects = [json.dumps({"name": _EMOTIONS[i], "tag": "PlayObject",
+        "slot": i + 1, "draggable": False, "isAnswerSlot": True})
+        for i in range(0, answers)]
+    return setup, scene_objects, answer_objects
+
+
+def benchmark_opal_loads(trials, message_ms, ros):
+    """ Compare loading a story scene into a stand-in Opal game with one
+    LOAD_OBJECT command per object and with batched LOAD_OBJECT commands.
+    """
+    from ss_ros import ss_ros
+
+    transport = _benchmark_transport(ros)
+    game = _stand_in_opal_game(message_ms / 1000.0, transport)
+    setup, scenes, answers = _story_scene_loads(4, 5)
+    expected = len(scenes) + len(answers)
+    for name, batch in [("before (one LOAD_OBJECT per object)", False),
+            ("after (batched LOAD_OBJECT)", True)]:
+        ros_ss = ss_ros(Queue.Queue(), batch, transport)
+        # Wait for the stand-in game to connect.
+        for i in range(0, 100):
+            if ros_ss._game_pub.get_num_connections() > 0:
+                break
+            time.sleep(0.05)
+        latencies = []
+        lost = []
+        for i in range(0, trials):
+            game.reset(expected)
+            start = time.time()
+            # Load a story the way the script handler does.
+            ros_ss.send_opal_command("SETUP_STORY_SCENE", setup)
+            ros_ss.send_opal_load_objects(scenes)
+            ros_ss.send_opal_load_objects(answers)
+            if game.ready.wait(5):
+                latencies.append(1000 * (game.ready_time - start))
+            # Let the game finish with this scene before the next one.
+            time.sleep(2 * (expected + 1) * message_ms / 1000.0)
+            lost.append(expected - game.loaded)
+
+        print("Loading a level-10 story scene " + name + ":")
+        _report("    scene-ready latency", latencies, "ms")
+        print("    scenes not ready after 5 s: %d of %d; objects lost: %d"
+            % (trials - len(latencies), trials, sum(lost)))
+
+
+def _legacy_encoders(logger, transport):
+    """ Get functions that build OpalCommand and RobotCommand messages
+    the way ss_ros did before it looked commands up in its command
+    tables, by walking a chain of substring checks.
+    """
+    OpalCommand = transport.OpalCommand
+    RobotCommand = transport.RobotCommand
+    Header = transport.Header
+
+    def encode_opal_command(command, properties=None):
+        # Build message.
+        msg = OpalCommand()
+        # Add header.
+        msg.header = Header()
+        msg.header.stamp = transport.now()
+        # Add appropriate command and properties if there are any.
+        # We check properties for each command individually, since some
+        # require properties, and if there are none, we shouldn't send
+        # the message. We assume any properties provided are in the
+        # correct format for the command.
+        if "RESET" in command:
+            msg.command = OpalCommand.RESET
+        elif "DISABLE_TOUCH" in command:
+            msg.command = OpalCommand.DISABLE_TOUCH
+        elif "ENABLE_TOUCH" in command:
+            msg.command = OpalCommand.ENABLE_TOUCH
+        elif "SIDEKICK_DO" in command:
+            msg.command = OpalCommand.SIDEKICK_DO
+            # Properties: a string with the name of action to do.
+        elif "SIDEKICK_SAY" in command:
+            msg.command = OpalCommand.SIDEKICK_SAY
+            # Properties: a string with the name of audio file to play.
+            if properties:
+                msg.properties = properties
+            else:
+                logger.warning("Did not get properties for a "
+                    + "SIDEKICK_SAY command! Not sending empty command.")
+                return None
+        elif "LOAD_OBJECT" in command:
+            msg.command = OpalCommand.LOAD_OBJECT
+            # Properties: JSON defining what object to load.
+            if properties:
+                msg.properties = properties
+            else:
+                logger.warning("Did not get properties for a "
+                    + "LOAD_OBJECT command! Not sending empty command.")
+                return None
+        elif "CLEAR" in command:
+            msg.command = OpalCommand.CLEAR
+            # Properties: optionally, string defining what objects to
+            # remove.
+            if properties:
+                msg.properties = properties
+        elif "MOVE_OBJECT" in command:
+            msg.command = OpalCommand.MOVE_OBJECT
+            # Properties: JSON defining what object to move where.
+            if properties:
+                msg.properties = properties
+            else:
+                logger.warning("Did not get properties for a "
+                    + "MOVE_OBJECT command! Not sending empty command.")
+                return None
+        elif "HIGHLIGHT" in command:
+            msg.command = OpalCommand.HIGHLIGHT_OBJECT
+            # Properties: a string with name of the object to highlight.
+            if properties:
+                msg.properties = properties
+            else:
+                logger.warning("Did not get properties for a "
+                    + "HIGHLIGHT_OBJECT command! Adding null properties.")
+        elif "REQUEST_KEYFRAME" in command:
+            msg.command = OpalCommand.REQUEST_KEYFRAME
+        elif "FADE_SCREEN" in command:
+            msg.command = OpalCommand.FADE_SCREEN
+        elif "UNFADE_SCREEN" in command:
+            msg.command = OpalCommand.UNFADE_SCREEN
+        elif "NEXT_PAGE" in command:
+            msg.command = OpalCommand.NEXT_PAGE
+        elif "PREV_PAGE" in command:
+            msg.command = OpalCommand.PREV_PAGE
+        elif "EXIT" in command:
+            msg.command = OpalCommand.EXIT
+        elif "SET_CORRECT" in command:
+            msg.command = OpalCommand.SET_CORRECT
+            # Properties: JSON listing names of objects that are
+            # correct or incorrect.
+            if properties:
+                msg.properties = properties
+            else:
+                logger.warning("Did not get properties for a "
+                    + "SET_CORRECT command! Not sending empty command.")
+                return None
+        elif "SHOW_CORRECT" in command:
+            msg.command = OpalCommand.SHOW_CORRECT
+        elif "HIDE_CORRECT" in command:
+            msg.command = OpalCommand.HIDE_CORRECT
+        elif "SETUP_STORY_SCENE" in command:
+            msg.command = OpalCommand.SETUP_STORY_SCENE
+            # Properties: JSON listing scene attributes.
+            if properties:
+                msg.properties = properties
+            else:
+                logger.warning("Did not get properties for a "
+                    + "SETUP_STORY_SCENE command! Not sending empty command.")
+                return None
+        else:
+            logger.warning("Not sending invalid OpalCommand: ", command)
+            return None
+        return msg
+
+    def encode_robot_command(command, properties=None):
+        # Build message.
+        msg = RobotCommand()
+        # Add header.
+        msg.header = Header()
+        msg.header.stamp = transport.now()
+        # Add appropriate command.
+        if "SLEEP" in command:
+            msg.command = RobotCommand.SLEEP
+        elif "WAKEUP" in command:
+            msg.command = RobotCommand.WAKEUP
+        elif "DO" in command:
+            msg.command = RobotCommand.DO
+            # DO commands take properties in the form of a string
+            # contianing text to say and/or actions to do. We assume
+            # these are provided in the correct string format.
+            if properties:
+                msg.properties = properties
+            else:
+                logger.warning("Did not get properties for a DO command! "
+                        + "Not sending empty command.")
+                return None
+        msg.interrupt = False
+        return msg
+
+    return encode_opal_command, encode_robot_command
+
+
+def benchmark_command_encoding(trials, ros):
+    """ Compare how fast Opal and robot commands are turned into ROS
+    messages with the old chain of substring checks and with the current
+    command tables.
+    """
+    from ss_ros import ss_ros
+
+    transport = _benchmark_transport(ros)
+    ros_ss = ss_ros(Queue.Queue(), transport=transport)
+    legacy_opal, legacy_robot = _legacy_encoders(logging.getLogger(__name__),
+        transport)
+    # The commands a story session sends most, and a few near the end
+    # of the old chain.
+    setup, scenes, answers = _story_scene_loads(4, 5)
+    commands = [("opal", "CLEAR", None), ("opal", "SETUP_STORY_SCENE", setup),
+        ("opal", "LOAD_OBJECT", scenes[0]), ("opal", "HIGHLIGHT", "scene1"),
+        ("opal", "SET_CORRECT", '{"correct": ["sad"], "incorrect": []}'),
+        ("opal", "SHOW_CORRECT", None), ("opal", "HIDE_CORRECT", None),
+        ("opal", "NEXT_PAGE", None), ("robot", "DO", "Hello!"),
+        ("robot", "WAKEUP", None)]
+    for name, encode_opal, encode_robot in [
+            ("before (substring checks)", legacy_opal, legacy_robot),
+            ("after (command tables)", ros_ss._encode_opal_command,
+                ros_ss._encode_robot_command)]:
+        start = time.time()
+        for i in range(0, trials):
+            kind, command, properties = commands[i % len(commands)]
+            if kind == "opal":
+                encode_opal(command, properties)
+            else:
+                encode_robot(command, properties)
+        seconds = time.time() - start
+        print("Command encoding " + name + ": %.0f commands/s (n=%d)"
+            % (trials / seconds, trials))
+
+
+# Emotions used as target responses in generated questions.
+_EMOTIONS = ["happy", "sad", "angry", "scared", "excited", "surprised",
+    "frustrated", "proud"]
+
+def _fill_benchmark_db(conn, sessions, participants, stories=40, levels=10,
+        stories_per_session=4):
+    """ Fill a new database with generated stories and questions, and
+    with progress for the given number of sessions spread across the
+    given number of participants.
+    """
+    rand = random.Random(0)
+    conn.executemany("INSERT INTO levels (level, num_answers, in_order) "
+        + "VALUES (?, 3, 1)", [(level,) for level in range(1, levels + 1)])
+    conn.executemany("INSERT INTO stories (id, story_name) VALUES (?, ?)",
+        [(i, "story-" + str(i)) for i in range(1, stories + 1)])
+    graphics = []
+    questions = []
+    for story in range(1, stories + 1):
+        for level in range(1, levels + 1):
+            for scene in range(1, 5):
+                graphics.append((story, level, scene, "story-" + str(story)
+                    + "-" + str(scene)))
+            for num in range(1, 4):
+                questions.append((story, level, num, "emotion",
+                    rand.choice(_EMOTIONS)))
+            questions.append((story, level, 1, "order", "scene-1"))
+    conn.executemany("INSERT INTO graphics (story_id, level, scene_num, "
+        + "graphic) VALUES (?, ?, ?, ?)", graphics)
+    conn.executemany("INSERT INTO questions (story_id, level, question_num, "
+        + "question_type, target_response) VALUES (?, ?, ?, ?, ?)", questions)
+
+    # Each participant plays a few stories per session and answers the
+    # questions about each story.
+    stories_played = []
+    responses = []
+    played_id = 0
+    for session_num in range(0, sessions):
+        participant = "p" + str(session_num % participants)
+        session = session_num // participants
+        level = min(levels, 1 + session // 4)
+        for i in range(0, stories_per_session):
+            played_id += 1
+            story = rand.randint(1, stories)
+            stories_played.append((played_id, "2016-01-01 00:00:%08d"
+                % played_id, participant, session, level, story))
+            for question in _questions_for(story, level, levels):
+                responses.append((played_id, question,
+                    rand.choice(_EMOTIONS)))
+    conn.executemany("INSERT INTO stories_played (id, time, participant, "
+        + "session, level, story_id) VALUES (?, ?, ?, ?, ?, ?)",
+        stories_played)
+    conn.executemany("INSERT INTO responses (stories_played_id, "
+        + "questions_id, response) VALUES (?, ?, ?)", responses)
+    conn.commit()
+
+
+def _questions_for(story, level, levels):
+    """ Get the ids of the generated questions for a story at a level.
+    Each story has four questions per level, inserted in order.
+    """
+    first = ((story - 1) * levels + (level - 1)) * 4 + 1
+    return range(first, first + 4)
+
+
+def _downgrade_to_version_0(conn):
+    """ Take a database back to schema version 0, without the indexes,
+    triggers, and tables added by migrations.
+    """
+    for (kind, name) in conn.execute("SELECT type, name FROM sqlite_master "
+            + "WHERE type IN ('index', 'trigger') AND sql IS NOT NULL"
+            ).fetchall():
+        conn.execute("DROP " + kind.upper() + " " + name)
+    conn.execute("DROP TABLE IF EXISTS session_performance")
+    conn.execute("DROP TABLE IF EXISTS catalog_version")
+    conn.execute("DROP TABLE IF EXISTS story_hashes")
+    conn.execute("PRAGMA user_version = 0")
+    conn.commit()
+
+
+def _time_db_queries(database, participants, sessions, trials,
+        options=None):
+    """ Run each of the game's database queries several times against
+    a database and return a list of query names and lists of times in
+    ms. Queries that need a newer schema than the database has get no
+    times. Options are passed on to the database manager.
+    """
+    from ss_db_manager import ss_db_manager
+    # Measure the database as it is, without migrating it.
+    db_options = {"migrate": False}
+    if options is not None:
+        db_options.update(options)
+    db_man = ss_db_manager(database, db_options)
+    rand = random.Random(1)
+    last_session = (sessions - 1) // participants
+    # Responses are recorded for a story played this session.
+    for participant in range(0, participants):
+        db_man.record_story_played("p" + str(participant), last_session + 1,
+            10, "story-7")
+    queries = [
+        ("get_most_recent_level", lambda p: db_man.get_most_recent_level(p,
+            last_session + 1)),
+        ("get_percent_correct_responses", lambda p:
+            db_man.get_percent_correct_responses(p, last_session)),
+        ("get_response_counts", lambda p:
+            db_man.get_response_counts(p, [last_session])),
+        ("get_most_recent_incorrect_emotions", lambda p:
+            db_man.get_most_recent_incorrect_emotions(p, last_session)),
+        ("get_next_new_story", lambda p: db_man.get_next_new_story(p,
+            ["sad", "proud"], 10)),
+        ("get_next_review_story", lambda p: db_man.get_next_review_story(p,
+            last_session + 1, ["sad", "proud"], 10)),
+        ("get_level_info", lambda p: db_man.get_level_info(10)),
+        ("get_graphics", lambda p: db_man.get_graphics("story-7", 10)),
+        ("record_response", lambda p: db_man.record_response(p,
+            last_session + 1, 10, "story-7", 1, "emotion", "sad")),
+        ]
+    times = {}
+    for name, query in queries:
+        times[name] = []
+        for i in range(0, trials):
+            participant = "p" + str(rand.randint(0, participants - 1))
+            start = time.time()
+            try:
+                query(participant)
+            except sqlite3.OperationalError:
+                # This query needs tables the database doesn't have.
+                break
+            times[name].append(1000 * (time.time() - start))
+    return [(name, times[name]) for name, query in queries]
+
+
+def benchmark_db_queries(sessions, participants, stories, trials):
+    """ Compare the game's database queries on a database without
+    indexes and on the same database after migrating it.
+    """
+    from ss_init_db import create_tables
+    from ss_migrate_db import migrate
+
+    temp_dir = tempfile.mkdtemp()
+    try:
+        database = os.path.join(temp_dir, "benchmark.db")
+        conn = sqlite3.connect(database)
+        create_tables(conn)
+        print("Generating " + str(sessions) + " sessions of progress for "
+            + str(participants) + " participants, with " + str(stories)
+            + " stories...")
+        _fill_benchmark_db(conn, sessions, participants, stories)
+        _downgrade_to_version_0(conn)
+
+        for name in ["before (schema version 0)", "after (migrated)"]:
+            if name.startswith("after"):
+                start = time.time()
+                version = migrate(conn)
+                print("Migrated to schema version " + str(version) + " in "
+                    + "%.1f s" % (time.time() - start))
+            print("Database queries " + name + ":")
+            for query, values in _time_db_queries(database, participants,
+                    sessions, trials):
+                _report("    " + query, values, "ms")
+        conn.close()
+    finally:
+        shutil.rmtree(temp_dir)
+
+
+def benchmark_memory_catalog(sessions, participants, stories, trials):
+    """ Compare connecting to the database and the game's database
+    queries with the story catalog read from the database file and with
+    it copied into memory.
+    """
+    from ss_init_db import create_tables
+    from ss_db_manager import ss_db_manager
+
+    temp_dir = tempfile.mkdtemp()
+    try:
+        database = os.path.join(temp_dir, "benchmark.db")
+        conn = sqlite3.connect(database)
+        create_tables(conn)
+        print("Generating " + str(sessions) + " sessions of progress for "
+            + str(participants) + " participants, with " + str(stories)
+            + " stories...")
+        _fill_benchmark_db(conn, sessions, participants, stories)
+        conn.close()
+
+        for name, memory in [("on disk", False), ("in memory", True)]:
+            print("Story catalog " + name + ":")
+            times = []
+            for i in range(0, trials):
+                start = time.time()
+                db_man = ss_db_manager(database, {"memory_catalog": memory})
+                times.append(1000 * (time.time() - start))
+                db_man.close()
+            _report("    connect", times, "ms")
+            for query, values in _time_db_queries(database, participants,
+                    sessions, trials, {"memory_catalog": memory}):
+                _report("    " + query, values, "ms")
+    finally:
+        shutil.rmtree(temp_dir)
+
+
+def benchmark_db_writes(trials, directory):
+    """ Compare how long recording responses and stories takes with
+    different database options.
+    """
+    from ss_init_db import create_tables
+    from ss_db_manager import ss_db_manager
+    from ss_response_recorder import ss_response_recorder
+
+    configs = [
+        ("before (rollback journal, synchronous=full, commit every write)",
+            {"journal_mode": "delete", "synchronous": "full"}),
+        ("WAL, synchronous=normal, commit every write", {}),
+        ("WAL, synchronous=normal, group commit at story boundaries",
+            {"durability": "story"}),
+        ("WAL, synchronous=normal, group commit on a timer",
+            {"durability": "timer"}),
+        ("WAL, synchronous=normal, write-behind recorder",
+            {"write_behind": True}),
+        ]
+    temp_dir = tempfile.mkdtemp(dir=directory)
+    try:
+        for name, options in configs:
+            database = os.path.join(temp_dir, "benchmark.db")
+            for suffix in ["", "-wal", "-shm"]:
+                if os.path.exists(database + suffix):
+                    os.remove(database + suffix)
+            conn = sqlite3.connect(database)
+            create_tables(conn)
+            _fill_benchmark_db(conn, 100, 10)
+            conn.close()
+
+            db_man = ss_db_manager(database, options)
+            # Record responses the way the personalization manager does
+            # with these options.
+            recorder = None
+            if options.get("write_behind"):
+                recorder = ss_response_recorder(database, options)
+            responses = []
+            stories = []
+            for i in range(0, trials):
+                # Record a new story every few responses.
+                if i % 4 == 0:
+                    start = time.time()
+                    db_man.record_story_played("p0", 100, 10, "story-7")
+                    stories.append(1000 * (time.time() - start))
+                start = time.time()
+                if recorder is not None:
+                    stories_played_id, question_id = db_man.get_response_ids(
+                        "p0", 100, 10, "story-7", i % 3 + 1, "emotion")
+                    recorder.record(stories_played_id, question_id, "sad")
+                else:
+                    db_man.record_response("p0", 100, 10, "story-7",
+                        i % 3 + 1, "emotion", "sad")
+                responses.append(1000 * (time.time() - start))
+            if recorder is not None:
+                recorder.close()
+            db_man.close()
+
+            print("Database writes " + name + ":")
+            _report("    record_response", responses, "ms")
+            _report("    record_story_played", stories, "ms")
+            if recorder is not None:
+                print("    recorder stats: " + str(recorder.get_stats()))
+    finally:
+        shutil.rmtree(temp_dir)
+
+
+# How responses were recorded before the database manager kept the ids
+# of the stories played and the questions: find both with subqueries.
+_LEGACY_RECORD_RESPONSE = """
+    INSERT INTO responses (stories_played_id, questions_id, response)
+    VALUES (
+    (SELECT id from stories_played
+        WHERE participant = (?)
+        AND session = (?)
+        AND level = (?)
+        AND story_id = (SELECT id FROM stories WHERE story_name = (?))
+        ORDER BY time DESC
+        LIMIT 1),
+    (SELECT id from questions
+        WHERE story_id = (SELECT id FROM stories WHERE story_name = (?))
+        AND level = (?)
+        AND question_type = (?)
+        AND question_num = (?)),
+    (?))
+    """
+
+def _legacy_record_response(db_man, participant, session, level, story,
+        question_num, question_type, response):
+    """ Record a response the way the database manager did before it
+    kept the ids of the stories played and the questions.
+    """
+    with db_man._lock:
+        db_man._cursor.execute(_LEGACY_RECORD_RESPONSE, (participant, session,
+            level, story, story, level, question_type, question_num,
+            response))
+        db_man._commit_response()
+
+
+def benchmark_response_inserts(trials):
+    """ Compare how many responses per second can be recorded with the
+    old nested-subquery insert and with the current plain insert. Both
+    commit once at the end, so the numbers are about the inserts rather
+    than syncing to disk.
+    """
+    from ss_init_db import create_tables
+    from ss_db_manager import ss_db_manager
+
+    temp_dir = tempfile.mkdtemp()
+    try:
+        for name in ["before (nested subqueries)", "after (cached ids)"]:
+            database = os.path.join(temp_dir, "benchmark.db")
+            for suffix in ["", "-wal", "-shm"]:
+                if os.path.exists(database + suffix):
+                    os.remove(database + suffix)
+            conn = sqlite3.connect(database)
+            create_tables(conn)
+            _fill_benchmark_db(conn, 1000, 10)
+            conn.close()
+
+            db_man = ss_db_manager(database, {"durability": "story"})
+            db_man.record_story_played("p0", 100, 10, "story-7")
+            if name.startswith("before"):
+                record_response = _legacy_record_response
+            else:
+                record_response = ss_db_manager.record_response
+            start = time.time()
+            for i in range(0, trials):
+                record_response(db_man, "p0", 100, 10, "story-7", i % 3 + 1,
+                    "emotion", "sad")
+            db_man.flush()
+            elapsed = time.time() - start
+            db_man.close()
+            print("Response inserts %s: %.0f inserts/s (%d inserts in "
+                "%.3f s)" % (name, trials / elapsed, trials, elapsed))
+    finally:
+        shutil.rmtree(temp_dir)
+
+
+
+def _make_benchmark_workbook(ods, stories, chars):
+    """ Write a story spreadsheet with the given number of stories, laid
+    out like the real ones, with long text in the story and scene
+    description cells.
+    """
+    import pyexcel
+    rand = random.Random(0)
+    text = ("Sam went to the park. " * (chars // 22 + 1))[:chars]
+    book = OrderedDict()
+    for story in range(1, stories + 1):
+        rows = [["Level", "Environment", "Characters", "Target emotions"]
+            + ["Scene " + str(n) + " graphic" for n in range(1, 5)]
+            + ["Scene " + str(n) for n in range(1, 5)]
+            + ["Story", "Question 1", "Question 1 correct,incorrect",
+                "Question 2", "Question 2 correct,incorrect"]]
+        for level in range(1, 11):
+            emotions = rand.sample(_EMOTIONS, 3)
+            rows.append([level, "park", "Sam, Alex", ", ".join(emotions)]
+                + ["a", "b", "c", "d"]
+                + [text] * 4
+                + ["//".join([text] * 4),
+                    "How did Sam feel?", ", ".join(emotions),
+                    "How did Sam feel at the end?", ", ".join(emotions)])
+        book["Story-B" + str(story)] = rows
+    pyexcel.save_book_as(bookdict=book, dest_file_name=ods)
+
+
+def _legacy_read_workbook(ods):
+    """ Read a spreadsheet the way ss_process_story_ods.py did before
+    it streamed sheets: load the whole workbook, then copy every sheet
+    into a dict.
+    """
+    import pyexcel
+    book = pyexcel.get_book(file_name=ods, name_columns_by_row=0)
+    sheets = []
+    for sheet in book:
+        sheet.name_columns_by_row(0)
+        sheets.append((sheet.name, sheet.to_dict()))
+    return sheets
+
+
+def _ingest_child(streaming, ods, results):
+    """ Read and process a spreadsheet in a fresh process, and put the
+    time taken, the peak RSS before starting, and the peak RSS after
+    (in KB) on the results queue.
+    """
+    from ss_process_story_ods import read_workbook, process_story
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.time()
+    if streaming:
+        sheets = read_workbook(ods, False)
+    else:
+        sheets = _legacy_read_workbook(ods)
+    stories = [process_story(name, sheet_dict, False)
+        for name, sheet_dict in sheets]
+    elapsed = time.time() - start
+    results.put((elapsed, baseline,
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss))
+
+
+def benchmark_ingest(stories, chars):
+    """ Compare the time and peak memory used to read and process a
+    large story spreadsheet, reading whole workbooks or streaming
+    sheets.
+    """
+    temp_dir = tempfile.mkdtemp()
+    try:
+        ods = os.path.join(temp_dir, "benchmark.ods")
+        # Write the spreadsheet in its own process, so the memory used
+        # doesn't count toward the measurements.
+        writer = multiprocessing.Process(target=_make_benchmark_workbook,
+            args=(ods, stories, chars))
+        writer.start()
+        writer.join()
+        print("Generated spreadsheet with %d stories: %.1f MB" % (stories,
+            os.path.getsize(ods) / 1e6))
+
+        for name, streaming in [("before (whole workbook)", False),
+                ("after (streaming sheets)", True)]:
+            results = multiprocessing.Queue()
+            child = multiprocessing.Process(target=_ingest_child,
+                args=(streaming, ods, results))
+            child.start()
+            elapsed, baseline, peak = results.get()
+            child.join()
+            print("Ingest %s: %.3f s, peak RSS %.1f MB (%.1f MB more than "
+                "at start)" % (name, elapsed, peak / 1024.0,
+                (peak - baseline) / 1024.0))
+    finally:
+        shutil.rmtree(temp_dir)
+
+
+if __name__ == '__main__':
+    ss_benchmark()
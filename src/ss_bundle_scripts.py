@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+
+# The MIT License (MIT)
+#
+# Copyright (c) 2016 Personal Robots Group
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import argparse # to parse command line arguments
+from ss_script_bundle import build_bundle # packs scripts into a bundle
+
+def ss_bundle_scripts():
+    """ Pack all the game scripts (session scripts, story scripts, and
+    response lists) into a single script bundle file that the game can
+    load scripts from.
+    """
+    # Parse python arguments: The game script directory is required;
+    # the name of the bundle file can be optionally provided.
+    parser = argparse.ArgumentParser(
+            formatter_class=argparse.RawDescriptionHelpFormatter,
+            description="""Packs all the game scripts in a directory (and its
+            sub-directories) into a single script bundle file for the SAR
+            Social Stories game. Set the \"script_bundle\" option in the game
+            config file to load scripts from the bundle. Re-run this after
+            changing any scripts.""")
+    parser.add_argument('script_dir', action='store', nargs='?', type=str,
+            default='../game_scripts/', help="The game script directory. "
+            + "Defaults to \"../game_scripts/\".")
+    parser.add_argument('-o', '--output', dest='bundle', action='store',
+            nargs='?', type=str, default='game_scripts.bundle',
+            help="The bundle filename. Defaults to \"game_scripts.bundle\".")
+
+    # Parse the args we got, and print them out.
+    args = parser.parse_args()
+    print("Args received: " + str(args))
+
+    count = build_bundle(args.script_dir, args.bundle)
+    print("Bundled " + str(count) + " scripts into " + args.bundle)
+
+
+if __name__ == '__main__':
+    ss_bundle_scripts()
@@ -0,0 +1,164 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2016 Personal Robots Group
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import logging # log messages
+import os # for absolute paths
+import sqlite3 # for database errors
+import threading # for locking the catalog cache
+from ss_story_index import ss_story_index # for picking new stories
+
+# The tables that make up the story catalog. They are filled by
+# ss_process_story_ods.py; the game only reads them.
+CATALOG_TABLES = ["stories", "levels", "questions", "responses_in_question",
+    "graphics", "story_hashes"]
+
+class ss_catalog():
+    """ In-memory copy of the static story catalog: the stories, levels,
+    questions, answer options, and graphics tables, which only change
+    when the database is filled with stories. Lookups are answered from
+    dicts instead of SQLite.
+    """
+
+    def __init__(self, conn):
+        """ Load the whole catalog from a database connection. """
+        # The catalog version this copy was loaded from.
+        self.version = get_catalog_version(conn)
+
+        # Story names to ids and back.
+        self.story_ids = {}
+        self.story_names = {}
+        for story_id, name in conn.execute(
+                "SELECT id, story_name FROM stories"):
+            self.story_ids[name] = story_id
+            self.story_names[story_id] = name
+
+        # Levels to (number of answer options, whether scenes are shown
+        # in order).
+        self.levels = {}
+        for level, num_answers, in_order in conn.execute(
+                "SELECT level, num_answers, in_order FROM levels"):
+            self.levels[level] = (num_answers, in_order == 1)
+
+        # (story id, level) to the list of graphics for the scenes, in
+        # the order they were added.
+        self.graphics = {}
+        for story_id, level, graphic in conn.execute("""
+                SELECT story_id, level, graphic
+                FROM graphics
+                ORDER BY rowid"""):
+            self.graphics.setdefault((story_id, level), []).append(graphic)
+
+        # (story id, level, question type, question number) to question
+        # ids, and a list of (question id, story id, level, question
+        # type, target response) for every question.
+        self.question_ids = {}
+        self.questions = []
+        for row in conn.execute("""
+                SELECT id, story_id, level, question_type, question_num,
+                    target_response
+                FROM questions
+                ORDER BY id"""):
+            question_id, story_id, level, question_type, question_num, \
+                target_response = row
+            self.question_ids[(story_id, level, question_type,
+                question_num)] = question_id
+            self.questions.append((question_id, story_id, level,
+                question_type, target_response))
+
+        # Question ids to the answer options shown for that question.
+        self.answer_options = {}
+        for question_id, response in conn.execute("""
+                SELECT questions_id, response
+                FROM responses_in_question
+                ORDER BY rowid"""):
+            self.answer_options.setdefault(question_id, []).append(response)
+
+        # Index for picking new stories.
+        self.story_index = ss_story_index(self)
+
+
+    def get_story_id(self, story):
+        """ Get the id of a story, given its name, or None if there's
+        no story with that name.
+        """
+        return self.story_ids.get(story)
+
+
+    def get_level_info(self, level):
+        """ Get (number of answer options, whether scenes are shown in
+        order) for a level, or None if there's no such level.
+        """
+        return self.levels.get(level)
+
+
+    def get_graphics(self, story, level):
+        """ Get the list of graphics for a story at a level, or None if
+        there are none.
+        """
+        graphics = self.graphics.get((self.get_story_id(story), level))
+        return list(graphics) if graphics else None
+
+
+    def get_question_id(self, story, level, question_type, question_num):
+        """ Get the id of a question about a story, or None if there's
+        no such question.
+        """
+        return self.question_ids.get((self.get_story_id(story), level,
+            question_type, question_num))
+
+
+def get_catalog_version(conn):
+    """ Get the catalog version stamp from a database. It's changed
+    every time the database is filled with stories. A database that
+    hasn't been migrated to have a version stamp is at version 0.
+    """
+    try:
+        return conn.execute("SELECT version FROM catalog_version"
+            ).fetchone()[0]
+    except sqlite3.OperationalError:
+        return 0
+
+
+# Catalogs loaded by this process, keyed by the database's absolute
+# path, so every database manager for the same database shares one.
+_catalogs = {}
+_catalogs_lock = threading.Lock()
+
+def get_catalog(conn, database):
+    """ Get the catalog for a database, loading it if it isn't loaded yet
+    or if the database's catalog version has changed since it was.
+    """
+    logger = logging.getLogger(__name__)
+    # Each in-memory database is different, so don't share catalogs
+    # for them.
+    if database == ":memory:":
+        return ss_catalog(conn)
+    path = os.path.abspath(database)
+    version = get_catalog_version(conn)
+    with _catalogs_lock:
+        catalog = _catalogs.get(path)
+        if catalog is None or catalog.version != version:
+            catalog = ss_catalog(conn)
+            _catalogs[path] = catalog
+            logger.info("Loaded story catalog version " + str(version)
+                + " from " + database + ": " + str(len(catalog.story_ids))
+                + " stories, " + str(len(catalog.questions)) + " questions")
+        return catalog
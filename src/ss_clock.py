@@ -0,0 +1,250 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2016 Personal Robots Group
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import datetime # the time now
+import errno # to tell when a wait was interrupted
+import heapq # timers, in the order they are due
+import itertools # to keep timers that are due together in order
+import logging # log messages
+import os # pipes that wake up waiting threads
+import select # to wait on those pipes
+import threading # timers and locks
+import time # for sleep
+
+# A clock is how the game tells time. The game node, script handler,
+# and ss_ros all use the same clock, so a simulated session can run in
+# virtual time. Each clock has:
+#   now(): get the time now, as a datetime.
+#   utcnow(): get the time now in UTC, as a datetime.
+#   sleep(seconds): wait for some time.
+#   wait(event, seconds): wait until an ss_event (or a threading.Event)
+#       is set or the time runs out. Return whether the event was set.
+#   call_later(seconds, callback): call the callback after some time.
+#       Return a timer with a cancel() method.
+
+
+class ss_real_clock():
+    """ Tells the real time, for playing the game. """
+
+    def now(self):
+        """ Get the time now. """
+        return datetime.datetime.now()
+
+
+    def utcnow(self):
+        """ Get the time now in UTC. """
+        return datetime.datetime.utcnow()
+
+
+    def sleep(self, seconds):
+        """ Wait for some time. """
+        time.sleep(seconds)
+
+
+    def wait(self, event, seconds):
+        """ Wait until the event is set or the time runs out. Return
+        whether the event was set. An ss_event wakes us up as soon as it
+        is set; a threading.Event's timed wait polls, so it may take up
+        to 50ms to notice.
+        """
+        return event.wait(seconds)
+
+
+    def call_later(self, seconds, callback):
+        """ Call the callback on a new thread after some time. The
+        timer's thread isn't a daemon thread: a cancelled Python 2 timer
+        can take up to 50ms to notice, and a daemon thread still running
+        when the interpreter shuts down raises an exception. So we wait
+        for timers when we exit, and timers must be cancelled first.
+        """
+        timer = threading.Timer(seconds, callback)
+        timer.start()
+        return timer
+
+
+class ss_event():
+    """ An event, like threading.Event, that wakes up whoever is waiting
+    for it right away. Python 2 waits on a threading.Event with a
+    timeout by polling with a sleep that backs off to 50ms, and without
+    a timeout, it doesn't handle signals (e.g., Ctrl-C) until the wait
+    ends. So we keep a byte in a pipe while the event is set, and wait
+    for the pipe with select, which wakes up when the byte is written
+    or a signal arrives, and times out without polling.
+    """
+
+    def __init__(self):
+        """ Make an event that isn't set. """
+        self._lock = threading.Lock()
+        self._flag = False
+        self._read, self._write = os.pipe()
+
+
+    def __del__(self):
+        """ Close the pipe. """
+        os.close(self._read)
+        os.close(self._write)
+
+
+    def is_set(self):
+        """ Return whether the event is set. """
+        return self._flag
+
+
+    def set(self):
+        """ Set the event, waking up anyone waiting for it. """
+        with self._lock:
+            if not self._flag:
+                self._flag = True
+                os.write(self._write, b"x")
+
+
+    def clear(self):
+        """ Unset the event. """
+        with self._lock:
+            if self._flag:
+                self._flag = False
+                os.read(self._read, 1)
+
+
+    def wait(self, timeout=None):
+        """ Wait until the event is set, or until timeout seconds (if
+        given) pass. Return whether the event is set.
+        """
+        if timeout is not None:
+            end = time.time() + timeout
+        while not self._flag:
+            remaining = None
+            if timeout is not None:
+                remaining = end - time.time()
+                if remaining <= 0:
+                    break
+            try:
+                select.select([self._read], [], [], remaining)
+            except select.error as e:
+                # A signal interrupted the wait, and its handler didn't
+                # raise an exception, so keep waiting.
+                if e.args[0] != errno.EINTR:
+                    raise
+        return self._flag
+
+
+class ss_virtual_clock():
+    """ Tells virtual time, for simulating sessions faster than they
+    really happen. Time only passes when someone waits on the clock, and
+    then it jumps straight to the next thing that happens: the end of the
+    wait or an earlier timer. Timers run on the thread that is waiting.
+
+    Before time moves, the clock waits until the rest of the simulation
+    has caught up (e.g., until an in-process bus has delivered every
+    message), so whatever would happen in the meantime happens first.
+    Only one thread should wait on the clock at a time, since waits
+    don't overlap in virtual time.
+    """
+
+    def __init__(self, start=None, wait_until_idle=None):
+        """ Start the clock at the given datetime (or now). The clock
+        calls wait_until_idle (if given) before time moves.
+        """
+        self._logger = logging.getLogger(__name__)
+        self._now = start if start is not None else datetime.datetime.now()
+        # How far local time is from UTC, to the nearest minute, so we
+        # can tell virtual time in UTC too.
+        offset = datetime.datetime.now() - datetime.datetime.utcnow()
+        self._utc_offset = datetime.timedelta(
+            minutes=round(offset.total_seconds() / 60))
+        self._wait_until_idle = wait_until_idle
+        self._lock = threading.Lock()
+        # Timers that haven't gone off yet, as (when, order, timer).
+        self._timers = []
+        self._order = itertools.count()
+
+
+    def now(self):
+        """ Get the virtual time now. """
+        with self._lock:
+            return self._now
+
+
+    def utcnow(self):
+        """ Get the virtual time now in UTC. """
+        with self._lock:
+            return self._now - self._utc_offset
+
+
+    def sleep(self, seconds):
+        """ Let some virtual time pass. """
+        self._wait(None, seconds)
+
+
+    def wait(self, event, seconds):
+        """ Wait until the event is set or the virtual time runs out.
+        Return whether the event was set.
+        """
+        return self._wait(event, seconds)
+
+
+    def call_later(self, seconds, callback):
+        """ Call the callback after some virtual time, when someone is
+        waiting on the clock.
+        """
+        timer = _virtual_timer(callback)
+        with self._lock:
+            heapq.heappush(self._timers, (self._now + datetime.timedelta(
+                seconds=max(0, seconds)), next(self._order), timer))
+        return timer
+
+
+    def _wait(self, event, seconds):
+        """ Move time forward, running timers as they come due, until
+        the event is set or the time runs out.
+        """
+        with self._lock:
+            end = self._now + datetime.timedelta(seconds=max(0, seconds))
+        while True:
+            if self._wait_until_idle is not None:
+                self._wait_until_idle()
+            if event is not None and event.is_set():
+                return True
+            with self._lock:
+                if not self._timers or self._timers[0][0] > end:
+                    self._now = max(self._now, end)
+                    return False
+                when, order, timer = heapq.heappop(self._timers)
+                self._now = max(self._now, when)
+            if not timer.cancelled:
+                try:
+                    timer.callback()
+                except Exception:
+                    self._logger.exception("Error in timer callback!")
+
+
+class _virtual_timer():
+    """ A callback waiting for virtual time to pass. """
+
+    def __init__(self, callback):
+        self.callback = callback
+        self.cancelled = False
+
+
+    def cancel(self):
+        """ Don't call the callback. """
+        self.cancelled = True
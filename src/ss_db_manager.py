@@ -22,34 +22,350 @@
 # LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
+import functools # for wrapping methods
 import logging # log messages
+import os # for catalog database paths
+import re # to copy catalog tables into memory
 import sqlite3 # store game info and personalization
+import threading # for the group commit timer
+import time # to time copying the catalog into memory
+import urllib # for catalog database URIs
+from ss_migrate_db import migrate, get_schema_version # keeps schema current
+from ss_migrate_db import SESSION_PERFORMANCE_TRIGGER # for split databases
+from ss_catalog import get_catalog # in-memory copy of the story catalog
+from ss_catalog import get_catalog_version # to tell when the catalog changed
+from ss_catalog import CATALOG_TABLES # tables in a catalog database
+from ss_story_index import story_set # sets of stories for picking stories
+from ss_review_sampler import ss_review_sampler # picks review stories
+from ss_clock import ss_real_clock # tells the time
+
+def _locked(method):
+    """ Hold the database manager's lock while a method runs, so the
+    group commit timer never commits in the middle of a query.
+    """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self._lock:
+            return method(self, *args, **kwargs)
+    return wrapper
+
 
 class ss_db_manager():
     """ Interface to database for storing personalization information. """
 
-    def __init__(self, database):
-        """ Initialize database connection. """
+    # Default database options. These can be overridden with the
+    # "database_options" in the game config file.
+    DEFAULT_OPTIONS = {
+        # SQLite journal mode. In WAL mode, writers don't block readers
+        # and a commit appends to the log instead of rewriting pages.
+        "journal_mode": "wal",
+        # How often SQLite waits for data to reach the disk. In WAL mode,
+        # "normal" only syncs at checkpoints: a commit survives the game
+        # crashing, but may be lost if the computer loses power.
+        "synchronous": "normal",
+        # Size of SQLite's page cache and of the memory-mapped part of
+        # the database. None leaves SQLite's default.
+        "cache_size_kb": None,
+        "mmap_size_mb": None,
+        # When to commit recorded responses: after every write
+        # ("every_write"), when the next story starts or the game ends
+        # ("story"), or within commit_interval seconds and at story
+        # boundaries ("timer"). Stories played are always committed
+        # right away.
+        "durability": "every_write",
+        "commit_interval": 2.0,
+        # Whether to migrate the database to the current schema when we
+        # connect to it.
+        "migrate": True,
+        # Seed for picking review stories at random, so picks can be
+        # reproduced. None seeds from the system.
+        "review_seed": None,
+        # A separate database with the story catalog, made with
+        # ss_init_db.py --catalog. It is opened read-only, and the main
+        # database only holds participant progress. None means the
+        # catalog is in the main database.
+        "catalog_database": None,
+        # Whether to copy the story catalog tables into an in-memory
+        # database when we connect, so queries that join them with
+        # participant progress don't read them from disk. Recorded
+        # progress is still written to the database file.
+        "memory_catalog": False,
+        # Whether the personalization manager records responses from a
+        # writer thread with its own connection (see
+        # ss_response_recorder), so the robot doesn't wait for the
+        # database before reacting to a response, and how many
+        # responses can wait to be written.
+        "write_behind": True,
+        "write_behind_queue_size": 1000
+        }
+
+    # Values we accept for the options that are passed to SQLite.
+    JOURNAL_MODES = ["delete", "truncate", "persist", "memory", "wal", "off"]
+    SYNCHRONOUS = ["off", "normal", "full", "extra"]
+    DURABILITY = ["every_write", "story", "timer"]
+
+    def __init__(self, database, options=None, clock=None):
+        """ Initialize database connection. Stories played are
+        timestamped with the given clock, or with the real time.
+        """
         # Set up logger
         self._logger = logging.getLogger(__name__)
+        self._clock = clock if clock is not None else ss_real_clock()
+
+        # Fill in defaults for any options that weren't given.
+        self._options = dict(self.DEFAULT_OPTIONS)
+        if options is not None:
+            self._options.update(options)
+        if self._options["journal_mode"] not in self.JOURNAL_MODES \
+                or self._options["synchronous"] not in self.SYNCHRONOUS \
+                or self._options["durability"] not in self.DURABILITY:
+            self._logger.error("Invalid database options: " +
+                str(self._options))
+            raise ValueError("Invalid database options: " + str(self._options))
+
+        # The group commit timer commits from another thread, so all use
+        # of the connection is under this lock.
+        self._lock = threading.RLock()
+        # Whether there are recorded responses that aren't committed
+        # yet, and the timer that will commit them.
+        self._pending = False
+        self._commit_timer = None
 
         # Get connection to database.
+        self._database = database
         try:
-            self._conn = sqlite3.connect(database)
+            self._conn = sqlite3.connect(database, check_same_thread=False)
             self._cursor = self._conn.cursor()
+            self._set_pragmas()
         except:
             self._logger.exception("Could not connect to database: " +
                 database)
             # Pass on exception for now.
             raise
+        # The file the story catalog is read from, and which file it was
+        # when we attached it, so we notice when it's replaced.
+        self._catalog_database = database
+        self._catalog_file_id = None
+        # The catalog version copied into memory, if it's copied.
+        self._memory_catalog_version = None
+
+        # Some queries need tables and indexes added by migrations, so
+        # bring the database up to date if it's from an older version.
+        if self._options["migrate"]:
+            try:
+                old_version = get_schema_version(self._conn)
+                new_version = migrate(self._conn)
+                if new_version != old_version:
+                    self._logger.info("Migrated database from schema version "
+                        + str(old_version) + " to " + str(new_version))
+            except:
+                self._logger.exception("Could not migrate database: " +
+                    database)
+                # Pass on exception for now.
+                raise
+
+        if self._options["catalog_database"] is not None:
+            self._catalog_database = os.path.abspath(
+                self._options["catalog_database"])
+            try:
+                self._attach_catalog()
+            except:
+                self._logger.exception("Could not attach catalog database: "
+                    + self._catalog_database)
+                # Pass on exception for now.
+                raise
+
+        # Stories, levels, questions, and graphics only change when the
+        # database is filled with stories, so we look them up in an
+        # in-memory copy of the catalog.
+        self._catalog = None
+        self._refresh_catalog()
+        # Participants to the sets of stories they've played.
+        self._played_stories = {}
+        # (participant, session, level, story id) to the id of the
+        # latest stories_played row for it.
+        self._stories_played_ids = {}
+        # Picks review stories from the stories participants played in
+        # earlier sessions.
+        self._review_sampler = ss_review_sampler(self._options["review_seed"])
 
     def __del__(self):
         """ Destructor. """
         # Close database connection.
+        if hasattr(self, "_conn"):
+            self.close()
+
+
+    def _set_pragmas(self):
+        """ Configure the connection with our database options. """
+        # PRAGMA doesn't take parameters, but the values were checked
+        # against the lists above or are numbers.
+        self._cursor.execute("PRAGMA journal_mode = " +
+            self._options["journal_mode"])
+        self._cursor.execute("PRAGMA synchronous = " +
+            self._options["synchronous"])
+        if self._options["cache_size_kb"] is not None:
+            # Negative sizes are in KB rather than in pages.
+            self._cursor.execute("PRAGMA cache_size = %d" %
+                -int(self._options["cache_size_kb"]))
+        if self._options["mmap_size_mb"] is not None:
+            self._cursor.execute("PRAGMA mmap_size = %d" %
+                (int(self._options["mmap_size_mb"]) * 1024 * 1024))
+
+
+    @_locked
+    def flush(self):
+        """ Commit any recorded responses that aren't committed yet. """
+        if self._commit_timer is not None:
+            self._commit_timer.cancel()
+            self._commit_timer = None
+        if self._pending:
+            self._conn.commit()
+            self._pending = False
+
+
+    @_locked
+    def close(self):
+        """ Commit anything pending and close the database connection.
+        """
+        if self._conn is None:
+            return
+        self.flush()
         self._cursor.close()
         self._conn.close()
+        self._conn = None
 
 
+    def _attach_catalog(self):
+        """ Attach the separate catalog database as "catalog". It's
+        opened read-only and immutable, so SQLite neither locks it nor
+        checks it for changes, and any number of games can share it.
+        That means it must never be changed in place: ss_process_story_ods.py
+        --immutable replaces the file instead, and we attach the new
+        file at the next story boundary.
+        """
+        path = self._catalog_database
+        file_id = self._get_file_id(path)
+        self._cursor.execute("ATTACH DATABASE ? AS catalog", ("file:" +
+            urllib.pathname2url(path) + "?mode=ro&immutable=1",))
+        # If SQLite was built without URI support, it would have treated
+        # the URI as a filename.
+        attached = [row[2] for row in self._cursor.execute(
+            "PRAGMA database_list") if row[1] == "catalog"]
+        if attached != [path]:
+            self._cursor.execute("DETACH DATABASE catalog")
+            raise sqlite3.OperationalError("Could not open " + path
+                + " read-only; does SQLite support URI filenames?")
+        # Table names that aren't qualified with a database are looked
+        # up in the main database first, so it mustn't have its own
+        # catalog tables.
+        for table in CATALOG_TABLES:
+            if self._cursor.execute("SELECT 1 FROM main.sqlite_master WHERE "
+                    + "type = 'table' AND name = (?)", (table,)).fetchone():
+                self._cursor.execute("DETACH DATABASE catalog")
+                raise sqlite3.OperationalError("Database " + self._database
+                    + " has its own " + table + " table, so it can't use a "
+                    + "separate catalog database. Make it with ss_init_db.py "
+                    + "--catalog.")
+        # A trigger stored in the main database can't see the catalog's
+        # questions, so add one for this connection.
+        self._cursor.execute(SESSION_PERFORMANCE_TRIGGER.replace(
+            "CREATE TRIGGER", "CREATE TEMP TRIGGER IF NOT EXISTS", 1))
+        self._catalog_file_id = file_id
+
+
+    def _copy_catalog_to_memory(self, version):
+        """ Copy the story catalog tables, with their indexes, into
+        SQLite's temp database, which is kept in memory. Table names that
+        aren't qualified with a database are looked up in the temp
+        database first, so every query then reads the catalog from
+        memory, while writes to participant progress still go to the
+        database file. The catalog_version table isn't copied, so we can
+        still tell when the catalog on disk changes.
+        """
+        start = time.time()
+        # Creating tables ends any transaction, so commit recorded
+        # responses first.
+        self.flush()
+        source = "main" if self._options["catalog_database"] is None \
+            else "catalog"
+        self._cursor.execute("PRAGMA temp_store = MEMORY")
+        for table in CATALOG_TABLES:
+            self._cursor.execute("DROP TABLE IF EXISTS temp." + table)
+        schema = self._cursor.execute("SELECT type, tbl_name, sql FROM "
+            + source + ".sqlite_master WHERE sql IS NOT NULL AND tbl_name "
+            + "IN (" + ", ".join("?" * len(CATALOG_TABLES)) + ")",
+            CATALOG_TABLES).fetchall()
+        # Fill the tables before indexing them, which is faster.
+        for kind, table, sql in schema:
+            if kind == "table":
+                self._cursor.execute(re.sub(r"^CREATE TABLE",
+                    "CREATE TEMP TABLE", sql))
+                self._cursor.execute("INSERT INTO temp." + table
+                    + " SELECT * FROM " + source + "." + table)
+        for kind, table, sql in schema:
+            if kind == "index":
+                self._cursor.execute(re.sub(r"^CREATE INDEX (IF NOT EXISTS |)",
+                    r"CREATE INDEX \1temp.", sql))
+        self._conn.commit()
+        self._memory_catalog_version = version
+        self._logger.info("Copied story catalog version " + str(version)
+            + " into memory in %.1f ms" % (1000 * (time.time() - start)))
+
+
+    def _get_file_id(self, path):
+        """ Identify the file at a path, so we can tell if it has been
+        replaced.
+        """
+        stat = os.stat(path)
+        return (stat.st_dev, stat.st_ino, stat.st_mtime)
+
+
+    def _refresh_catalog(self):
+        """ Get the in-memory story catalog, reloading it if the
+        catalog in the database changed since it was loaded. We check at
+        story boundaries, so the catalog doesn't change in the middle of
+        a story.
+        """
+        try:
+            if self._catalog_file_id is not None and self._get_file_id(
+                    self._catalog_database) != self._catalog_file_id:
+                # The catalog database was replaced. We can't detach it
+                # in the middle of a transaction.
+                self.flush()
+                self._conn.commit()
+                self._cursor.execute("DETACH DATABASE catalog")
+                self._attach_catalog()
+            if self._options["memory_catalog"]:
+                version = get_catalog_version(self._conn)
+                if version != self._memory_catalog_version:
+                    self._copy_catalog_to_memory(version)
+            self._catalog = get_catalog(self._conn, self._catalog_database)
+        except:
+            self._logger.exception("Could not load the story catalog from "
+                + "the database!")
+            # Pass on exception for now.
+            raise
+
+
+    def _commit_response(self):
+        """ Commit a recorded response now or later, depending on the
+        durability option. Call with the lock held.
+        """
+        durability = self._options["durability"]
+        if durability == "every_write":
+            self._conn.commit()
+            return
+        self._pending = True
+        if durability == "timer" and self._commit_timer is None:
+            self._commit_timer = threading.Timer(
+                self._options["commit_interval"], self.flush)
+            # Don't keep the game running just to commit.
+            self._commit_timer.daemon = True
+            self._commit_timer.start()
+
+
+    @_locked
     def get_most_recent_level(self, participant, current_session):
         """ Get the level at which the participant played during the
         previous session (return None if no previous session).
@@ -83,6 +399,7 @@ class ss_db_manager():
             raise
 
 
+    @_locked
     def get_percent_correct_responses(self, participant, session,
             question_type=None):
         """ Get the percentage of the participant's questions responses
@@ -167,6 +484,44 @@ class ss_db_manager():
             raise
 
 
+    @_locked
+    def get_response_counts(self, participant, sessions):
+        """ Get the number of correct responses and the total number of
+        responses the participant gave in each of the listed sessions,
+        for each type of question, from the session_performance table. Return a dict of
+        session numbers to dicts of question types to (correct, total)
+        tuples. Sessions with no responses are left out.
+        """
+        sessions = list(sessions)
+        if not sessions:
+            return {}
+        try:
+            # The session_performance table is kept up to date as
+            # responses are recorded, so we just look up the counts.
+            # It has no rows for sessions with no responses yet.
+            result = self._cursor.execute("""
+                SELECT session, question_type, correct, total
+                FROM session_performance
+                WHERE participant = (?)
+                    AND session IN (%s)
+                """ % ",".join("?"*len(sessions)),
+                [participant] + sessions).fetchall()
+
+            counts = {}
+            for session, question_type, correct, total in result:
+                if total > 0:
+                    counts.setdefault(session, {})[question_type] = \
+                        (correct or 0, total)
+            return counts
+        except Exception as e:
+            self._logger.exception("Failed when trying to count responses for "
+                + participant + " for sessions " + str(sessions)
+                + " in the database!")
+            # Pass on exception for now.
+            raise
+
+
+    @_locked
     def get_most_recent_incorrect_emotions(self, participant, current_session):
         """ Get a list of the target emotions for all questions from
         the last session where the participant responded incorrectly.
@@ -207,6 +562,7 @@ class ss_db_manager():
             raise
 
 
+    @_locked
     def get_next_new_story(self, participant, emotions, level):
         """ Get the next unplayed story for the desired level from the
         story table with at least one of the listed emotions present in
@@ -216,67 +572,23 @@ class ss_db_manager():
         None.
         """
         try:
-            # Parameters are the list of emotions, participant, session.
-            # We have to put all the parameters into the same list so
-            # we can give the query just one list. We can't supply a
-            # list and a couple other things, because SQLite doesn't
-            # know how to deal with a list parameter. So we add
-            # correct number of ?'s into the query for the number of
-            # emotions and supply a list with a matching number of
-            # parameters.
-            params = []
-            params.append(participant)
-            params = params + list(emotions)
-            params.append(level)
-            params.append(participant)
-
-            # The stories and questions tables should not be empty.
-            # The stories_played table may be empty.
-            # The first half of the query looks for a story with the
-            # specified emotions; the second half looks for any unplayed
-            # story, not caring about emotions.
-            # 0 for the first query and 1 for the second query lets us
-            # order the results by anything found from the first query (the
-            # first half of the union) before anything from the second half.
-            query1 = """
-                SELECT stories.story_name, stories.id, 0 AS found_emotion
-                FROM stories
-                JOIN questions
-                    ON questions.story_id = stories.id
-                LEFT JOIN stories_played
-                    ON stories_played.story_id = stories.id
-                    AND stories_played.participant = (?)
-                WHERE questions.target_response IN (%s)
-                    AND stories_played.participant IS NULL
-                    AND questions.level = (?)
-                """ % ",".join("?"*len(emotions))
-
-            query2 = """
-                SELECT stories.story_name, stories.id, 1 AS found_emotion
-                FROM stories
-                LEFT JOIN stories_played
-                    ON stories_played.story_id = stories.id
-                    AND stories_played.participant = (?)
-                WHERE stories_played.participant IS NULL
-                """
-
-            query = query1 + " UNION " + query2 + """
-                ORDER BY found_emotion, stories.id
-                LIMIT 1 """
+            # The story index finds the unplayed story with the lowest
+            # id that has one of the emotions at this level, or, if
+            # there isn't one, the unplayed story with the lowest id.
+            story_id = self._catalog.story_index.get_first_unplayed(
+                self._get_played_stories(participant), emotions, level)
 
-            result = self._cursor.execute(query, params).fetchone()
-
-            if result is None or result == []:
+            if story_id is None:
                 self._logger.warn("Could not find any unplayed stories for "
                 + participant + " in the database!")
                 return None
 
             # We either found an unplayed story with the right emotions
             # or didn't, and found an unplayed story without them.
-            # Return the name of a new story to play. The DB gives
-            # us the name of the story in a tuple.
-            self._logger.info("Found a story to play: " + str(result[0]))
-            return result[0]
+            # Return the name of a new story to play.
+            story = self._catalog.story_names[story_id]
+            self._logger.info("Found a story to play: " + str(story))
+            return story
 
         except Exception as e:
             self._logger.exception("Failed when trying to find unplayed "
@@ -286,73 +598,55 @@ class ss_db_manager():
             raise
 
 
+    def _get_played_stories(self, participant):
+        """ Get the set of stories (as a bitset; see ss_story_index) the
+        participant has played. It's loaded from the database the first
+        time, then kept up to date as we record stories played. Call
+        with the lock held.
+        """
+        if participant not in self._played_stories:
+            # The stories_played table may be empty.
+            result = self._cursor.execute("""
+                SELECT DISTINCT story_id
+                FROM stories_played
+                WHERE participant = (?)
+                """, (participant,)).fetchall()
+            self._played_stories[participant] = story_set(
+                int(row[0]) for row in result)
+        return self._played_stories[participant]
+
+
+    @_locked
     def get_next_review_story(self, participant, current_session, emotions,
             level):
         """ Get a review story with at least one of the listed emotions
-        present in the story that wasn't played in the current session.
-        If no played stories have the desired emotions, return the
-        name of the story heard least recently and least often. If there
-        are no stories we can review, return None.
+        present in the story that was played in a session other than the
+        current one. If no played stories have the desired emotions,
+        return the name of the story heard least often and least
+        recently. If there are no stories we can review, return None.
         """
         try:
-            # Parameters are the list of emotions, participant, session.
-            # We have to put all the parameters into the same list so
-            # we can give the query just one list. We can't supply a
-            # list and a couple other things, because SQLite doesn't
-            # know how to deal with a list parameter. So we add
-            # correct number of ?'s into the query for the number of
-            # emotions and supply a list with a matching number of
-            # parameters.
-            params = list(emotions)
-            params.append(participant)
-            params.append(current_session)
-            params.append(level)
-
-            # This gives us a randomly picked story from a list of
-            # stories played not this session with at least one of the
-            # desired emotions.
-            # The stories and questions tables should not be empty.
-            # The stories_played table may be empty.
-            result = self._cursor.execute("""
-                SELECT DISTINCT stories.story_name
-                FROM stories
-                JOIN questions
-                    ON questions.story_id = stories.id
-                JOIN stories_played
-                    ON stories_played.story_id = stories.id
-                WHERE questions.target_response IN (%s)
-                AND stories_played.participant = (?)
-                AND stories_played.session <> (?)
-                AND questions.level = (?)
-                ORDER BY RANDOM()
-                LIMIT 1
-                """ % ",".join("?"*len(emotions)), params).fetchone()
+            self._load_review_candidates(participant, current_session)
 
-            if result is None:
+            # This gives us a randomly picked story from the stories
+            # played in other sessions with at least one of the desired
+            # emotions at this level.
+            story_id = self._review_sampler.pick(participant,
+                self._catalog.story_index.get_stories_with_emotions(emotions,
+                level))
+
+            if story_id is None:
                 self._logger.warn("Could not find any stories to review for "
                     + participant + " for session " + str(current_session)
                     + " with emotions " + str(emotions) + " in the database!"
                     + " Looking for a story without those emotions...")
 
                 # If no stories have the desired emotions to review,
-                # find and return the story heard least recently and
-                # least often. Sort results by stories heard least
-                # often, then by the least recent. If there is a tie,
-                # pick the least recent.
-                result = self._cursor.execute("""
-                    SELECT stories.story_name
-                    FROM stories_played
-                    JOIN stories
-                        ON stories_played.story_id = stories.id
-                    WHERE stories_played.participant = (?)
-                    AND stories_played.session <> (?)
-                    GROUP BY stories_played.story_id
-                    ORDER BY count(stories_played.story_id) ASC,
-                        max(stories_played.time) ASC
-                    LIMIT 1
-                    """, (participant, current_session)).fetchone()
-
-                if result is None or result == []:
+                # find the story heard least often, then least recently.
+                story_id = self._review_sampler.get_least_reviewed(
+                    participant, self._catalog.story_index.get_all_stories())
+
+                if story_id is None:
                     self._logger.warn("Could not find any review stories for "
                     + participant + " for session " + str(current_session)
                     + " in the database!")
@@ -361,9 +655,8 @@ class ss_db_manager():
             # We found a review story with the right emotions, or
             # we didn't find any with the right emotions, so we
             # found the story told least often and least recently.
-            # Return the name of a review story to play. The DB
-            # gives us the name of the story in a tuple.
-            return result[0]
+            # Return the name of a review story to play.
+            return self._catalog.story_names[story_id]
 
         except Exception as e:
             self._logger.exception("Failed when trying to find stories to "
@@ -374,26 +667,42 @@ class ss_db_manager():
             raise
 
 
+    def _load_review_candidates(self, participant, current_session):
+        """ Give the review sampler the stories the participant played in
+        sessions other than the current one, if it doesn't have them
+        yet. After that, it's kept up to date as we record stories
+        played. Call with the lock held.
+        """
+        if self._review_sampler.is_loaded(participant, current_session):
+            return
+        # The stories_played table may be empty.
+        result = self._cursor.execute("""
+            SELECT story_id, COUNT(*), MAX(time)
+            FROM stories_played
+            WHERE participant = (?)
+                AND session <> (?)
+            GROUP BY story_id
+            """, (participant, current_session)).fetchall()
+        self._review_sampler.load(participant, current_session,
+            [(int(row[0]), row[1], row[2]) for row in result])
+
+
+    @_locked
     def get_level_info(self, level):
         """ Get information about stories at this level: whether the
         scenes are presented in order or not, and how many answer
         options are shown when questions are asked.
         """
         try:
-            result = self._cursor.execute("""
-                SELECT num_answers, in_order
-                FROM levels
-                WHERE level = (?)
-                """, (level,)).fetchone()
+            result = self._catalog.get_level_info(level)
             if result is None:
                 self._logger.warn("Could not find info for level " + str(level)
                         + " in the database!")
                 return None
             else:
-                # Database gives us a tuple, so return first element as
-                # the number of answers and convert the second element
-                # to a boolean.
-                return result[0], (True if result[1] == 1 else False)
+                # The catalog gives us the number of answers and
+                # whether the scenes are in order as a boolean.
+                return result
         except Exception as e:
             self._logger.exception("Failed when trying to find info for level "
                     + str(level) + " in the database!")
@@ -401,28 +710,20 @@ class ss_db_manager():
             raise
 
 
+    @_locked
     def get_graphics(self, story, level):
         """ Get the list of names of graphics for the scenes in a story
         at the specified level.
         """
         try:
-            result = self._cursor.execute("""
-                SELECT graphic
-                FROM graphics
-                WHERE level = (?)
-                AND story_id = (
-                    SELECT id
-                    FROM stories
-                    WHERE story_name = (?))
-                """, (level, story)).fetchall()
-            if result is None or result == []:
+            result = self._catalog.get_graphics(story, level)
+            if result is None:
                 self._logger.warn("Could not find graphics for story " + story
                     + " at level " + str(level) + " in the database!")
                 return None
             else:
-                # Database gives us a list of tuples of graphic names,
-                # so make this into a list of graphic names.
-                return [name[0] for name in result]
+                # The catalog gives us a list of graphic names.
+                return result
         except Exception as e:
             self._logger.exception("Failed when trying to find graphics for "
                 "story " + story + " at level " + str(level) +
@@ -431,28 +732,46 @@ class ss_db_manager():
             raise
 
 
+    @_locked
     def record_story_played(self, participant, session, level, story):
         """ Insert the participant ID, session number, story level,
         current date and time, and a reference to the current story
-        into the stories_played table.
+        into the stories_played table. Return the id of the new row.
         """
         try:
+            # This is a story boundary, so it's a good time to check
+            # whether the catalog changed.
+            self._refresh_catalog()
+            story_id = self._catalog.get_story_id(story)
+            # Record the time ourselves (in UTC, in the same format as
+            # SQLite's current_timestamp) so the review sampler knows
+            # it too, and so simulated sessions record simulated time.
+            now = self._clock.utcnow().strftime("%Y-%m-%d %H:%M:%S")
             self._cursor.execute("""
                 INSERT INTO stories_played (participant, session,
-                    story_id, level)
-                VALUES (
-                (?),
-                (?),
-                (SELECT id
-                    FROM stories
-                    WHERE story_name = (?)),
-                (?))
-                """, (participant, session, story, level))
-            # Commit after recording the story.
+                    story_id, level, time)
+                VALUES ((?), (?), (?), (?), (?))
+                """, (participant, session, story_id, level, now))
+            # Remember the row, so responses to questions about this
+            # story can refer to it without looking it up.
+            stories_played_id = self._cursor.lastrowid
+            self._stories_played_ids[(participant, session, level,
+                story_id)] = stories_played_id
+            # Keep the participant's played stories and review
+            # candidates up to date.
+            if participant in self._played_stories:
+                self._played_stories[participant] |= story_set([story_id])
+            self._review_sampler.record_play(participant, session, story_id,
+                now)
+            # Commit after recording the story. This is a story
+            # boundary, so any responses waiting for a group commit are
+            # committed too.
+            self.flush()
             self._conn.commit()
             self._logger.debug("Recorded story played: participant=" +
                 participant + ", session=" + str(session) + ", level=" +
                 str(level) + ", story=" + story)
+            return stories_played_id
         except Exception as e:
             self._logger.exception("Could not insert record into stories_played"
                 + " table in database! Tried to insert: participant=" +
@@ -462,40 +781,101 @@ class ss_db_manager():
             raise
 
 
+    def _get_stories_played_id(self, participant, session, level, story_id):
+        """ Get the id of the most recent stories_played row for the
+        participant playing a story. We remember the rows we insert; if
+        the story was recorded by someone else (e.g., before the game
+        restarted), look it up. Call with the lock held.
+        """
+        key = (participant, session, level, story_id)
+        if key not in self._stories_played_ids:
+            result = self._cursor.execute("""
+                SELECT id
+                FROM stories_played
+                WHERE participant = (?)
+                    AND session = (?)
+                    AND level = (?)
+                    AND story_id = (?)
+                ORDER BY time DESC
+                LIMIT 1
+                """, key).fetchone()
+            if result is None:
+                # The insert will fail, since every response has to be
+                # for a story played.
+                return None
+            self._stories_played_ids[key] = result[0]
+        return self._stories_played_ids[key]
+
+
+    @_locked
+    def get_response_ids(self, participant, session, level, story,
+            question_num, question_type):
+        """ Get the ids a response to a question is recorded with: the
+        id of the stories_played row for the story the participant is
+        playing, and the id of the question. Raise a ValueError if either
+        isn't found.
+        """
+        return self._get_response_ids(participant, session, level, story,
+            question_num, question_type)
+
+
+    def _get_response_ids(self, participant, session, level, story,
+            question_num, question_type):
+        """ Get the ids a response to a question is recorded with. Call
+        with the lock held.
+        """
+        stories_played_id = self._get_stories_played_id(participant, session,
+            level, self._catalog.get_story_id(story))
+        question_id = self._catalog.get_question_id(story, level,
+            question_type, question_num)
+        if stories_played_id is None or question_id is None:
+            self._logger.error("Could not find the story played or question "
+                + "for a response: participant=" + participant + ", session="
+                + str(session) + ", level=" + str(level) + ", story=" + story
+                + ", question_num=" + str(question_num) + ", question_type="
+                + question_type)
+            raise ValueError("No story played or question for response to "
+                + story + " question " + str(question_num))
+        return stories_played_id, question_id
+
+
+    @_locked
+    def record_responses(self, responses):
+        """ Insert several user responses into the responses table in
+        one transaction. Each response is (stories_played id, question
+        id, response), as from get_response_ids.
+        """
+        try:
+            self._cursor.executemany("""
+                INSERT INTO responses (stories_played_id, questions_id,
+                    response)
+                VALUES ((?), (?), (?))
+                """, responses)
+            # Commit the responses, now or with the next group commit.
+            self._commit_response()
+        except Exception as e:
+            self._logger.exception("Could not insert records into responses"
+                + " table in database! Tried to insert: " + str(responses))
+            # Pass on exception for now.
+            raise
+
+
+    @_locked
     def record_response(self, participant, session, level, story, question_num,
             question_type, response):
         """ Insert a user response into the responses table: we need
         the question ID, stories_played ID, and the actual response.
         """
         try:
+            # We know both ids already, so this is a plain insert.
             self._cursor.execute("""
                 INSERT INTO responses (stories_played_id, questions_id,
                     response)
-                VALUES (
-                (SELECT id from stories_played
-                    WHERE participant = (?)
-                    AND session = (?)
-                    AND level = (?)
-                    AND story_id = (
-                        SELECT id
-                            FROM stories
-                            WHERE story_name = (?))
-                    ORDER BY time DESC
-                    LIMIT 1),
-                (SELECT id
-                    FROM questions
-                    WHERE question_num = (?)
-                    AND question_type = (?)
-                    AND level = (?)
-                    AND story_id = (
-                        SELECT id
-                        FROM stories
-                        WHERE story_name = (?))),
-                (?))
-                """, (participant, session, level, story, question_num,
-                    question_type, level, story, response))
-            # Commit after recording the response.
-            self._conn.commit()
+                VALUES ((?), (?), (?))
+                """, self._get_response_ids(participant, session, level,
+                    story, question_num, question_type) + (response,))
+            # Commit the response, now or with the next group commit.
+            self._commit_response()
         except Exception as e:
             self._logger.exception("Could not insert record into questions"
                 + " table in database! Tried to insert: participant=" +
@@ -27,14 +27,15 @@
 
 import sys # exit and argv
 import json # for reading config file
-import rospy # ROS
 import argparse # to parse command line arguments
 import signal # catching SIGINT signal
 import logging # log messages
+import logging.config # for reading the log config file
 import Queue # for getting messages from ROS callback threads
-import datetime # for getting time deltas for timeouts
 from ss_script_handler import ss_script_handler # plays back script lines
 from ss_ros import ss_ros # we put all our ROS stuff here
+from ss_script_cache import get_script_cache # caches scripts we load
+from ss_clock import ss_real_clock # tells the time
 
 class ss_game_node():
     """ The SAR social stories main game node orchestrates the game: what the
@@ -44,29 +45,39 @@ class ss_game_node():
     This node sends ROS messages to a SAR Opal game via a rosbridge_server
     websocket connection, and uses ROS to exchange messages with other relevant
     nodes (such as the node that translates robot commands to specific robot
-    platforms).
+    platforms). Given another transport, such as an in-process bus, it runs
+    without ROS; given a virtual clock, it runs in virtual time.
     """
-    # Initialize the ROS node.
-    # TODO If running on network where DNS does not resolve local
-    # hostnames, get the public IP address of this machine and
-    # export to the environment variable $ROS_IP to set the public
-    # address of this node, so the user doesn't have to remember
-    # to do this before starting the node.
-    _ros_node = rospy.init_node('social_story_game', anonymous=True)
-            # We could set the ROS log level here if we want:
-            #log_level=rospy.DEBUG)
-            # The rest of our logging is set up in the log config file.
-
-
-    def __init__(self):
-        """ Initialize anything that needs initialization """
+    # How often to log that we are waiting for a command while the game
+    # hasn't started or is paused (in seconds).
+    STATUS_LOG_INTERVAL = 5
+    # Put on the queue, with the timer that put it there, to wake up the
+    # game loop when it's time to print the periodic status message.
+    STATUS_TICK = "STATUS_TICK"
+
+
+    def __init__(self, transport=None, log_config="ss_log_config.json",
+            clock=None):
+        """ Initialize anything that needs initialization. We use ROS
+        (starting our ROS node when the game launches) unless we are given
+        another transport, and the real time unless we are given another
+        clock. If the log config file is None, whoever runs us has set up
+        logging.
+        """
         # Set up queue that we use to get messages from ROS callbacks.
         self._queue = Queue.Queue()
+        self._transport = transport
+        self._clock = clock if clock is not None else ss_real_clock()
+        # Timer that puts a status tick on the queue while the game
+        # loop waits for a command.
+        self._status_timer = None
         # Set up logger.
         self._logger = logging.getLogger(__name__)
+        if log_config is None:
+            return
         # Configure logging.
         try:
-            config_file = "ss_log_config.json"
+            config_file = log_config
             with open(config_file) as json_file:
                 json_data = json.load(json_file)
                 logging.config.dictConfig(json_data)
@@ -130,9 +141,6 @@ class ss_game_node():
         self._logger.info("\n==============================\nSOCIAL STORIES " +
             "GAME\nSession: %s, Participant ID: %s", session, participant)
 
-        # Set up ROS node publishers and subscribers.
-        self._ros_ss = ss_ros(self._queue)
-
         # Read config file to get relative file path to game scripts.
         try:
             config_file = "ss_config.demo.json" if participant == "DEMO" \
@@ -180,161 +188,247 @@ class ss_game_node():
                         \"percent_correct_to_level\" to be in the config file.
                         Defaulting to 75%.""")
                     percent_correct_to_level = 0.75
+                # The script cache size is optional; if it isn't set,
+                # the cache uses its default size.
+                if ("script_cache_kb") in json_data:
+                    get_script_cache().set_max_size(
+                            int(json_data["script_cache_kb"]) * 1024)
+                # The script bundle is optional; if it isn't set, we
+                # read scripts from the game script directory.
+                if ("script_bundle") in json_data:
+                    script_bundle = json_data["script_bundle"]
+                else:
+                    script_bundle = None
+                # Database options are optional; any that aren't set
+                # use the database manager's defaults.
+                if ("database_options") in json_data:
+                    database_options = json_data["database_options"]
+                else:
+                    database_options = None
+                # Whether the Opal game takes batches of objects to load
+                # is optional; only newer versions do, so we don't batch
+                # unless told to.
+                if ("batch_opal_loads") in json_data:
+                    batch_opal_loads = json_data["batch_opal_loads"]
+                else:
+                    batch_opal_loads = False
         except Exception as e:
             self._logger.exception("Could not read your json config file \""
                 + config_file + "\". Does the file exist? Is it valid json?"
                 + " Exiting because we need the config file to run the game.")
             return
 
+        # Set up ROS node publishers and subscribers.
+        self._ros_ss = ss_ros(self._queue, batch_opal_loads, self._transport,
+                self._clock)
+
         # Load script.
         try:
             script_handler = ss_script_handler(self._ros_ss, session,
                 participant, script_path, story_script_path,
                 session_script_path, database, self._queue,
-                percent_correct_to_level)
+                percent_correct_to_level, script_bundle, database_options,
+                self._clock)
         except IOError as e:
             self._logger.exception("Did not load the session script... exiting "
                 + "because we need the session script to run the game.")
             return
-        else:
-            # Flag to indicate whether we should exit.
-            self._stop = False
-
-            # Flags for game control.
-            started = False
-            paused = False
-            log_timer = datetime.datetime.now()
 
-            # Set up signal handler to catch SIGINT (e.g., ctrl-c).
-            signal.signal(signal.SIGINT, self._signal_handler)
+        # Set up signal handler to catch SIGINT (e.g., ctrl-c).
+        signal.signal(signal.SIGINT, self._signal_handler)
 
-            # Ready to start the game. Send a "READY" message.
-            self._logger.info("Ready to start!")
-            self._ros_ss.send_game_state("READY")
+        # Ready to start the game. Send a "READY" message.
+        self._logger.info("Ready to start!")
+        self._ros_ss.send_game_state("READY")
 
-            while (not self._stop):
+        # Play the game until the script is done or we are told to stop.
+        # Whatever happens, make sure the participant's progress is
+        # saved.
+        try:
+            self.run_game(script_handler)
+        finally:
+            self._cancel_status_timer()
+            script_handler.close()
+        self._logger.info("Script cache stats: %s",
+                get_script_cache().get_stats())
+
+        # TODO wait after exiting this loop for the main
+        # SessionManager to close the process??
+
+
+    def run_game(self, script_handler):
+        """ Main game loop: act on game commands from the queue and
+        iterate over the script. Before the game starts and while it is
+        paused, there is nothing to do until a command arrives, so we
+        block on the queue rather than spinning. Anything that puts a
+        message on the queue (ROS callbacks, the script handler) wakes
+        the loop up, as does a timer that ticks when it's time to print
+        the periodic status message. (We don't give the queue a timeout
+        instead, because Python 2 waits with a timeout by polling, which
+        would delay acting on each command by up to 50ms.)
+        """
+        # Flag to indicate whether we should exit.
+        self._stop = False
+
+        # Flags for game control.
+        started = False
+        paused = False
+
+        while (not self._stop):
+            try:
+                if (not started or paused) and self._status_timer is None:
+                    self._status_timer = self._start_status_timer()
+                elif started and not paused:
+                    self._cancel_status_timer()
                 try:
-                    try:
-                        # Get data from queue if any is there, but don't
-                        # wait if there isn't.
+                    if started and not paused:
+                        # We are playing the script, so get data from
+                        # the queue if any is there, but don't wait if
+                        # there isn't.
                         msg = self._queue.get(False)
-                    except Queue.Empty:
-                        # no data yet!
-                        pass
                     else:
-                        # Got a message! Parse:
-                        # Wait for START command before starting to
-                        # iterate over the script.
-                        if "START" in msg and not started:
-                            self._logger.info("Starting game!")
-                            # Pass on the start level, if it was given.
-                            msg_parts = msg.split("\t")
-                            if len(msg_parts) > 1:
-                                try:
-                                    script_handler.set_start_level(
-                                        int(msg_parts[1]))
-                                    self._logger.info("Got start level: "
-                                        + msg_parts[1])
-                                except ValueError:
-                                    self._logger.warning("Was given a start " +
-                                        "level that wasn't an int! "
-                                        + msg_parts[1])
-                            started = True
-                            # Announce the game is starting.
-                            self._ros_ss.send_game_state("START")
-                            self._ros_ss.send_game_state("IN_PROGRESS")
+                        # Wait for a command, or for the status tick.
+                        # Python 2 handles signals only once the wait
+                        # ends, so the tick also means we act on Ctrl-C
+                        # within STATUS_LOG_INTERVAL seconds.
+                        msg = self._queue.get()
+                except Queue.Empty:
+                    # no data yet!
+                    pass
+                else:
+                    # Got a message! Parse:
+                    # Print a log message periodically stating that
+                    # we are waiting for a command to continue. (A tick
+                    # from a timer we cancelled may still arrive after
+                    # we've started another; ignore it.)
+                    if isinstance(msg, tuple) and msg[0] == self.STATUS_TICK:
+                        if msg[1] is self._status_timer:
+                            self._status_timer = None
+                            if paused:
+                                self._logger.info("Game paused... waiting "
+                                    + "for command to continue or skip "
+                                    + "response.")
+                            else:
+                                self._logger.info("Waiting for command to "
+                                    + "start.")
 
-                        # If we get a PAUSE command, pause iteration over
-                        # the script.
-                        elif "PAUSE" in msg and not paused:
-                            self._logger.info("Game paused!")
-                            log_timer = datetime.datetime.now()
-                            paused = True
-                            script_handler.pause_game_timer()
-                            # Announce the game is pausing.
-                            self._ros_ss.send_game_state("PAUSE")
-
-                        # If we are paused and get a CONTINUE command,
-                        # we can resume iterating over the script. If
-                        # we're not paused, ignore.
-                        elif "CONTINUE" in msg and paused:
-                            self._logger.info("Resuming game!")
+                    # Wait for START command before starting to
+                    # iterate over the script.
+                    elif "START" in msg and not started:
+                        self._logger.info("Starting game!")
+                        # Pass on the start level, if it was given.
+                        msg_parts = msg.split("\t")
+                        if len(msg_parts) > 1:
+                            try:
+                                script_handler.set_start_level(
+                                    int(msg_parts[1]))
+                                self._logger.info("Got start level: "
+                                    + msg_parts[1])
+                            except ValueError:
+                                self._logger.warning("Was given a start " +
+                                    "level that wasn't an int! "
+                                    + msg_parts[1])
+                        started = True
+                        # Announce the game is starting.
+                        self._ros_ss.send_game_state("START")
+                        self._ros_ss.send_game_state("IN_PROGRESS")
+
+                    # If we get a PAUSE command, pause iteration over
+                    # the script.
+                    elif "PAUSE" in msg and not paused:
+                        self._logger.info("Game paused!")
+                        paused = True
+                        script_handler.pause_game_timer()
+                        # Announce the game is pausing.
+                        self._ros_ss.send_game_state("PAUSE")
+
+                    # If we are paused and get a CONTINUE command,
+                    # we can resume iterating over the script. If
+                    # we're not paused, ignore.
+                    elif "CONTINUE" in msg and paused:
+                        self._logger.info("Resuming game!")
+                        paused = False
+                        script_handler.resume_game_timer()
+                        # Announce the game is resuming.
+                        self._ros_ss.send_game_state("IN_PROGRESS")
+
+                    # When we receive an END command, we need to
+                    # exit gracefully. Stop all repeating scripts
+                    # and story scripts, go directly to the end.
+                    elif "END" in msg and started:
+                        self._logger.info("Ending game!")
+                        script_handler.set_end_game()
+
+                    # When we receive a WAIT_FOR_RESPONSE command,
+                    # we can unpause the game, but go directly to
+                    # waiting for a user response rather than
+                    # reading the next script line.
+                    elif "WAIT_FOR_RESPONSE" in msg and started:
+                        self._logger.info("Waiting for user response!")
+                        if (script_handler. \
+                            wait_for_last_response_again()):
+                            # If we get a response, we can unpause
+                            # (but we may not have been paused).
                             paused = False
                             script_handler.resume_game_timer()
                             # Announce the game is resuming.
                             self._ros_ss.send_game_state("IN_PROGRESS")
+                        else:
+                            # We timed out again, don't resume.
+                            self._logger.info("Did not get response!")
+
+                    # When we receive a SKIP_RESPONSE command, we
+                    # unpause the game, and instead of waiting for
+                    # user response, we skip waiting, and continue
+                    # with the next script line.
+                    elif "SKIP_RESPONSE" in msg and started:
+                        self._logger.info("Skipping waiting for user " +
+                            "response!")
+                        # Treat the skipped response as a NO or as
+                        # INCORRECT, then let the game resume play
+                        # normally.
+                        script_handler.skip_wait_for_response()
+                        # Unpause and continue the game.
+                        paused = False
+                        script_handler.resume_game_timer()
+                        # Announce the game is resuming.
+                        self._ros_ss.send_game_state("IN_PROGRESS")
+
+                # If the game has been started and is not paused,
+                # parse and handle the next script line.
+                if started and not paused:
+                    script_handler.iterate_once()
+
+            except StopIteration as e:
+                self._logger.info("Finished script!")
+                # Send message to announce the game is over.
+                if "performance" in dir(e):
+                    self._ros_ss.send_game_state("END", e.performance)
+                else:
+                    self._ros_ss.send_game_state("END")
+                break
 
-                        # When we receive an END command, we need to
-                        # exit gracefully. Stop all repeating scripts
-                        # and story scripts, go directly to the end.
-                        elif "END" in msg and started:
-                            self._logger.info("Ending game!")
-                            script_handler.set_end_game()
-
-                        # When we receive a WAIT_FOR_RESPONSE command,
-                        # we can unpause the game, but go directly to
-                        # waiting for a user response rather than
-                        # reading the next script line.
-                        elif "WAIT_FOR_RESPONSE" in msg and started:
-                            self._logger.info("Waiting for user response!")
-                            if (script_handler. \
-                                wait_for_last_response_again()):
-                                # If we get a response, we can unpause
-                                # (but we may not have been paused).
-                                paused = False
-                                script_handler.resume_game_timer()
-                                # Announce the game is resuming.
-                                self._ros_ss.send_game_state("IN_PROGRESS")
-                            else:
-                                # We timed out again, don't resume.
-                                self._logger.info("Did not get response!")
-
-                        # When we receive a SKIP_RESPONSE command, we
-                        # unpause the game, and instead of waiting for
-                        # user response, we skip waiting, and continue
-                        # with the next script line.
-                        elif "SKIP_RESPONSE" in msg and started:
-                            self._logger.info("Skipping waiting for user " +
-                                "response!")
-                            # Treat the skipped response as a NO or as
-                            # INCORRECT, then let the game resume play
-                            # normally.
-                            script_handler.skip_wait_for_response()
-                            # Unpause and continue the game.
-                            paused = False
-                            script_handler.resume_game_timer()
-                            # Announce the game is resuming.
-                            self._ros_ss.send_game_state("IN_PROGRESS")
+        self._cancel_status_timer()
 
-                    # If the game has been started and is not paused,
-                    # parse and handle the next script line.
-                    if started and not paused:
-                        script_handler.iterate_once()
 
-                    elif not started or paused:
-                        # Print a log message periodically stating that
-                        # we are waiting for a command to continue.
-                        if (datetime.datetime.now() - log_timer > \
-                                datetime.timedelta(seconds=int(5))):
-                            if paused:
-                                self._logger.info("Game paused... waiting for "
-                                + "command to continue or skip response.")
-                            elif not started:
-                                self._logger.info("Waiting for command to "
-                                    + "start.")
-                            log_timer = datetime.datetime.now()
+    def _start_status_timer(self):
+        """ Start a timer that puts a status tick on the queue, tagged
+        with the timer, so we can tell ticks from cancelled timers apart.
+        Return the timer.
+        """
+        timer = []
+        timer.append(self._clock.call_later(self.STATUS_LOG_INTERVAL,
+            lambda: self._queue.put((self.STATUS_TICK, timer[0]))))
+        return timer[0]
 
-                except StopIteration as e:
-                    self._logger.info("Finished script!")
-                    # Send message to announce the game is over.
-                    if "performance" in dir(e):
-                        self._ros_ss.send_game_state("END", e.performance)
-                    else:
-                        self._ros_ss.send_game_state("END")
-                    break
 
-            # TODO wait after exiting this loop for the main
-            # SessionManager to close the process??
+    def _cancel_status_timer(self):
+        """ Stop the timer for the periodic status message, if it's
+        running.
+        """
+        if self._status_timer is not None:
+            self._status_timer.cancel()
+            self._status_timer = None
 
 
     def _signal_handler(self, sig, frame):
@@ -342,10 +436,14 @@ class ss_game_node():
         if sig == signal.SIGINT:
             self._logger.info("Got keyboard interrupt! Exiting.")
             self._stop = True
+            # exit() raises SystemExit, so launch_game closes the script
+            # handler on the way out, which writes any responses that
+            # are still queued.
             exit("Interrupted by user.")
 
 
 if __name__ == '__main__':
+    import rospy # ROS
     # Try launching the game!
     try:
         game_node = ss_game_node()
@@ -354,6 +452,6 @@ if __name__ == '__main__':
 
     # If roscore isn't running or shuts down unexpectedly...
     except rospy.ROSInterruptException:
-        self._logger.exception('ROS node shutdown')
+        logging.getLogger(__name__).exception('ROS node shutdown')
         pass
 
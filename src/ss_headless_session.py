@@ -0,0 +1,388 @@
+#!/usr/bin/env python
+
+# The MIT License (MIT)
+#
+# Copyright (c) 2016 Personal Robots Group
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import argparse # to parse command line arguments
+import json # Opal command properties
+import logging # log messages
+import random # the simulated child's answers
+import threading # for locks and events
+import time # to time the session
+from ss_game_node import ss_game_node # runs the game
+from ss_transport import ss_local_transport # in-process messages
+from ss_clock import ss_real_clock, ss_virtual_clock # real or virtual time
+
+class ss_simulated_session():
+    """ Plays everyone but the game in a session, over an in-process
+    bus: the game command node that starts the game, the Opal game on
+    the tablet, the child touching the tablet, and the robot.
+
+    The child answers when there is a question (set up with SET_CORRECT)
+    or a start button on the tablet and the robot isn't speaking, e.g.,
+    once the robot has finished asking about it. Each topic's messages
+    arrive on their own thread, so the robot may finish asking before
+    the question reaches the tablet; the child answers whichever comes
+    last. If the game doesn't react to a touch, the child touches again,
+    since the touch may have come before the game started waiting for
+    it. The child and the robot take their time on the game's clock.
+    """
+
+    def __init__(self, transport, correct_rate=0.75, response_seconds=0.05,
+            retry_seconds=0.5, seconds_per_word=0, seed=None, clock=None):
+        """ Subscribe to the game's messages. """
+        self._logger = logging.getLogger(__name__)
+        self._transport = transport
+        self._clock = clock if clock is not None else ss_real_clock()
+        self._correct_rate = correct_rate
+        self._response_seconds = response_seconds
+        self._retry_seconds = retry_seconds
+        self._seconds_per_word = seconds_per_word
+        self._random = random.Random(seed)
+
+        # What is on the tablet that the child can touch: the names of
+        # the correct and incorrect answers to the current question, and
+        # whether there is a start button.
+        self._lock = threading.Lock()
+        self._answers = None
+        self._start_button = False
+        # How many things the robot is in the middle of saying. The
+        # child waits until the robot is done before touching anything.
+        self._robot_speaking = 0
+        # The last touch, until the game reacts to it, and the timer for
+        # the next touch.
+        self._touch = None
+        self._timer = None
+        self._closed = False
+        self.finished = threading.Event()
+
+        # Counters for the session summary.
+        self.stats = {"opal_commands": 0, "robot_commands": 0,
+            "game_states": 0, "start_touches": 0, "correct_touches": 0,
+            "incorrect_touches": 0, "repeated_touches": 0, "timeouts": 0,
+            "performance": None}
+        self._timed_out = False
+
+        self._action_pub = transport.publisher('/sar/opal_action',
+            transport.OpalAction)
+        self._robot_state_pub = transport.publisher('/sar/robot_state',
+            transport.RobotState)
+        self._game_command_pub = transport.publisher('/sar/game_command',
+            transport.GameCommand)
+        transport.subscribe('/sar/opal_command', transport.OpalCommand,
+            self.on_opal_command_msg)
+        transport.subscribe('/sar/robot_command', transport.RobotCommand,
+            self.on_robot_command_msg)
+        transport.subscribe('/sar/game_state', transport.GameState,
+            self.on_game_state_msg)
+
+
+    def close(self):
+        """ Stop touching the tablet. """
+        with self._lock:
+            self._closed = True
+            self._cancel_timer()
+
+
+    def on_game_state_msg(self, msg):
+        """ Act as the game command node: start the game when it is
+        ready, skip responses the child never gave, and note when the
+        game ends.
+        """
+        GameState = self._transport.GameState
+        self.stats["game_states"] += 1
+        if msg.state == GameState.READY:
+            self._send_game_command(self._transport.GameCommand.START)
+        elif msg.state == GameState.USER_TIMEOUT:
+            # The game pauses itself after it times out, and says so in
+            # its next game state message. Skip the response then, so we
+            # don't get to the game before its own pause does.
+            self.stats["timeouts"] += 1
+            self._timed_out = True
+        elif msg.state == GameState.END:
+            self.stats["performance"] = msg.performance
+            self.finished.set()
+        elif self._timed_out:
+            self._timed_out = False
+            self._send_game_command(self._transport.GameCommand.SKIP_RESPONSE)
+
+
+    def on_opal_command_msg(self, msg):
+        """ Act as the Opal game: keep track of the question being asked
+        and whether there is a start button to touch.
+        """
+        OpalCommand = self._transport.OpalCommand
+        self.stats["opal_commands"] += 1
+        with self._lock:
+            self._game_reacted()
+            if msg.command == OpalCommand.LOAD_OBJECT:
+                objects = json.loads(msg.properties)
+                if not isinstance(objects, list):
+                    objects = [objects]
+                if any("start" in obj.get("name", "").lower()
+                        for obj in objects):
+                    self._start_button = True
+            elif msg.command == OpalCommand.SET_CORRECT:
+                self._answers = json.loads(msg.properties)
+            elif msg.command == OpalCommand.CLEAR:
+                # Clearing with no properties clears everything;
+                # otherwise, only answers are cleared.
+                self._answers = None
+                if not msg.properties:
+                    self._start_button = False
+            self._touch_if_ready()
+
+
+    def on_robot_command_msg(self, msg):
+        """ Act as the robot: say whatever we're told to, taking a while
+        to say it if we were given how long each word takes. Once the
+        robot is done, the child can answer what the robot asked.
+        """
+        RobotState = self._transport.RobotState
+        self.stats["robot_commands"] += 1
+        with self._lock:
+            self._game_reacted()
+            if msg.command == self._transport.RobotCommand.DO:
+                self._robot_speaking += 1
+            else:
+                self._touch_if_ready()
+        if msg.command != self._transport.RobotCommand.DO:
+            return
+        self._robot_state_pub.publish(RobotState(is_playing_sound=True))
+        if self._seconds_per_word:
+            self._clock.call_later(self._seconds_per_word
+                * len(msg.properties.split()), self._on_robot_done)
+        else:
+            self._on_robot_done()
+
+
+    def _on_robot_done(self):
+        """ The robot has finished speaking. """
+        with self._lock:
+            self._robot_speaking -= 1
+        self._robot_state_pub.publish(
+            self._transport.RobotState(is_playing_sound=False))
+        with self._lock:
+            self._touch_if_ready()
+
+
+    def _touch_if_ready(self):
+        """ If there is something to touch, the robot isn't speaking,
+        and the child isn't about to touch something already, touch it
+        after a while. Call with the lock held.
+        """
+        if self._timer is None and self._touch is None \
+                and not self._robot_speaking \
+                and (self._answers or self._start_button):
+            self._schedule_touch(self._response_seconds)
+
+
+    def _game_reacted(self):
+        """ The game sent a command, so it is done waiting for whatever
+        the child last touched. A correct answer or the start button
+        is done with; after an incorrect answer, the child tries again
+        once the robot has finished responding.
+        """
+        if self._touch is not None:
+            if self._touch.message == "CORRECT":
+                self._answers = None
+            elif self._touch.message == "START":
+                self._start_button = False
+            self._touch = None
+        self._cancel_timer()
+
+
+    def _schedule_touch(self, seconds):
+        """ Touch the tablet after a while. """
+        self._cancel_timer()
+        if not self._closed:
+            timer = self._clock.call_later(seconds,
+                lambda: self._on_timer(timer))
+            self._timer = timer
+
+
+    def _cancel_timer(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+
+    def _on_timer(self, timer):
+        """ Touch the start button or an answer, or touch the same thing
+        again if the game didn't react to the last touch.
+        """
+        with self._lock:
+            # A real timer can go off just as it's cancelled, so make
+            # sure this is still the timer we're waiting for.
+            if timer is not self._timer:
+                return
+            self._timer = None
+            if self._closed or self._robot_speaking:
+                return
+            if self._touch is not None:
+                self.stats["repeated_touches"] += 1
+            elif self._start_button:
+                self._touch = self._transport.OpalAction(action="press",
+                    message="START", objectName="start_button")
+                self.stats["start_touches"] += 1
+            elif self._answers:
+                correct = self._answers.get("correct", [])
+                incorrect = self._answers.get("incorrect", [])
+                if correct and (not incorrect or self._random.random() <
+                        self._correct_rate):
+                    self._touch = self._transport.OpalAction(action="press",
+                        message="CORRECT",
+                        objectName=self._random.choice(correct))
+                    self.stats["correct_touches"] += 1
+                elif incorrect:
+                    self._touch = self._transport.OpalAction(action="press",
+                        message="INCORRECT",
+                        objectName=self._random.choice(incorrect))
+                    self.stats["incorrect_touches"] += 1
+            if self._touch is None:
+                return
+            self._touch.header.stamp = self._transport.now()
+            self._action_pub.publish(self._touch)
+            self._schedule_touch(self._retry_seconds)
+
+
+    def _send_game_command(self, command):
+        """ Send a game command to the game. """
+        GameCommand = self._transport.GameCommand
+        msg = GameCommand(game=GameCommand.STORYTELLING, command=command)
+        msg.header.stamp = self._transport.now()
+        self._game_command_pub.publish(msg)
+
+
+def run_session(session, participant, virtual_time=False, correct_rate=0.75,
+        response_seconds=0.05, seconds_per_word=0, seed=None):
+    """ Run a whole game session without ROS, with the game command
+    node, the tablet, the child, and the robot simulated in this process,
+    in real or virtual time. Return whether the session finished, how
+    long it took in real time and on the game's clock (in seconds), and
+    the simulation's counters. A seed seeds the game's own random picks
+    (e.g., of robot responses) as well as the child's answers, so a
+    session in virtual time plays out the same way each time.
+    """
+    if seed is not None:
+        random.seed(seed)
+    transport = ss_local_transport()
+    if virtual_time:
+        clock = ss_virtual_clock(wait_until_idle=transport.bus.wait_until_idle)
+    else:
+        clock = ss_real_clock()
+    simulation = ss_simulated_session(transport, correct_rate,
+        response_seconds, seconds_per_word=seconds_per_word, seed=seed,
+        clock=clock)
+    game_node = ss_game_node(transport, log_config=None, clock=clock)
+    start = time.time()
+    clock_start = clock.now()
+    try:
+        game_node.launch_game(session, participant)
+    finally:
+        simulation.close()
+        transport.bus.close()
+    return (simulation.finished.is_set(), time.time() - start,
+        (clock.now() - clock_start).total_seconds(), simulation.stats)
+
+
+def ss_headless_session():
+    """ Run game sessions without ROS, with the tablet, the child, and
+    the robot simulated in this process, and print a summary.
+    """
+    parser = argparse.ArgumentParser(
+            formatter_class=argparse.RawDescriptionHelpFormatter,
+            description="""Run a SAR Social Stories game session headless:
+            the game runs as it does with ROS, but its messages go over an
+            in-process bus to a simulated tablet, child, and robot, so it
+            doesn't need roscore or the sar_* message packages. Uses the
+            same config files, scripts, and database as the game node. In
+            virtual time, sessions run as fast as the game can go.""")
+    parser.add_argument('session', action='store', nargs='?', type=int,
+            default=-1, help="The session to play. Defaults to -1, the "
+            + "demo session.")
+    parser.add_argument('participant', action='store', nargs='?', type=str,
+            default='DEMO', help="The participant playing. Defaults to "
+            + "DEMO.")
+    parser.add_argument('-t', '--virtual_time', dest='virtual_time',
+            action='store_true', default=False, help="Run in virtual time "
+            + "instead of real time.")
+    parser.add_argument('-n', '--runs', dest='runs', action='store',
+            type=int, default=1, help="Number of times to run the session. "
+            + "Defaults to 1.")
+    parser.add_argument('-c', '--correct', dest='correct', action='store',
+            type=float, default=0.75, help="Chance that the simulated child "
+            + "answers a question correctly. Defaults to 0.75.")
+    parser.add_argument('-r', '--response_seconds', dest='response_seconds',
+            action='store', type=float, default=0.05, help="Seconds the "
+            + "simulated child takes to answer. Defaults to 0.05.")
+    parser.add_argument('-w', '--seconds_per_word', dest='seconds_per_word',
+            action='store', type=float, default=0, help="Seconds the "
+            + "simulated robot takes to say each word. Defaults to 0.")
+    parser.add_argument('-s', '--seed', dest='seed', action='store',
+            type=int, default=None, help="Random seed for the simulated "
+            + "child's answers and the game's random picks. Each run after "
+            + "the first adds one to it.")
+    parser.add_argument('-v', '--verbose', dest='verbose',
+            action='store_true', default=False, help="Log what the game "
+            + "does to the console.")
+
+    # Parse the args we got, and print them out.
+    args = parser.parse_args()
+    print("Args received: " + str(args))
+    if args.session <= 0 or args.participant.lower() == "demo":
+        session, participant = -1, "DEMO"
+    else:
+        session, participant = args.session, args.participant
+
+    logging.basicConfig(level=logging.INFO if args.verbose else
+            logging.WARNING)
+
+    finished = 0
+    real_seconds = 0
+    game_seconds = 0
+    totals = {}
+    for run in range(0, args.runs):
+        seed = args.seed + run if args.seed is not None else None
+        done, real, game, stats = run_session(session, participant,
+            args.virtual_time, args.correct, args.response_seconds,
+            args.seconds_per_word, seed)
+        finished += 1 if done else 0
+        real_seconds += real
+        game_seconds += game
+        print("Session " + ("finished" if done else "did not finish")
+            + " in %.3f s (%.3f s of game time)" % (real, game))
+        for name in sorted(stats):
+            print("    " + name + ": " + str(stats[name]))
+            if name != "performance":
+                totals[name] = totals.get(name, 0) + stats[name]
+
+    if args.runs > 1:
+        print("%d of %d sessions finished in %.3f s (%.3f s of game time, "
+            "%.0fx real time)" % (finished, args.runs, real_seconds,
+            game_seconds, game_seconds / max(real_seconds, 1e-9)))
+        for name in sorted(totals):
+            print("    total " + name + ": " + str(totals[name]))
+
+
+if __name__ == '__main__':
+    ss_headless_session()
@@ -27,6 +27,8 @@
 
 import argparse # to parse command line arguments
 import sqlite3 # store game info and personalization
+from ss_migrate_db import migrate # brings the schema up to date
+from ss_catalog import CATALOG_TABLES # tables that hold the story catalog
 
 def ss_init_db():
     """ Initalize database with tables for tracking question responses
@@ -43,6 +45,12 @@ def ss_init_db():
            action='store', nargs='?', type=str, default='socialstories.db',
            help= "The database filename for storing story and question info. "
            + "Defaults to \"socialstories.db\".")
+    parser.add_argument('-c', '--catalog', dest='catalog',
+           action='store', type=str, default=None,
+           help= "Keep the story catalog in a separate database with this "
+           + "filename (see the \"catalog_database\" game config option). "
+           + "The database given with -d then only holds participant "
+           + "progress.")
 
     # Parse the args we got, and print them out.
     args = parser.parse_args()
@@ -50,6 +58,20 @@ def ss_init_db():
 
     # Get connection to database.
     conn = sqlite3.connect(args.db)
+    if args.catalog is None:
+        create_tables(conn)
+    else:
+        catalog_conn = sqlite3.connect(args.catalog)
+        create_tables(catalog_conn)
+        catalog_conn.close()
+        create_progress_tables(conn)
+    conn.close()
+
+
+def create_tables(conn):
+    """ Create the tables for the social stories game in the database,
+    and bring the schema up to the current version (e.g., add indexes).
+    """
     cursor = conn.cursor()
 
     # Create tables.
@@ -136,7 +158,25 @@ def ss_init_db():
             )""")
 
     conn.commit()
-    conn.close()
+
+    # Apply schema migrations, so a new database has the same schema as
+    # an old database that has been migrated.
+    migrate(conn)
+
+
+def create_progress_tables(conn):
+    """ Create the tables for a database that only holds participant
+    progress, for use with a separate catalog database.
+    """
+    create_tables(conn)
+    # Take out the story catalog, so the game finds the catalog tables
+    # in the catalog database when it attaches it. The trigger that
+    # keeps session_performance up to date needs the questions table, so
+    # the game adds it when it attaches the catalog.
+    conn.execute("DROP TRIGGER session_performance_insert_response")
+    for table in CATALOG_TABLES + ["catalog_version"]:
+        conn.execute("DROP TABLE " + table)
+    conn.commit()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,274 @@
+#!/usr/bin/env python
+
+# The MIT License (MIT)
+#
+# Copyright (c) 2016 Personal Robots Group
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import argparse # to parse command line arguments
+import os # to check the catalog database exists
+import sqlite3 # store game info and personalization
+
+# Statements that recompute the session_performance summary table from
+# all the recorded responses. A response counts if it isn't NULL, and is
+# correct if it is equal to the question's target response.
+REBUILD_SESSION_PERFORMANCE = [
+    "DELETE FROM session_performance",
+    """INSERT INTO session_performance (participant, session, question_type,
+            correct, total)
+        SELECT stories_played.participant, stories_played.session,
+            questions.question_type,
+            SUM(questions.target_response = responses.response),
+            COUNT(responses.response)
+        FROM responses
+        JOIN stories_played
+            ON responses.stories_played_id = stories_played.id
+        JOIN questions
+            ON questions.id = responses.questions_id
+        WHERE responses.response IS NOT NULL
+        GROUP BY stories_played.participant, stories_played.session,
+            questions.question_type""",
+    ]
+
+# Keeps the SESSION_PERFORMANCE table up to date as responses are
+# recorded. When the story catalog is in its own database, the trigger
+# can't be stored with the responses, so the game adds it as a TEMP
+# trigger when it attaches the catalog (see ss_db_manager).
+SESSION_PERFORMANCE_TRIGGER = """CREATE TRIGGER session_performance_insert_response
+        AFTER INSERT ON responses
+        WHEN NEW.response IS NOT NULL
+        BEGIN
+            INSERT OR IGNORE INTO session_performance (participant, session,
+                question_type)
+            SELECT stories_played.participant, stories_played.session,
+                questions.question_type
+            FROM stories_played, questions
+            WHERE stories_played.id = NEW.stories_played_id
+                AND questions.id = NEW.questions_id;
+
+            UPDATE session_performance
+            SET correct = correct + (
+                    SELECT target_response = NEW.response
+                    FROM questions
+                    WHERE id = NEW.questions_id),
+                total = total + 1
+            WHERE participant = (
+                    SELECT participant
+                    FROM stories_played
+                    WHERE id = NEW.stories_played_id)
+                AND session = (
+                    SELECT session
+                    FROM stories_played
+                    WHERE id = NEW.stories_played_id)
+                AND question_type = (
+                    SELECT question_type
+                    FROM questions
+                    WHERE id = NEW.questions_id);
+        END"""
+
+# Database schema migrations, in order. Each migration is a list of SQL
+# statements. A database's schema version (stored in SQLite's
+# user_version) is the number of migrations that have been applied to
+# it, so a database made by an older version of ss_init_db.py, which
+# has the tables but no migrations, is at version 0. Add new schema
+# changes to the end of this list; never change or remove a migration
+# that has been released, since databases in the field already have it.
+MIGRATIONS = [
+    # 1: Indexes for the queries the game makes while it is running.
+    [
+    # Finding the level and stories a participant played in a session.
+    """CREATE INDEX IF NOT EXISTS stories_played_participant_session
+        ON stories_played (participant, session, time)""",
+    # Finding which stories a participant has played.
+    """CREATE INDEX IF NOT EXISTS stories_played_participant_story
+        ON stories_played (participant, story_id)""",
+    # Finding a question to record a response to.
+    """CREATE INDEX IF NOT EXISTS questions_story_level
+        ON questions (story_id, level, question_type, question_num)""",
+    # Finding stories at a level with particular target emotions.
+    """CREATE INDEX IF NOT EXISTS questions_level_target
+        ON questions (level, target_response, story_id)""",
+    # Finding the responses given while playing a story.
+    """CREATE INDEX IF NOT EXISTS responses_stories_played
+        ON responses (stories_played_id, questions_id, response)""",
+    # Finding the graphics for a story at a level.
+    """CREATE INDEX IF NOT EXISTS graphics_story_level
+        ON graphics (story_id, level, scene_num, graphic)""",
+    ],
+    # 2: The SESSION_PERFORMANCE table summarizes how many responses a
+    # participant gave to each type of question in each session, and how
+    # many were correct, so we can look up their performance without
+    # counting all their responses. A trigger updates it whenever a
+    # response is recorded.
+    [
+    """CREATE TABLE session_performance (
+            participant     text    NOT NULL,
+            session         integer NOT NULL,
+            question_type   text    NOT NULL,
+            correct         integer NOT NULL    DEFAULT 0,
+            total           integer NOT NULL    DEFAULT 0,
+            PRIMARY KEY (participant, session, question_type)
+            )""",
+    SESSION_PERFORMANCE_TRIGGER,
+    ] + REBUILD_SESSION_PERFORMANCE,
+    # 3: The CATALOG_VERSION table holds a number that changes every
+    # time the database is filled with stories, so copies of the story
+    # catalog kept in memory can tell when they are out of date.
+    [
+    """CREATE TABLE catalog_version (
+            version     integer     NOT NULL
+            )""",
+    "INSERT INTO catalog_version (version) VALUES (0)",
+    ],
+    # 4: The STORY_HASHES table holds a hash of each story's content as
+    # it was last processed by ss_process_story_ods.py, so stories that
+    # haven't changed can be skipped.
+    [
+    """CREATE TABLE story_hashes (
+            story_id        integer PRIMARY KEY,
+            content_hash    text    NOT NULL,
+            FOREIGN KEY(story_id) REFERENCES stories(id)
+            )""",
+    ],
+    ]
+
+def ss_migrate_db():
+    """ Bring an existing social stories database up to date with the
+    current database schema.
+    """
+    # Parse python arguments: The name of the database to migrate can
+    # be optionally provided.
+    parser = argparse.ArgumentParser(
+            formatter_class=argparse.RawDescriptionHelpFormatter,
+            description="""Migrates a database for the SAR Social Stories game
+            to the current schema version, keeping all story information and
+            participant progress. Databases that are already up to date are
+            not changed.""")
+    parser.add_argument('-d', '--database', dest='db',
+           action='store', nargs='?', type=str, default='socialstories.db',
+           help= "The database filename for storing story and question info. "
+           + "Defaults to \"socialstories.db\".")
+    parser.add_argument('-r', '--rebuild', dest='rebuild',
+           action='store_true', default=False, help="Rebuild the "
+           + "session_performance summary table from all the recorded "
+           + "responses, e.g., after editing responses by hand.")
+    parser.add_argument('-c', '--catalog', dest='catalog',
+           action='store', type=str, default=None, help="With --rebuild, "
+           + "the separate catalog database that the database uses, if it "
+           + "is a progress database (see ss_init_db.py --catalog). The "
+           + "catalog is only read.")
+
+    # Parse the args we got, and print them out.
+    args = parser.parse_args()
+    print("Args received: " + str(args))
+
+    # Get connection to database.
+    conn = sqlite3.connect(args.db)
+    old_version = get_schema_version(conn)
+    new_version = migrate(conn)
+    if new_version == old_version:
+        print("Database is up to date (schema version " + str(new_version)
+            + ").")
+    else:
+        print("Migrated database from schema version " + str(old_version)
+            + " to " + str(new_version) + ".")
+    if args.rebuild:
+        # A progress database's responses refer to questions in its
+        # catalog database.
+        if args.catalog is None and not conn.execute("SELECT 1 FROM "
+                "sqlite_master WHERE type = 'table' AND name = 'questions'"
+                ).fetchone():
+            print("Error! The database doesn't have the story catalog, so "
+                "give its catalog database with -c to rebuild the "
+                "session_performance table.")
+        elif args.catalog is not None and not os.path.exists(args.catalog):
+            print("Error! Catalog database " + args.catalog + " doesn't "
+                "exist.")
+        else:
+            rebuild_session_performance(conn, args.catalog)
+            print("Rebuilt the session_performance table.")
+    conn.close()
+
+
+def get_schema_version(conn):
+    """ Get the schema version of a database. """
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(conn):
+    """ Apply all the migrations a database doesn't have yet, in one
+    transaction, and return the database's new schema version.
+    """
+    version = get_schema_version(conn)
+    if version > len(MIGRATIONS):
+        raise ValueError("Database schema version " + str(version) + " is "
+            + "newer than this code knows about (" + str(len(MIGRATIONS))
+            + ")!")
+    if version == len(MIGRATIONS):
+        return version
+
+    # If any migration fails, none of them are applied. The sqlite3
+    # module commits before schema changes on its own, so we manage the
+    # transaction ourselves.
+    isolation_level = conn.isolation_level
+    conn.isolation_level = None
+    try:
+        conn.execute("BEGIN")
+        for migration in MIGRATIONS[version:]:
+            for statement in migration:
+                conn.execute(statement)
+        # PRAGMA doesn't take parameters.
+        conn.execute("PRAGMA user_version = %d" % len(MIGRATIONS))
+        conn.execute("COMMIT")
+    except:
+        conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.isolation_level = isolation_level
+
+    # Update the statistics the query planner uses to pick indexes.
+    conn.execute("ANALYZE")
+    conn.commit()
+    return len(MIGRATIONS)
+
+
+def rebuild_session_performance(conn, catalog_database=None):
+    """ Recompute the session_performance summary table from all the
+    recorded responses, in one transaction. If the database is a
+    progress database, give the filename of its catalog database, where
+    the questions are.
+    """
+    if catalog_database is not None:
+        # The progress database has no questions table of its own, so
+        # the rebuild's unqualified table names find the catalog's. We
+        # only read the catalog, since games may have it open as
+        # immutable.
+        conn.execute("ATTACH DATABASE ? AS catalog", (catalog_database,))
+    try:
+        with conn:
+            for statement in REBUILD_SESSION_PERFORMANCE:
+                conn.execute(statement)
+    finally:
+        if catalog_database is not None:
+            conn.execute("DETACH DATABASE catalog")
+
+
+if __name__ == '__main__':
+    ss_migrate_db()
@@ -0,0 +1,129 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2016 Personal Robots Group
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import zipfile # .ods files are zip archives
+from xml.etree import cElementTree as ElementTree # to stream the sheets
+
+# OpenDocument XML namespaces.
+_OFFICE = "{urn:oasis:names:tc:opendocument:xmlns:office:1.0}"
+_TABLE = "{urn:oasis:names:tc:opendocument:xmlns:table:1.0}"
+_TEXT = "{urn:oasis:names:tc:opendocument:xmlns:text:1.0}"
+
+def iter_rows(ods, keep_sheet=None):
+    """ Stream the rows of every sheet in an .ods spreadsheet, in order.
+    Yield a (sheet name, row) pair for each row, where the row is a list
+    of cell values without trailing empty cells. The spreadsheet's XML is
+    parsed as it is read, and each row is discarded once it has been
+    yielded, so only one row is held in memory at a time, however big
+    the spreadsheet is.
+
+    If keep_sheet is given, it is called with each sheet's index,
+    counting from 0, and only the rows of sheets it returns True for are
+    read. The other sheets are skipped without reading their cells.
+
+    Cells are read the same way pyexcel-ods reads them: numbers are
+    returned as ints or floats, other cells as the text they contain,
+    and merged (covered) cells are skipped.
+    """
+    with zipfile.ZipFile(ods) as archive:
+        content = archive.open("content.xml")
+        try:
+            sheet_name = None
+            sheet_index = -1
+            keep = False
+            for event, elem in ElementTree.iterparse(content,
+                    ("start", "end")):
+                if event == "start":
+                    if elem.tag == _TABLE + "table":
+                        sheet_name = elem.get(_TABLE + "name")
+                        sheet_index += 1
+                        keep = keep_sheet is None or keep_sheet(sheet_index)
+                elif elem.tag == _TABLE + "table-row":
+                    if keep:
+                        yield sheet_name, _read_row(elem)
+                    elem.clear()
+                elif elem.tag == _TABLE + "table":
+                    elem.clear()
+        finally:
+            content.close()
+
+
+def _read_row(row):
+    """ Get the values of the cells in a table row. """
+    values = []
+    # Empty cells are only added once we find a cell after them, so
+    # that a row ending in thousands of repeated empty cells doesn't
+    # take thousands of entries.
+    empty = 0
+    for cell in row:
+        if cell.tag != _TABLE + "table-cell":
+            continue
+        repeat = int(cell.get(_TABLE + "number-columns-repeated", 1))
+        value = _read_cell(cell)
+        if value == "":
+            empty += repeat
+        else:
+            values.extend([""] * empty)
+            values.extend([value] * repeat)
+            empty = 0
+    return values
+
+
+def _read_cell(cell):
+    """ Get the value of a table cell. """
+    value_type = cell.get(_OFFICE + "value-type")
+    if value_type in ("float", "percentage"):
+        value = float(cell.get(_OFFICE + "value"))
+        # Whole numbers are ints.
+        if value.is_integer():
+            value = int(value)
+        return value
+    return u"\n".join(_read_text(p) for p in _paragraphs(cell))
+
+
+def _paragraphs(elem):
+    """ Yield the paragraphs in an element, leaving out comments. """
+    for child in elem:
+        if child.tag == _OFFICE + "annotation":
+            continue
+        if child.tag == _TEXT + "p":
+            yield child
+        else:
+            for paragraph in _paragraphs(child):
+                yield paragraph
+
+
+def _read_text(elem):
+    """ Get the text in an element, turning the elements OpenDocument
+    uses for repeated spaces, tabs, and line breaks back into text.
+    """
+    text = [elem.text or u""]
+    for child in elem:
+        if child.tag == _TEXT + "s":
+            text.append(u" " * int(child.get(_TEXT + "c", 1)))
+        elif child.tag == _TEXT + "tab":
+            text.append(u"\t")
+        elif child.tag == _TEXT + "line-break":
+            text.append(u"\n")
+        else:
+            text.append(_read_text(child))
+        text.append(child.tail or u"")
+    return u"".join(text)
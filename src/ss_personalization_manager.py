@@ -24,6 +24,7 @@
 # SOFTWARE.
 import logging # log messages
 from ss_db_manager import ss_db_manager
+from ss_response_recorder import ss_response_recorder
 from SS_Errors import NoStoryFound
 
 class ss_personalization_manager():
@@ -31,8 +32,10 @@ class ss_personalization_manager():
     performance and the current session """
 
     def __init__(self, session, participant, database,
-            percent_correct_to_level):
-        """ Initialize stuff """
+            percent_correct_to_level, database_options=None, clock=None):
+        """ Initialize stuff. The database manager timestamps stories
+        played with the given clock, or with the real time.
+        """
         # Set up logger.
         self._logger = logging.getLogger(__name__)
         self._logger.info("Initializing personalization manager...")
@@ -49,8 +52,17 @@ class ss_personalization_manager():
         self._percent_correct_to_level = percent_correct_to_level
         # Get database manager, but don't require the database for a
         # DEMO session!
+        self._recorder = None
         if (self._session != -1):
-            self._db_man = ss_db_manager(database)
+            self._db_man = ss_db_manager(database, database_options, clock)
+            # Record responses from a writer thread, unless the database
+            # options say not to.
+            options = dict(ss_db_manager.DEFAULT_OPTIONS)
+            if database_options is not None:
+                options.update(database_options)
+            if options["write_behind"]:
+                self._recorder = ss_response_recorder(database,
+                    database_options, options["write_behind_queue_size"])
 
         # Get the level for this session.
         self._level = self.get_level_for_session()
@@ -96,8 +108,9 @@ class ss_personalization_manager():
         # up. If no responses were found or not enough were answered
         # correctly, do not level up.
         #TODO total performance or just last time's performance?
-        past_performance = self._db_man.get_percent_correct_responses(
-            self._participant, (self._session - 1))
+        past_performance = self._percent_correct(
+            self._db_man.get_response_counts(self._participant,
+            [self._session - 1]).get(self._session - 1, {}))
         if past_performance is None:
             self._logger.info("Participant did not answer any questions last "
                 + "time, so we will not level up. Level will be " + str(level)
@@ -125,14 +138,51 @@ class ss_personalization_manager():
         if (self._session != -1):
             # Get the user's performance on the emotion questions, on
             # the theory of mind questions, and on the order questions.
-            return self._db_man.get_percent_correct_responses(
-                self._participant, self._session, "emotion"), \
-                self._db_man.get_percent_correct_responses(self._participant,
-                self._session, "ToM"), \
-                self._db_man.get_percent_correct_responses( \
-                self._participant, self._session, "order")
+            # The counts for all of them come from one query, which
+            # needs every response written first.
+            self.flush_responses()
+            counts = self._db_man.get_response_counts(self._participant,
+                [self._session]).get(self._session, {})
+            return self._percent_correct(counts, "emotion"), \
+                self._percent_correct(counts, "ToM"), \
+                self._percent_correct(counts, "order")
+        else:
+            return None
+
+
+    def _percent_correct(self, counts, question_type=None):
+        """ Given a dict of question types to (correct, total) response
+        counts, get the percentage of responses that were correct, for
+        one question type or (if question_type is None) for all of
+        them. Return None if there were no responses.
+        """
+        if question_type is None:
+            correct = sum(c[0] for c in counts.values())
+            total = sum(c[1] for c in counts.values())
         else:
+            correct, total = counts.get(question_type, (0, 0))
+        if total == 0:
             return None
+        return float(correct) / total
+
+
+    def flush_responses(self):
+        """ Wait until every response recorded so far is saved to the
+        database.
+        """
+        if self._recorder is not None:
+            self._recorder.flush()
+
+
+    def close(self):
+        """ Make sure everything we recorded is saved to the database,
+        and close it.
+        """
+        if self._recorder is not None:
+            self._recorder.close()
+            self._recorder = None
+        if (self._session != -1):
+            self._db_man.close()
 
 
     def get_next_story_script(self):
@@ -258,6 +308,10 @@ class ss_personalization_manager():
         """
         # Skip if this is a demo session; otherwise record.
         if (self._session != -1):
+            # Commit the last story's responses first. With group commit,
+            # the recorder's connection holds them in an open write
+            # transaction, which would lock us out.
+            self.flush_responses()
             self._db_man.record_story_played(self._participant, self._session,
                 self._level, self._current_story)
 
@@ -267,7 +321,16 @@ class ss_personalization_manager():
         questions.
         """
         # Skip if this is a demo session; otherwise record.
-        if (self._session != -1):
+        if (self._session == -1):
+            return
+        if self._recorder is not None:
+            # The ids are in memory, so only the write waits, and that
+            # happens in the recorder's writer thread.
+            stories_played_id, question_id = self._db_man.get_response_ids(
+                self._participant, self._session, self._level,
+                self._current_story, question_num, question_type)
+            self._recorder.record(stories_played_id, question_id, response)
+        else:
             self._db_man.record_response(self._participant, self._session,
                 self._level, self._current_story, question_num, question_type,
                 response)
@@ -30,6 +30,43 @@ import argparse # to parse command line arguments
 import pyexcel # for reading in .ods spreadsheets
 from collections import OrderedDict # spreadsheets read into OrderedDicts
 import re # regex for parsing data in spreadsheet cells
+import itertools # to read only the rows we need
+import hashlib # content hashes to tell which stories changed
+import json # serialize stories for hashing
+import os # to check which story scripts exist
+import time # for timing each phase of processing
+import multiprocessing # for processing spreadsheets in parallel
+from contextlib import closing # close the script buffer when done
+from StringIO import StringIO # build story scripts in memory
+from ss_migrate_db import migrate # brings the schema up to date
+from ss_migrate_db import get_schema_version, MIGRATIONS # for catalog files
+from ss_init_db import create_tables # for the side file catalogs are built in
+from ss_catalog import CATALOG_TABLES # the tables copied to the side file
+from ss_ods_reader import iter_rows # streams rows from .ods spreadsheets
+
+# How long to wait, in seconds, for a game that is writing to the
+# database before giving up.
+LOCK_TIMEOUT = 60
+
+# The number of levels each story has, one per row in its sheet.
+NUM_LEVELS = 10
+
+# The levels table doesn't depend on the spreadsheets. Each level is
+# (level, num_answers, in_order).
+LEVELS = [
+    (1, 3, 1),
+    (2, 3, 1),
+    (3, 3, 1),
+    (4, 3, 1),
+    (5, 3, 0),
+    (6, 4, 0),
+    (7, 4, 0),
+    (8, 4, 0),
+    (9, 4, 0),
+    (10, 5, 0),
+    (11, 4, 0),
+    (12, 4, 0),
+    ]
 
 def ss_process_story_ods():
     """ Using the story info and scripts in the .ods spreadsheets,
@@ -45,11 +82,10 @@ def ss_process_story_ods():
             " SAR Social Stories game stories. Generate game scripts that will"
             " be used to load graphics and tell the robot how to read aloud"
             " the story. Add meta-information about the stories and the"
-            " questions to ask about each story to the database.\nThis script"
-            " will clear any existing data from the tables, so you should run"
-            " it with all the spreadsheets at once -- if you run it again"
-            " later, some or all of the previously imported data may be"
-            " deleted.")
+            " questions to ask about each story to the database.\nStories"
+            " that haven't changed since the last time they were processed"
+            " are skipped; new and changed stories are added or updated, and"
+            " only their story scripts are regenerated.")
     parser.add_argument('-d', '--database', dest='db',
            action='store', nargs='?', type=str, default='socialstories.db',
            help= "The database filename for storing story and question info. "
@@ -61,316 +97,906 @@ def ss_process_story_ods():
             nargs='?', type=str, default="", help="""The output directory where
             generated story scripts will be saved. Defaults to the current
             directory.""")
+    parser.add_argument('-q', '--quiet', dest='quiet', action='store_true',
+            default=False, help="""Don't print a message for every sheet,
+            question, and graphic processed; only print how long each phase
+            of processing took.""")
+    parser.add_argument('-j', '--jobs', dest='jobs', action='store',
+            type=int, default=1, help="""The number of processes to read
+            and process spreadsheets with. With fewer spreadsheets than
+            jobs, each spreadsheet's sheets are shared out between several
+            processes; each of them still parses the whole spreadsheet, but
+            only reads and processes its own sheets. Defaults to 1.""")
+    parser.add_argument('--vacuum', dest='vacuum', action='store_true',
+            default=False, help="""After updating the database, rebuild it
+            to reclaim the space used by deleted rows.""")
+    parser.add_argument('--immutable', dest='immutable', action='store_true',
+            default=False, help="""The database is a separate catalog
+            database, which games open as immutable (see the
+            "catalog_database" game config option). Replace the file with
+            the new catalog instead of changing it, so games that have it
+            open keep reading the old one until they attach the new one.
+            The new file is always compact, so --vacuum isn't needed.
+            Needs --progress_database.""")
+    parser.add_argument('-p', '--progress_database', dest='progress_dbs',
+            action='append', default=[], help="""With --immutable, a
+            progress database that games using the catalog record
+            responses in. New questions never reuse the id of a question
+            that has responses, even if it was removed, so we need every
+            progress database to tell which ids were used. Give this once
+            for each progress database.""")
 
     # Parse the args we got, and print them out.
     args = parser.parse_args()
     print("Args received: " + str(args))
+    verbose = not args.quiet
 
-    # Get connection to database.
-    conn = sqlite3.connect(args.db)
-    cursor = conn.cursor()
-
-    # Reset any tables that shouldn't have duplicate data.
-    cursor.execute("DELETE FROM questions")
-    cursor.execute("DELETE FROM responses_in_question")
-    cursor.execute("DELETE FROM graphics")
-    cursor.execute("VACUUM")
-
-    # Fill levels table since it doesn't depend on the spreadsheets.
-    fill_levels_table(cursor)
-
-    # For each spreadsheet file, go through sheets and read in stories.
-    for ods in args.ods_files:
-        print("Processing file: " + ods)
-
-        # Open file and get data.
-        book = pyexcel.get_book(file_name=ods, name_columns_by_row=0)
-
-        # Print out general info about the spreadsheet.
-        print("Found " + str(book.number_of_sheets()) + " sheets.")
-
-        # Add list of story names to story table (from sheet names).
-        insert_to_stories_table(cursor, book.sheet_names())
-
-        # We need to keep track of graphic names for later...
-        graphic_names = {}
-
-        # For each sheet, read in story, generate scripts, input info
-        # about stories, questions, and emotions to DB.
-        for sheet in book:
-            print("Processing sheet: " + sheet.name)
-            sheet.name_columns_by_row(0)
-            print("Has columns: " + str(sheet.colnames))
-
-            story_name = str(sheet.name.lower())
-            print "Story name: " + story_name
-
-            sheet_dict = sheet.to_dict()
-            question_list = {}
-            midway_question_list = {}
-            graphic_names[story_name] = {}
-
-            # Add each question to the DB. Loop through columns.
-            for key in sheet_dict.keys():
-                # For each question column, get question text without
-                # the answer list.
-                if "question" in key.lower() and not "correct" in key.lower():
-                    print("Adding question: " + key)
-                    # Get the number of the question, if it has one
-                    try:
-                        question_num = re.findall(r'\d+', key)[0]
-                    except:
-                        # If there is no number in the question's label,
-                        # there is probably only one such question, so
-                        # label it question 1.
-                        question_num = 1
-                    # Get the type of question
-                    if "midway" in key.lower():
-                        question_type = "ToM"
-                    elif "order" in key.lower():
-                        question_type = "order"
-                    else:
-                        question_type = "emotion"
-
-                    # Find responses column for the question by looping
-                    # through the keys and finding the one that matches
-                    # the question we're on.
-                    responses = None
-                    for k in sheet_dict.keys():
-                        if key.lower() in k.lower() and "correct" in k.lower():
-                            responses = k
-                            break
-
-                    if (responses is None):
-                        print("Error! Did not find question responses.")
-                        return
-
-                    for level in range(0,10):
-                        # Skip empty cells.
-                        if (sheet_dict[responses][level] == "") \
-                                or (sheet_dict[responses][level] == "-") \
-                                or (sheet_dict[responses][level] == ["-"]):
-                            print("Skipping empty cell")
-                            continue
-
-                        # Add question to questions table at this level.
-                        insert_to_questions_table(cursor, sheet.name.lower(),
-                            level+1, question_num, question_type,
-                            # Target response is the first in the list
-                            # of response options
-                            sheet_dict[responses][level].split(',')[0]
-                                .strip().lower())
-
-                        # Add responses to emotions_in_question table
-                        # at this level.
-                        insert_to_responses_table(cursor, sheet.name.lower(),
-                            level+1, question_num, question_type,
-                            sheet_dict[responses][level].split(','))
-
-                        # Make dict of level:(question text, question type,
-                        # question num, responses).
-                        if level not in question_list.keys():
-                            question_list[level] = []
-                        if level not in midway_question_list.keys():
-                            midway_question_list[level] = []
-                        # Save theory of mind questions separately
-                        # because they are asked midway through the
-                        # story.
-                        if "ToM" in question_type:
-                            midway_question_list[level].append(
-                                [sheet_dict[key][level],
-                                sheet_dict[responses][level].split(','),
-                                question_type,
-                                question_num])
-                        else:
-                            question_list[level].append(
-                                [sheet_dict[key][level],
-                                sheet_dict[responses][level].split(','),
-                                question_type,
-                                question_num])
-                # If this is a Scene column, add the graphics filenames
-                # to the DB.
-                # We also want to save the graphics names for use when
-                # adding order/scene questions to the script later.
-                if "scene" in key.lower() and "graphic" in key.lower():
-                    # Get the number of the scene
-                    try:
-                        scene_num = int(re.findall(r'\d+', key)[0])
-                    except Exception as e:
-                        # If there is no number in the scene's label,
-                        # that's a problem.
-                        print("Error! No scene number found!\n" + str(e))
-                        return
+    # A catalog database has no responses of its own, so we can only
+    # number new questions if we can see the responses that refer to
+    # its questions.
+    if args.immutable and not args.progress_dbs:
+        print("Error! Give the progress databases that use the catalog "
+            "with -p, so new questions don't reuse the ids of questions "
+            "that have responses.")
+        return
+    for progress_db in args.progress_dbs:
+        if not os.path.exists(progress_db):
+            print("Error! Progress database " + progress_db + " doesn't "
+                "exist.")
+            return
+
+    # How long each phase of processing took, in seconds.
+    timings = OrderedDict()
+
+    # Read all the spreadsheets, then pull the questions, graphics, and
+    # scripts for each story out of its sheet. Nothing is written until
+    # every story has been processed, so a problem with any sheet leaves
+    # the database and the story scripts as they were.
+    try:
+        if args.jobs > 1:
+            # Each worker reads and processes one part of a spreadsheet
+            # at a time: every sheet, or, if there are more jobs than
+            # spreadsheets, every so many sheets, so that a single big
+            # spreadsheet still keeps every job busy. Only this process
+            # writes to the database and the story scripts, and it puts
+            # the stories back in the order the sheets were in, so the
+            # output is the same as processing them one after another.
+            start = time.time()
+            stories = []
+            parts = max(1, args.jobs // len(args.ods_files))
+            tasks = [(ods, verbose, part, parts) for ods in args.ods_files
+                for part in range(parts)]
+            pool = multiprocessing.Pool(min(args.jobs, len(tasks)))
+            try:
+                results = pool.imap(_process_workbook, tasks)
+                for ods in args.ods_files:
+                    stories.extend(_merge_parts([next(results)
+                        for part in range(parts)]))
+            finally:
+                pool.terminate()
+                pool.join()
+            timings["read and process spreadsheets (" + str(args.jobs)
+                + " jobs)"] = time.time() - start
+        else:
+            # Process each sheet as soon as it is read, so we only
+            # hold one sheet at a time.
+            timings["read spreadsheets"] = 0
+            timings["process stories"] = 0
+            stories = []
+            for ods in args.ods_files:
+                for sheet_name, sheet_dict in _timed(read_workbook(ods,
+                        verbose), timings, "read spreadsheets"):
+                    start = time.time()
+                    stories.append(process_story(sheet_name, sheet_dict,
+                        verbose))
+                    timings["process stories"] += time.time() - start
+    except ValueError as e:
+        print("Error! " + str(e))
+        return
+
+    # If a story is in more than one sheet, the last one wins.
+    stories = OrderedDict((story["name"], story) for story in stories
+        ).values()
+
+    # Get connection to database, and make sure it has the current
+    # schema. If a game is writing to the database, wait for it.
+    conn = sqlite3.connect(args.db, timeout=LOCK_TIMEOUT)
+    try:
+        if not args.immutable:
+            migrate(conn)
+        elif get_schema_version(conn) != len(MIGRATIONS):
+            # Games don't expect an immutable database to change, so we
+            # can't migrate it while they may be using it.
+            print("Error! The catalog database isn't at the current schema "
+                "version. Migrate it with ss_migrate_db.py while no games are "
+                "running.")
+            return
+
+        # Build the new catalog in a side file, so games using the database
+        # aren't held up while we work, and check it.
+        start = time.time()
+        side_file = args.db + ".new-catalog"
+        try:
+            status = build_catalog(conn, side_file, stories, verbose,
+                args.progress_dbs)
+            timings["build catalog"] = time.time() - start
+            if "added" in status.values() or "updated" in status.values():
+                start = time.time()
+                problems = check_catalog(side_file)
+                timings["check catalog"] = time.time() - start
+                if problems:
+                    print("Error! The new story catalog failed its checks, so "
+                        "the database was not changed:")
+                    for problem in problems:
+                        print("    " + problem)
+                    return
+
+                # Swap the new catalog in, in one short transaction, or
+                # replace the whole file.
+                start = time.time()
+                try:
+                    if args.immutable:
+                        replace_catalog(conn, side_file)
                     else:
-                        if scene_num not in graphic_names[story_name]:
-                            graphic_names[story_name][scene_num] = {}
-                        # Graphics may have different descriptions at
-                        # different levels, so we cannot automatically
-                        # figure out which description matches which
-                        # graphics tag. Instead, there are columns that
-                        # list the tag of the graphic to load for that
-                        # scene, for that level, for that story.
-                        for level in range(0,10):
-                            # Skip empty cells.
-                            if (sheet[level,key] == "") \
-                                or (sheet[level,key] == "-") \
-                                or (sheet[level,key] == ["-"]):
-                                print("Skipping empty cell")
-                                continue
-                            # Graphics scene numbers are 1-indexed.
-                            graphic_names[story_name][scene_num][level+1] = \
-                                insert_to_graphics_table(cursor,
-                                sheet.name.upper(), level + 1, scene_num,
-                                sheet[level,key].lower())
-
-            # For each level, generate story.
-            # Rows are 0-indexed but levels are 1-indexed.
-            for level in range(0,10):
-                # Use story to generate game script for robot
-                generate_script_for_story(args.out_dir, sheet.name.lower(),
-                        level+1, sheet[level, "Story"], question_list[level],
-                        midway_question_list[level], graphic_names)
-
-            # Commit after each story.
-            conn.commit()
-
-    # Close database connection.
-    conn.close()
+                        swap_catalog(conn, side_file)
+                except (sqlite3.OperationalError, OSError) as e:
+                    print("Error! Could not swap in the new story catalog, so "
+                        "the database was not changed: " + str(e))
+                    return
+                timings["swap catalog"] = time.time() - start
+        finally:
+            if os.path.exists(side_file):
+                os.remove(side_file)
 
+        # Reclaim the space used by old rows, if asked.
+        if args.vacuum and not args.immutable:
+            start = time.time()
+            conn.execute("VACUUM")
+            timings["vacuum database"] = time.time() - start
+    finally:
+        # Close database connection, however we got here.
+        conn.close()
 
-def insert_to_stories_table(cursor, story_names):
-    """ Add a story to the stories table. """
-    # story_name = The story's unique tag string.
-    for name in story_names:
+    # Save the story scripts for each new or changed story, and any
+    # other story scripts that are missing.
+    start = time.time()
+    for story in stories:
+        for level, script in story["scripts"]:
+            filename = args.out_dir + story["name"] + "-" + str(level) + ".txt"
+            if status[story["name"]] != "skipped" \
+                    or not os.path.exists(filename):
+                write_story_script(args.out_dir, story["name"], level, script)
+    timings["write scripts"] = time.time() - start
+
+    for name, story_status in status.items():
+        _say(verbose, story_status.capitalize() + " story: " + name)
+    counts = [status.values().count(s) for s in
+        ["skipped", "updated", "added"]]
+    print("Processed " + str(len(stories)) + " stories from "
+        + str(len(args.ods_files)) + " spreadsheets: %d skipped (unchanged),"
+        " %d updated, %d added." % tuple(counts))
+    for phase, seconds in timings.items():
+        print("    %s: %.3f s" % (phase, seconds))
+
+
+def _say(verbose, message):
+    """ Print a progress message, unless we're being quiet. """
+    if verbose:
+        print(message)
+
+
+def read_workbook(ods, verbose=True, keep_sheet=None):
+    """ Read the sheets in an .ods spreadsheet one at a time. Yield a
+    (sheet name, sheet dict) pair for each sheet, where the sheet dict
+    maps column names to the list of cells in that column. Rows are
+    streamed from the spreadsheet, and only the columns and rows we use
+    are kept, so only one sheet's worth of cells is held at a time.
+
+    If keep_sheet is given, only the sheets whose index it returns True
+    for are read (see ss_ods_reader.iter_rows).
+    """
+    _say(verbose, "Processing file: " + ods)
+    for sheet_name, rows in _iter_sheets(ods, keep_sheet):
+        # The first row has the column names.
+        colnames = next(rows, [])
+        _say(verbose, "Read sheet: " + sheet_name)
+        _say(verbose, "Has columns: " + str(colnames))
+        columns = [(i, name) for i, name in enumerate(colnames)
+            if _is_used_column(name)]
+        sheet_dict = OrderedDict((name, []) for i, name in columns)
+        # Each of the next rows is a level.
+        for row in itertools.islice(rows, NUM_LEVELS):
+            for i, name in columns:
+                sheet_dict[name].append(row[i] if i < len(row) else "")
+        # Skip the rest of the sheet.
+        for row in rows:
+            pass
+        yield sheet_name, sheet_dict
+
+
+def _iter_sheets(ods, keep_sheet=None):
+    """ Yield a (sheet name, rows) pair for each sheet in a spreadsheet
+    (or each one keep_sheet returns True for), where rows is an iterator
+    over the sheet's rows. Each sheet's rows must be used up before
+    moving on to the next sheet.
+    """
+    if ods.lower().endswith(".ods"):
+        # Stream the spreadsheet's XML, so we never hold more than one
+        # row of it.
+        for sheet_name, sheet_rows in itertools.groupby(iter_rows(ods,
+                keep_sheet), lambda sheet_row: sheet_row[0]):
+            yield sheet_name, (row for _, row in sheet_rows)
+    else:
+        # Other formats are read with pyexcel, a sheet at a time.
+        book = pyexcel.iget_book(file_name=ods)
+        try:
+            for index, sheet in enumerate(book):
+                if keep_sheet is None or keep_sheet(index):
+                    yield sheet.name, iter(sheet.payload)
+        finally:
+            # Close the spreadsheet.
+            pyexcel.free_resources()
+
+
+def _is_used_column(name):
+    """ Return whether a spreadsheet column is one we use: the story
+    text, a question or its responses, or a scene's graphic.
+    """
+    name = unicode(name)
+    return name == "Story" or "question" in name.lower() \
+        or ("scene" in name.lower() and "graphic" in name.lower())
+
+
+def _process_workbook(task):
+    """ Read part of an .ods spreadsheet and process the stories in it,
+    in a worker process. The task is (ods filename, verbose, part,
+    parts): the spreadsheet is split into that many parts, and part k
+    has sheets k, k + parts, k + 2 * parts, and so on. Return the list
+    of processed stories.
+    """
+    ods, verbose, part, parts = task
+    return [process_story(sheet_name, sheet_dict, verbose)
+        for sheet_name, sheet_dict in read_workbook(ods, verbose,
+            lambda index: index % parts == part)]
+
+
+def _merge_parts(parts):
+    """ Put the stories from the parts of a spreadsheet (see
+    _process_workbook) back in the order their sheets were in.
+    """
+    stories = []
+    for index in range(sum(len(part) for part in parts)):
+        stories.append(parts[index % len(parts)][index // len(parts)])
+    return stories
+
+
+def _timed(iterable, timings, phase):
+    """ Yield the items from an iterable, adding the time spent getting
+    each one to timings[phase].
+    """
+    iterator = iter(iterable)
+    while True:
+        start = time.time()
         try:
-            cursor.execute("""
-                INSERT INTO stories (story_name)
-                VALUES (?)
-                """, (name.lower(),))
-        except sqlite3.IntegrityError as e:
-            print("Error adding story " + name + " to DB! It may already "
-                "exist. Exception: " + str(e))
+            item = next(iterator)
+        finally:
+            timings[phase] += time.time() - start
+        yield item
+
+
+def _is_empty(cell):
+    """ Return whether a spreadsheet cell has nothing in it. """
+    return cell == "" or cell == "-" or cell == ["-"]
+
+
+def process_story(sheet_name, sheet_dict, verbose=True):
+    """ Get everything we need to add a story to the game from its
+    sheet: the questions to ask and their answer options, the graphics
+    to load for each scene, and the contents of the story scripts. Raise
+    a ValueError if the sheet isn't organized the way we expect.
+
+    Return a dict with:
+        "name": the story name,
+        "questions": a list of (level, question_num, question_type,
+            target_response, responses),
+        "graphics": a list of (level, scene_num, graphic filename),
+        "graphic_names": {scene_num: {level: graphic name}},
+        "scripts": a list of (level, story script contents),
+        "hash": a hash of the story's questions, graphics, and scripts.
+    """
+    _say(verbose, "Processing sheet: " + sheet_name)
+    story_name = str(sheet_name.lower())
+    _say(verbose, "Story name: " + story_name)
+
+    questions = []
+    graphics = []
+    question_list = {}
+    midway_question_list = {}
+    # We need to keep track of graphic names for the order questions.
+    graphic_names = {}
+
+    # Add each question. Loop through columns.
+    for key in sheet_dict.keys():
+        # For each question column, get question text without the
+        # answer list.
+        if "question" in key.lower() and not "correct" in key.lower():
+            _say(verbose, "Adding question: " + key)
+            # Get the number of the question, if it has one
+            try:
+                question_num = int(re.findall(r'\d+', key)[0])
+            except:
+                # If there is no number in the question's label, there
+                # is probably only one such question, so label it
+                # question 1.
+                question_num = 1
+            # Get the type of question
+            if "midway" in key.lower():
+                question_type = "ToM"
+            elif "order" in key.lower():
+                question_type = "order"
+            else:
+                question_type = "emotion"
+
+            # Find responses column for the question by looping through
+            # the keys and finding the one that matches the question
+            # we're on.
+            responses = None
+            for k in sheet_dict.keys():
+                if key.lower() in k.lower() and "correct" in k.lower():
+                    responses = k
+                    break
+
+            if (responses is None):
+                raise ValueError("Did not find question responses for "
+                    + key + " in sheet " + sheet_name + ".")
+
+            for level in range(0, NUM_LEVELS):
+                # Skip empty cells.
+                if _is_empty(sheet_dict[responses][level]):
+                    _say(verbose, "Skipping empty cell")
+                    continue
 
+                response_list = sheet_dict[responses][level].split(',')
+                # Target response is the first in the list of response
+                # options.
+                target_response = response_list[0].strip().lower()
+                _say(verbose, "ADD QUESTION: " + story_name + "-"
+                    + str(level+1) + " " + question_type + " "
+                    + str(question_num) + ": " + target_response)
+                _say(verbose, "ADD RESPONSES: " + story_name + "-"
+                    + str(level+1) + " " + question_type + " "
+                    + str(question_num) + ": " + str(response_list))
+                questions.append((level+1, question_num, question_type,
+                    target_response, response_list))
+
+                # Make dict of level:(question text, question type,
+                # question num, responses).
+                if level not in question_list.keys():
+                    question_list[level] = []
+                if level not in midway_question_list.keys():
+                    midway_question_list[level] = []
+                # Save theory of mind questions separately because they
+                # are asked midway through the story.
+                if "ToM" in question_type:
+                    midway_question_list[level].append(
+                        [sheet_dict[key][level], response_list,
+                        question_type, question_num])
+                else:
+                    question_list[level].append(
+                        [sheet_dict[key][level], response_list,
+                        question_type, question_num])
+
+        # If this is a Scene column, get the graphics filenames. We also
+        # want to save the graphics names for use when adding
+        # order/scene questions to the script later.
+        if "scene" in key.lower() and "graphic" in key.lower():
+            # Get the number of the scene
+            try:
+                scene_num = int(re.findall(r'\d+', key)[0])
+            except Exception as e:
+                # If there is no number in the scene's label, that's a
+                # problem.
+                raise ValueError("No scene number found in column " + key
+                    + " in sheet " + sheet_name + ".")
+            if scene_num not in graphic_names:
+                graphic_names[scene_num] = {}
+            # Graphics may have different descriptions at different
+            # levels, so we cannot automatically figure out which
+            # description matches which graphics tag. Instead, there are
+            # columns that list the tag of the graphic to load for that
+            # scene, for that level, for that story.
+            for level in range(0, NUM_LEVELS):
+                # Skip empty cells.
+                if _is_empty(sheet_dict[key][level]):
+                    _say(verbose, "Skipping empty cell")
+                    continue
+                # Graphics scene numbers are 1-indexed.
+                graphic = get_graphic_name(sheet_name.upper(), level+1,
+                    sheet_dict[key][level].lower())
+                _say(verbose, "ADD GRAPHIC: " + sheet_name.upper() + "-"
+                    + str(level+1) + " scene" + str(scene_num) + " "
+                    + sheet_dict[key][level].lower())
+                graphics.append((level+1, scene_num, graphic))
+                graphic_names[scene_num][level+1] = graphic.replace(".png",
+                    "")
 
-def insert_to_graphics_table(cursor, story_name, level, scene, graphic_tag):
-    """ Add a list of graphics names to the graphics table."""
+    # For each level, use story to generate game script for robot.
+    # Rows are 0-indexed but levels are 1-indexed.
+    scripts = []
+    for level in range(0, NUM_LEVELS):
+        scripts.append((level+1, generate_script_for_story(story_name,
+            level+1, sheet_dict["Story"][level], question_list[level],
+            midway_question_list[level], graphic_names, verbose)))
+
+    return {
+        "name": story_name,
+        "questions": questions,
+        "graphics": graphics,
+        "graphic_names": graphic_names,
+        "scripts": scripts,
+        # Hash everything the story puts in the database and the story
+        # scripts, so we can tell when it has changed.
+        "hash": hashlib.sha1(json.dumps([questions, graphics, scripts])
+            ).hexdigest(),
+        }
+
+
+def get_graphic_name(story_name, level, graphic_tag):
+    """ Get the filename of a graphic to load for a story."""
     # story_name = The name of the story.
     # level = The level number from the levels table for this level.
-    # scene = Scene number (1,2,3,4) to load this graphic into.
     # graphic_tag = Tag of graphic to load (lowercase letter).
-    print("ADD GRAPHIC: " + story_name + "-" + str(level) + " scene" +
-            str(scene) + " " + graphic_tag)
     # Graphics file names:
     #     [env][story_num]-[tag]-[background_type].png
     #     where background_type is b=background or p=plain
     #     e.g., LR1-a-b.png or CF1-f-p.png
     # Levels 1-5: p for plain background.
     # Levels 6-10: b for complex background.
-    graphic_name = story_name.replace("STORY-","") + "-" + graphic_tag + "-" \
+    return story_name.replace("STORY-","") + "-" + graphic_tag + "-" \
         + ("p" if level < 6 else "b") + ".png"
-    cursor.execute("""
+
+
+def build_catalog(conn, side_file, stories, verbose=True,
+        progress_databases=()):
+    """ Build the updated story catalog in a side file: copy the current
+    catalog from the database into it, then add new stories and update
+    changed ones there (see write_catalog). The database itself isn't
+    changed. If the database is a separate catalog database, the
+    progress databases are the files that hold the responses to its
+    questions. Return what write_catalog returns.
+    """
+    if os.path.exists(side_file):
+        os.remove(side_file)
+    side_conn = sqlite3.connect(side_file)
+    try:
+        # Nobody else uses the side file, and we start over if we're
+        # interrupted, so don't wait for it to be synced to disk.
+        side_conn.execute("PRAGMA journal_mode = OFF")
+        side_conn.execute("PRAGMA synchronous = OFF")
+        create_tables(side_conn)
+
+        # Reading the catalog doesn't block games that are writing to
+        # the database.
+        side_conn.execute("ATTACH DATABASE ? AS live", (conn_filename(conn),))
+        with side_conn:
+            for table in CATALOG_TABLES:
+                columns = _columns(side_conn, table)
+                side_conn.execute("INSERT INTO main." + table + " ("
+                    + columns + ") SELECT " + columns + " FROM live."
+                    + table)
+        # Recorded responses may refer to questions that have since been
+        # removed, so new questions mustn't reuse their ids. A separate
+        # catalog database has no responses; they're in the progress
+        # databases.
+        used_question_id = _used_question_id(side_conn, "live")
+        side_conn.execute("DETACH DATABASE live")
+        for progress_database in progress_databases:
+            side_conn.execute("ATTACH DATABASE ? AS progress",
+                (progress_database,))
+            try:
+                used_question_id = max(used_question_id,
+                    _used_question_id(side_conn, "progress"))
+            finally:
+                side_conn.execute("DETACH DATABASE progress")
+
+        return write_catalog(side_conn, stories, verbose,
+            used_question_id + 1)
+    finally:
+        side_conn.close()
+
+
+def _used_question_id(conn, database):
+    """ Get the highest question id that an attached database has
+    responses to, or 0 if it has none.
+    """
+    return conn.execute("SELECT IFNULL(MAX(questions_id), 0) FROM "
+        + database + ".responses").fetchone()[0]
+
+
+def conn_filename(conn):
+    """ Get the filename of the main database of a connection. """
+    for _, name, filename in conn.execute("PRAGMA database_list"):
+        if name == "main":
+            return filename
+
+
+def _columns(conn, table):
+    """ Get a comma-separated list of a table's columns. """
+    return ", ".join(row[1] for row in conn.execute(
+        "PRAGMA main.table_info(" + table + ")"))
+
+
+def check_catalog(side_file):
+    """ Check that the catalog in a side file is sound before it is
+    swapped in: the file isn't corrupt, and every question, answer
+    option, and graphic refers to a story, level, or question that
+    exists. Return a list of the problems found.
+    """
+    side_conn = sqlite3.connect(side_file)
+    try:
+        problems = [row[0] for row in side_conn.execute(
+            "PRAGMA integrity_check") if row[0] != "ok"]
+        for table, rowid, parent, _ in side_conn.execute(
+                "PRAGMA foreign_key_check"):
+            problems.append(table + " row " + str(rowid) + " refers to a "
+                + parent + " row that doesn't exist")
+        return problems
+    finally:
+        side_conn.close()
+
+
+def swap_catalog(conn, side_file):
+    """ Bring the story catalog in the database up to date with the one
+    in the side file, in one transaction. Games reading the database see
+    either the old catalog or the new one; games writing to it only wait
+    for the copy, not for the whole ingest.
+
+    The side file was copied from the database and then only had new
+    and changed stories written to it (see build_catalog), so usually
+    only those stories' rows, the ones whose content hash differs, are
+    copied back. That keeps the transaction, and the write lock it
+    holds, short when only a few stories changed. When most stories
+    changed, replacing whole tables is quicker, so we do that instead.
+    """
+    isolation_level = conn.isolation_level
+    conn.isolation_level = None
+    conn.execute("ATTACH DATABASE ? AS new_catalog", (side_file,))
+    try:
+        # Find the changed stories before taking the write lock. Games
+        # never write story_hashes, so they can't change underneath us.
+        conn.execute("""
+            CREATE TEMP TABLE changed_stories AS
+            SELECT story_id FROM (
+                SELECT story_id, content_hash
+                FROM new_catalog.story_hashes
+                EXCEPT
+                SELECT story_id, content_hash
+                FROM main.story_hashes)""")
+        changed, total = conn.execute("""
+            SELECT (SELECT COUNT(*) FROM temp.changed_stories),
+                (SELECT COUNT(*) FROM new_catalog.story_hashes)
+            """).fetchone()
+        copy_all = 2 * changed > total
+        if not copy_all:
+            # Index the new answer options by question, so the changed
+            # stories' options can be found without reading them all.
+            # Nobody else uses the side file, so this doesn't hold anyone
+            # up.
+            conn.execute("""
+                CREATE INDEX IF NOT EXISTS
+                    new_catalog.responses_in_question_questions
+                ON responses_in_question (questions_id)""")
+        # Take the write lock up front, so we don't fail partway through
+        # because a game started writing.
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if copy_all:
+                _copy_catalog(conn)
+            else:
+                _copy_changed_stories(conn)
+            # Let anyone with the catalog loaded know it changed.
+            bump_catalog_version(conn)
+            conn.execute("COMMIT")
+        except:
+            conn.execute("ROLLBACK")
+            raise
+    finally:
+        conn.execute("DROP TABLE IF EXISTS temp.changed_stories")
+        conn.execute("DETACH DATABASE new_catalog")
+        conn.isolation_level = isolation_level
+
+
+def _copy_catalog(conn):
+    """ Replace every catalog table in the database with the one in the
+    attached new_catalog database.
+    """
+    for table in CATALOG_TABLES:
+        columns = _columns(conn, table)
+        conn.execute("DELETE FROM main." + table)
+        conn.execute("INSERT INTO main." + table + " (" + columns
+            + ") SELECT " + columns + " FROM new_catalog." + table)
+
+
+def _copy_changed_stories(conn):
+    """ Copy the stories listed in temp.changed_stories, with their
+    questions, answer options, and graphics, from the attached
+    new_catalog database to the database, replacing what it had for
+    them. Levels are copied if they changed.
+    """
+    # Levels don't belong to a story, and there are only a few, so if
+    # they changed, copy them all.
+    if conn.execute("""
+            SELECT * FROM new_catalog.levels
+            EXCEPT SELECT * FROM main.levels""").fetchone() \
+            or conn.execute("""
+            SELECT * FROM main.levels
+            EXCEPT SELECT * FROM new_catalog.levels""").fetchone():
+        columns = _columns(conn, "levels")
+        conn.execute("DELETE FROM main.levels")
+        conn.execute("INSERT INTO main.levels (" + columns + ") SELECT "
+            + columns + " FROM new_catalog.levels")
+    # Questions never move between stories, so replacing the changed
+    # stories' questions covers every question that was removed or
+    # added.
+    conn.execute("""
+        DELETE FROM main.responses_in_question
+        WHERE questions_id IN (
+            SELECT id
+            FROM main.questions
+            WHERE story_id IN temp.changed_stories)""")
+    for table in ["questions", "graphics"]:
+        conn.execute("DELETE FROM main." + table
+            + " WHERE story_id IN temp.changed_stories")
+    for table, key in [("stories", "id"), ("story_hashes", "story_id"),
+            ("questions", "story_id"), ("graphics", "story_id")]:
+        columns = _columns(conn, table)
+        conn.execute("INSERT OR REPLACE INTO main." + table + " ("
+            + columns + ") SELECT " + columns + " FROM new_catalog." + table
+            + " WHERE " + key + " IN temp.changed_stories")
+    columns = _columns(conn, "responses_in_question")
+    conn.execute("INSERT INTO main.responses_in_question (" + columns
+        + ") SELECT " + columns + """
+        FROM new_catalog.responses_in_question
+        WHERE questions_id IN (
+            SELECT id
+            FROM new_catalog.questions
+            WHERE story_id IN temp.changed_stories)""")
+
+
+def replace_catalog(conn, side_file):
+    """ Replace a catalog database with the side file, for catalogs
+    that games open as immutable. The side file gets the next catalog
+    version and is synced to disk, then renamed over the database, so
+    games see either the whole old file or the whole new one.
+    """
+    version = conn.execute("SELECT version FROM catalog_version"
+        ).fetchone()[0]
+    database = conn_filename(conn)
+    side_conn = sqlite3.connect(side_file)
+    try:
+        with side_conn:
+            side_conn.execute("UPDATE catalog_version SET version = (?)",
+                (version + 1,))
+    finally:
+        side_conn.close()
+    with open(side_file, "rb") as f:
+        os.fsync(f.fileno())
+    conn.close()
+    os.rename(side_file, database)
+
+
+def write_catalog(conn, stories, verbose=True, first_question_id=1):
+    """ Add new stories to the database and update the questions, answer
+    options, and graphics of stories that changed, in one transaction.
+    A story is unchanged if its content hash matches the one stored the
+    last time it was processed; unchanged stories aren't touched. Story
+    and question ids are looked up once, so each table is written with
+    a single executemany. Questions keep their ids when a story is
+    updated, so recorded responses still refer to them. New questions
+    get ids of at least first_question_id.
+
+    Return an OrderedDict mapping each story name to "added", "updated",
+    or "skipped".
+    """
+    status = OrderedDict()
+    with conn:
+        cursor = conn.cursor()
+
+        # Fill levels table since it doesn't depend on the spreadsheets.
+        fill_levels_table(cursor)
+
+        story_ids = dict(cursor.execute("SELECT story_name, id FROM stories"))
+        hashes = dict(cursor.execute(
+            "SELECT story_id, content_hash FROM story_hashes"))
+        changed = []
+        for story in stories:
+            story_id = story_ids.get(story["name"])
+            if story_id is None:
+                status[story["name"]] = "added"
+            elif hashes.get(story_id) == story["hash"]:
+                status[story["name"]] = "skipped"
+                continue
+            else:
+                status[story["name"]] = "updated"
+            changed.append(story)
+        if not changed:
+            return status
+
+        # Add the new stories. Stories that are already in the database
+        # keep their ids, so progress recorded for them still refers
+        # to them.
+        insert_to_stories_table(cursor, [story["name"] for story in changed
+            if status[story["name"]] == "added"])
+        story_ids = dict(cursor.execute("SELECT story_name, id FROM stories"))
+        changed_ids = set(story_ids[story["name"]] for story in changed)
+        levels = set(row[0] for row in cursor.execute(
+            "SELECT level FROM levels"))
+
+        # Find the questions the changed stories already have.
+        old_questions = {}
+        for row in cursor.execute("""
+                SELECT story_id, level, question_type, question_num, id
+                FROM questions
+                ORDER BY id"""):
+            if row[0] in changed_ids:
+                old_questions.setdefault(row[:4], []).append(row[4])
+        # New questions get ids that have never been used, even by
+        # questions that were removed but still have responses.
+        next_id = max(first_question_id, cursor.execute("""
+            SELECT MAX(IFNULL((SELECT MAX(id) FROM questions), 0),
+                IFNULL((SELECT MAX(questions_id) FROM responses), 0))
+            """).fetchone()[0] + 1)
+
+        # Questions that are still in the story keep their ids; the rest
+        # are new.
+        question_updates = []
+        question_inserts = []
+        answer_options = []
+        for story in changed:
+            story_id = story_ids[story["name"]]
+            for level, question_num, question_type, target_response, \
+                    responses in story["questions"]:
+                ids = old_questions.get((story_id, level, question_type,
+                    question_num))
+                if ids:
+                    question_id = ids.pop(0)
+                    question_updates.append((target_response, question_id))
+                else:
+                    question_id = next_id
+                    next_id += 1
+                    question_inserts.append((question_id, story_id,
+                        level if level in levels else None, question_num,
+                        question_type, target_response))
+                answer_options.extend((question_id, response)
+                    for response in responses)
+        # Questions the stories don't have anymore.
+        question_deletes = [(question_id,) for ids in old_questions.values()
+            for question_id in ids]
+
+        # Replace the changed stories' answer options and graphics.
+        cursor.executemany("""
+            DELETE FROM responses_in_question
+            WHERE questions_id IN (
+                SELECT id
+                FROM questions
+                WHERE story_id = (?))
+            """, [(story_id,) for story_id in changed_ids])
+        cursor.executemany("DELETE FROM graphics WHERE story_id = (?)",
+            [(story_id,) for story_id in changed_ids])
+
+        cursor.executemany("DELETE FROM questions WHERE id = (?)",
+            question_deletes)
+        cursor.executemany("""
+            UPDATE questions
+            SET target_response = (?)
+            WHERE id = (?)
+            """, question_updates)
+        insert_to_questions_table(cursor, question_inserts)
+        insert_to_responses_table(cursor, answer_options)
+        insert_to_graphics_table(cursor, [(story_ids[story["name"]],
+            level if level in levels else None, scene_num, graphic)
+            for story in changed
+            for level, scene_num, graphic in story["graphics"]])
+
+        # Remember what each story looked like, so we can skip it next
+        # time if it hasn't changed.
+        cursor.executemany("""
+            INSERT OR REPLACE INTO story_hashes (story_id, content_hash)
+            VALUES (?, ?)
+            """, [(story_ids[story["name"]], story["hash"])
+                for story in changed])
+
+        # Let anyone with the catalog loaded know it changed.
+        bump_catalog_version(cursor)
+    return status
+
+
+def bump_catalog_version(cursor):
+    """ Change the catalog version stamp, so copies of the story catalog
+    kept in memory by running games are reloaded.
+    """
+    cursor.execute("UPDATE catalog_version SET version = version + 1")
+
+
+def insert_to_stories_table(cursor, story_names):
+    """ Add stories to the stories table, skipping any that are already
+    there.
+    """
+    # story_name = The story's unique tag string.
+    cursor.executemany("""
+        INSERT OR IGNORE INTO stories (story_name)
+        VALUES (?)
+        """, [(name.lower(),) for name in story_names])
+
+
+def insert_to_graphics_table(cursor, graphics):
+    """ Add graphics to the graphics table."""
+    # Each graphic is (story_id, level, scene, graphic filename), where
+    # scene is the scene number (1,2,3,4) to load the graphic into.
+    cursor.executemany("""
         INSERT INTO graphics (story_id, level, scene_num, graphic)
-        VALUES (
-            (SELECT id FROM stories WHERE story_name=(?)),
-            (SELECT level FROM levels WHERE level=(?)),
-            (?),
-            (?))
-        """, (story_name.lower(), level, scene, graphic_name))
-    return graphic_name.replace(".png", "")
-
-
-def insert_to_questions_table(cursor, story, level, question_num,
-        question_type, target_response):
-    """ Add a question to the questions table."""
-    # story = Story this question belongs to
+        VALUES (?, ?, ?, ?)
+        """, graphics)
+
+
+def insert_to_questions_table(cursor, questions):
+    """ Add questions to the questions table."""
+    # Each question is (id, story_id, level, question_num, question_type,
+    # target_response), where:
     # level = Level of the story (some levels have more questions)
     # question_num = Number of question in the story (1,2,3).
     # question_type = Emotion, order, or midway ToM question.
     # target_response = Correct answer (emotion or scene name).
-    print("ADD QUESTION: " + story + "-" + str(level) + " " + question_type +
-        " " + str(question_num) + ": " + target_response)
-    cursor.execute("""
-        INSERT INTO questions (story_id, level, question_num, question_type,
-            target_response)
-        VALUES (
-            (SELECT id
-                FROM stories
-                WHERE story_name=(?)),
-            (SELECT level
-                FROM levels
-                WHERE level=(?)),
-            (?),
-            (?),
-            (?))
-        """, (story, level, question_num, question_type, target_response))
-
-
-def insert_to_responses_table(cursor, story, level, question_num,
-        question_type, responses):
-    """ Add a question-response pair to the responses table. """
-    # question_id = The id of the question in the questions table.
-    # emotion = Emotion string.
-    print("ADD RESPONSES: " + story + "-" + str(level) + " " + question_type +
-        " " + str(question_num) + ": " + str(responses))
-    for response in responses:
+    cursor.executemany("""
+        INSERT INTO questions (id, story_id, level, question_num,
+            question_type, target_response)
+        VALUES (?, ?, ?, ?, ?, ?)
+        """, questions)
+
+
+def insert_to_responses_table(cursor, responses):
+    """ Add question-response pairs to the responses_in_question table. """
+    # Each response is (question_id, response), where question_id is
+    # the id of the question in the questions table. Blank responses
+    # are skipped.
+    rows = []
+    for question_id, response in responses:
         resp = response.strip().replace(" ", "")
         if (resp == ""):
             continue
-        cursor.execute("""
-            INSERT INTO responses_in_question (questions_id, response)
-            VALUES (
-                (SELECT id
-                    FROM questions
-                    WHERE level=(?)
-                    AND question_num=(?)
-                    AND question_type=(?)
-                    AND story_id
-                        IN (
-                        SELECT id
-                        FROM stories
-                        WHERE story_name=(?))),
-                (?))
-            """, (level, question_num, question_type, story, resp))
+        rows.append((question_id, resp))
+    cursor.executemany("""
+        INSERT INTO responses_in_question (questions_id, response)
+        VALUES (?, ?)
+        """, rows)
 
 
 def fill_levels_table(cursor):
-    """ Initialize levels table. """
+    """ Initialize levels table, skipping levels that are already
+    there.
+    """
     # level = The level number.
     # num_answers = The number of answer options for questions asked
     # about the story this level.
     # in_order = Whether the scenes for stories at that level are shown
     # in order (1=True) or out of order (0=False).
-    try:
-        cursor.execute("""
-            INSERT INTO levels (level, num_answers, in_order)
-            VALUES
-            ("1", "3", "1"),
-            ("2", "3", "1"),
-            ("3", "3", "1"),
-            ("4", "3", "1"),
-            ("5", "3", "0"),
-            ("6", "4", "0"),
-            ("7", "4", "0"),
-            ("8", "4", "0"),
-            ("9", "4", "0"),
-            ("10", "5", "0"),
-            ("11", "4", "0"),
-            ("12", "4", "0")
-            """)
-    except sqlite3.IntegrityError as e:
-        print("Error adding levels to DB! They may already exist. Exception: "
-                + str(e))
-
-
-def generate_script_for_story(output_dir, story_name, level, story, questions,
-        midway_questions, graphic_names):
+    cursor.executemany("""
+        INSERT OR IGNORE INTO levels (level, num_answers, in_order)
+        VALUES (?, ?, ?)
+        """, LEVELS)
+
+
+def generate_script_for_story(story_name, level, story, questions,
+        midway_questions, graphic_names, verbose=True):
     """ Using the provided story text, generate a game script with the
-    instructions for loading and playing the story with a robot.
+    instructions for loading and playing the story with a robot. Return
+    the contents of the script.
     """
-    print("Generating script for story: " + story_name + "-" + str(level))
+    _say(verbose, "Generating script for story: " + story_name + "-"
+        + str(level))
 
-    # Open file for game script for this story.
-    with open(output_dir + story_name + "-" + str(level) + ".txt", "w+") as f:
+    # Build the game script for this story in memory.
+    with closing(StringIO()) as f:
         # Add story to script as one line for the robot to say.
         # We can't split on sentences because splitting by period may
         # make some quoted speech in the stories be split onto multiple
@@ -398,7 +1024,7 @@ def generate_script_for_story(output_dir, story_name, level, story, questions,
                     f.write("ROBOT\tDO\t" + s[0].strip() + "\n")
                     # Add midway question
                     add_question_to_script(midway_questions[0], f,
-                            graphic_names[story_name], level)
+                            graphic_names, level)
                     # Add second half of story.
                     f.write("ROBOT\tDO\t" + s[1].strip() + "\n")
                 else:
@@ -419,7 +1045,20 @@ def generate_script_for_story(output_dir, story_name, level, story, questions,
 
         # Then add questions!
         for question in questions:
-            add_question_to_script(question, f, graphic_names[story_name], level)
+            add_question_to_script(question, f, graphic_names, level)
+
+        return f.getvalue()
+
+
+def write_story_script(output_dir, story_name, level, script):
+    """ Save a generated story script. The script is written to a
+    temporary file and then moved into place, so a game that is loading
+    the script reads either the old one or the new one.
+    """
+    filename = output_dir + story_name + "-" + str(level) + ".txt"
+    with open(filename + ".tmp", "w+") as f:
+        f.write(script)
+    os.rename(filename + ".tmp", filename)
 
 
 def find_character(words):
@@ -0,0 +1,164 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2016 Personal Robots Group
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import logging # log messages
+import Queue # responses waiting to be written
+import threading # for the writer thread
+import time # to time writes
+from ss_db_manager import ss_db_manager # writes the responses
+
+class ss_response_recorder():
+    """ Records responses to questions in the database from a writer
+    thread, so the game doesn't wait for the database before the robot
+    reacts to a response. Responses wait in a bounded queue; the writer
+    thread has its own database connection and writes all the responses
+    that are waiting in one transaction.
+    """
+
+    # Most responses written in one transaction.
+    MAX_BATCH = 100
+
+    def __init__(self, database, options=None, queue_size=1000):
+        """ Connect to the database and start the writer thread. """
+        # Set up logger.
+        self._logger = logging.getLogger(__name__)
+
+        # The game's own connection has already brought the database up
+        # to date, and we only insert, so there's no need to migrate or
+        # to copy the catalog.
+        writer_options = dict(options) if options is not None else {}
+        writer_options["migrate"] = False
+        writer_options["memory_catalog"] = False
+        self._db_man = ss_db_manager(database, writer_options)
+
+        # Each response is (stories_played id, question id, response).
+        # None tells the writer thread to stop.
+        self._queue = Queue.Queue(queue_size)
+
+        # Counters, for seeing how far behind the writer gets.
+        self._stats_lock = threading.Lock()
+        self.recorded = 0
+        self.written = 0
+        self.failed = 0
+        self.batches = 0
+        self.waits = 0
+        self.max_queue_depth = 0
+        self.max_batch_ms = 0.0
+
+        self._thread = threading.Thread(target=self._write_responses,
+            name="ss_response_recorder")
+        # Don't keep the game running if it isn't closed; close() is what
+        # makes sure the responses are written.
+        self._thread.daemon = True
+        self._thread.start()
+
+
+    def record(self, stories_played_id, question_id, response):
+        """ Queue a response to be written. This only waits if the queue
+        is full, i.e., the database is far behind.
+        """
+        item = (stories_played_id, question_id, response)
+        try:
+            self._queue.put_nowait(item)
+        except Queue.Full:
+            self._logger.warning("Response queue is full! Waiting for the "
+                + "database to catch up.")
+            with self._stats_lock:
+                self.waits += 1
+            self._queue.put(item)
+        with self._stats_lock:
+            self.recorded += 1
+            self.max_queue_depth = max(self.max_queue_depth,
+                self._queue.qsize())
+
+
+    def flush(self):
+        """ Wait until every queued response is written and committed. """
+        self._queue.join()
+        self._db_man.flush()
+
+
+    def close(self):
+        """ Write any queued responses, stop the writer thread, and close
+        the database connection.
+        """
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        self._thread.join()
+        self._thread = None
+        self._db_man.close()
+        self._logger.info("Response recorder stats: %s", self.get_stats())
+
+
+    def get_stats(self):
+        """ Return a dict with the number of responses waiting to be
+        written, the most that have waited at once, how many responses
+        were recorded, written, and failed to be written, how many
+        batches they were written in, the longest a batch took to write
+        (in ms), and how many times recording had to wait because the
+        queue was full.
+        """
+        with self._stats_lock:
+            return {"queue_depth": self._queue.qsize(),
+                "max_queue_depth": self.max_queue_depth,
+                "recorded": self.recorded, "written": self.written,
+                "failed": self.failed, "batches": self.batches,
+                "max_batch_ms": self.max_batch_ms, "waits": self.waits}
+
+
+    def _write_responses(self):
+        """ Writer thread: write queued responses until told to stop. """
+        stop = False
+        while not stop:
+            # Wait for a response, then take the rest of the ones that
+            # are waiting too.
+            batch = [self._queue.get()]
+            while batch[-1] is not None and len(batch) < self.MAX_BATCH:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except Queue.Empty:
+                    break
+            if batch[-1] is None:
+                stop = True
+            responses = [item for item in batch if item is not None]
+            if responses:
+                self._write_batch(responses)
+            for item in batch:
+                self._queue.task_done()
+
+
+    def _write_batch(self, responses):
+        """ Write a batch of responses in one transaction. """
+        start = time.time()
+        try:
+            self._db_man.record_responses(responses)
+        except Exception:
+            # The database manager logged what went wrong. Keep going,
+            # so later responses are still written.
+            with self._stats_lock:
+                self.failed += len(responses)
+            return
+        batch_ms = 1000 * (time.time() - start)
+        with self._stats_lock:
+            self.written += len(responses)
+            self.batches += 1
+            self.max_batch_ms = max(self.max_batch_ms, batch_ms)
@@ -0,0 +1,110 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2016 Personal Robots Group
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import random # for picking review stories
+from ss_story_index import story_set # sets of stories
+
+class ss_review_sampler():
+    """ Picks stories for a participant to review. For each participant,
+    it keeps the stories they played in sessions other than the current
+    one, with how many times and when they last played each, so review
+    stories can be picked without querying the database. The random
+    number generator can be seeded so picks are reproducible.
+    """
+
+    def __init__(self, seed=None):
+        """ Set up the random number generator. """
+        self._random = random.Random(seed)
+        # Participants to (current session, dict of story ids to
+        # [times played, last time played], set of those stories).
+        self._participants = {}
+
+
+    def is_loaded(self, participant, current_session):
+        """ Whether we have the participant's review candidates for the
+        current session.
+        """
+        return participant in self._participants \
+            and self._participants[participant][0] == current_session
+
+
+    def load(self, participant, current_session, plays):
+        """ Set the participant's review candidates from a list of (story
+        id, times played, last time played) tuples covering the stories
+        played in sessions other than the current one.
+        """
+        stories = {}
+        for story_id, count, last_time in plays:
+            stories[story_id] = [count, last_time]
+        self._participants[participant] = [current_session, stories,
+            story_set(stories)]
+
+
+    def record_play(self, participant, session, story_id, time):
+        """ Update the participant's review candidates when they play a
+        story. Plays in the current session don't make a story
+        reviewable.
+        """
+        if participant not in self._participants:
+            return
+        entry = self._participants[participant]
+        if session == entry[0]:
+            return
+        if story_id in entry[1]:
+            entry[1][story_id][0] += 1
+            entry[1][story_id][1] = max(entry[1][story_id][1], time)
+        else:
+            entry[1][story_id] = [1, time]
+            entry[2] |= story_set([story_id])
+
+
+    def pick(self, participant, stories):
+        """ Pick one of the participant's review candidates that is in
+        the given set of stories, uniformly at random. Return None if
+        there are none.
+        """
+        candidates = self._participants[participant][2] & stories
+        story_ids = []
+        while candidates:
+            # Take the lowest set bit.
+            lowest = candidates & -candidates
+            story_ids.append(lowest.bit_length() - 1)
+            candidates ^= lowest
+        if not story_ids:
+            return None
+        return self._random.choice(story_ids)
+
+
+    def get_least_reviewed(self, participant, stories):
+        """ Get the participant's review candidate in the given set of
+        stories that was played the fewest times, and of those, the one
+        played least recently. Ties go to the story with the lowest id.
+        Return None if there are none.
+        """
+        best = None
+        for story_id, (count, last_time) in \
+                self._participants[participant][1].items():
+            if not stories & (1 << story_id):
+                continue
+            key = (count, last_time, story_id)
+            if best is None or key < best:
+                best = key
+        return None if best is None else best[2]
@@ -23,38 +23,105 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
-import rospy # ROS
-import datetime # for header times and timeouts
-import time # for sleep
+import json # for batching objects to load
 import logging # log messages
 import Queue # for queuing messages for the main game loop
-from sar_opal_msgs.msg import OpalCommand # ROS msgs to talk to game
-from sar_opal_msgs.msg import OpalAction # ROS msgs for game actions
-from sar_robot_command_msgs.msg import RobotCommand # ROS msgs for robot cmd
-from sar_robot_command_msgs.msg import RobotState # ROS msgs for robot state
-from std_msgs.msg import Header # standard ROS msg header
-from sar_game_command_msgs.msg import GameState # ROS msgs for game state
-from sar_game_command_msgs.msg import GameCommand # ROS msgs for game commands
+from ss_clock import ss_real_clock # for timing out waits
+from ss_clock import ss_event # for signaling when responses arrive
 
 class ss_ros():
     """ ROS node: set up rostopics we publish, subscribe to rostopics
-    we care about, functions to send and receive messages.
+    we care about, functions to send and receive messages. The messages
+    go over a transport: ROS (ss_rospy_transport), or an in-process bus
+    (ss_local_transport) for running without ROS.
     """
-    # Set up rostopics we publish: commands to the game (on a tablet or on a
-    # PC/touchscreen), commands to the robot, and game state messages.
-    _game_pub = rospy.Publisher('/sar/opal_command', OpalCommand,
-            queue_size = 10)
-    _robot_pub = rospy.Publisher('/sar/robot_command', RobotCommand,
-            queue_size = 10)
-    _state_pub = rospy.Publisher('/sar/game_state', GameState, queue_size = 10)
+    # How a command uses properties: commands with NO_PROPERTIES never
+    # send any; OPTIONAL properties are sent if given; commands that
+    # EXPECT properties are sent with empty properties (and a warning)
+    # if none are given; commands that REQUIRE properties aren't sent
+    # without them.
+    NO_PROPERTIES = "none"
+    OPTIONAL = "optional"
+    EXPECTED = "expected"
+    REQUIRED = "required"
 
+    # The Opal commands we can send, by name, with the name of the
+    # OpalCommand constant for each and how it uses properties. Names
+    # have to match exactly. Scripts use HIGHLIGHT for HIGHLIGHT_OBJECT.
+    # We look up the constants in the transport's message classes when
+    # we start.
+    OPAL_COMMANDS = {
+        "RESET": ("RESET", NO_PROPERTIES),
+        "DISABLE_TOUCH": ("DISABLE_TOUCH", NO_PROPERTIES),
+        "ENABLE_TOUCH": ("ENABLE_TOUCH", NO_PROPERTIES),
+        # Properties: a string with the name of action to do.
+        "SIDEKICK_DO": ("SIDEKICK_DO", OPTIONAL),
+        # Properties: a string with the name of audio file to play.
+        "SIDEKICK_SAY": ("SIDEKICK_SAY", REQUIRED),
+        # Properties: JSON defining what object to load, or a JSON list
+        # of objects to load.
+        "LOAD_OBJECT": ("LOAD_OBJECT", REQUIRED),
+        # Properties: optionally, string defining what objects to
+        # remove.
+        "CLEAR": ("CLEAR", OPTIONAL),
+        # Properties: JSON defining what object to move where.
+        "MOVE_OBJECT": ("MOVE_OBJECT", REQUIRED),
+        # Properties: a string with name of the object to highlight.
+        "HIGHLIGHT": ("HIGHLIGHT_OBJECT", EXPECTED),
+        "HIGHLIGHT_OBJECT": ("HIGHLIGHT_OBJECT", EXPECTED),
+        "REQUEST_KEYFRAME": ("REQUEST_KEYFRAME", NO_PROPERTIES),
+        "FADE_SCREEN": ("FADE_SCREEN", NO_PROPERTIES),
+        "UNFADE_SCREEN": ("UNFADE_SCREEN", NO_PROPERTIES),
+        "NEXT_PAGE": ("NEXT_PAGE", NO_PROPERTIES),
+        "PREV_PAGE": ("PREV_PAGE", NO_PROPERTIES),
+        "EXIT": ("EXIT", NO_PROPERTIES),
+        # Properties: JSON listing names of objects that are correct or
+        # incorrect.
+        "SET_CORRECT": ("SET_CORRECT", REQUIRED),
+        "SHOW_CORRECT": ("SHOW_CORRECT", NO_PROPERTIES),
+        "HIDE_CORRECT": ("HIDE_CORRECT", NO_PROPERTIES),
+        # Properties: JSON listing scene attributes.
+        "SETUP_STORY_SCENE": ("SETUP_STORY_SCENE", REQUIRED),
+        }
+
+    # The robot commands we can send, by name, with the name of the
+    # RobotCommand constant for each and how it uses properties.
+    ROBOT_COMMANDS = {
+        "SLEEP": ("SLEEP", NO_PROPERTIES),
+        "WAKEUP": ("WAKEUP", NO_PROPERTIES),
+        # DO commands take properties in the form of a string containing
+        # text to say and/or actions to do.
+        "DO": ("DO", REQUIRED),
+        }
+
+
+    def __init__(self, queue, batch_opal_loads=False, transport=None,
+            clock=None):
+        """ Initialize ROS, or whichever transport we were given. """
+        # Use ROS unless we're told otherwise.
+        if transport is None:
+            from ss_rospy_transport import ss_rospy_transport
+            transport = ss_rospy_transport()
+        self._transport = transport
+
+        # Time out waits with the clock we were given, or in real time.
+        self._clock = clock if clock is not None else ss_real_clock()
+
+        # Look up the constant for each command we can send.
+        self._opal_commands = self._get_constants(self.OPAL_COMMANDS,
+                transport.OpalCommand)
+        self._robot_commands = self._get_constants(self.ROBOT_COMMANDS,
+                transport.RobotCommand)
 
-    def __init__(self, queue):
-        """ Initialize ROS """
         # We get a reference to the main game node's queue so we can
         # give it messages.
         self._game_node_queue = queue
 
+        # Whether the Opal game takes a list of objects in one
+        # LOAD_OBJECT command. Older versions only take one object per
+        # command, so we only batch when told to.
+        self._batch_opal_loads = batch_opal_loads
+
         # Set up logger
         self._logger = logging.getLogger(__name__)
         self._logger.info("Subscribing to topics: /sar/opal_action, " +
@@ -67,129 +134,92 @@ class ss_ros():
         self._response_received = None
         self._touched_object = ""
 
+        # Set up events that the subscriber callbacks set when a response
+        # arrives, one for each kind of response we can wait for. Whoever
+        # is waiting for a response blocks on the matching event, so
+        # they wake up as soon as the response arrives.
+        self._start_event = ss_event()
+        self._correct_incorrect_event = ss_event()
+        self._robot_not_speaking_event = ss_event()
+
+        # Set up rostopics we publish: commands to the game (on a tablet
+        # or on a PC/touchscreen), commands to the robot, and game state
+        # messages.
+        self._game_pub = transport.publisher('/sar/opal_command',
+                transport.OpalCommand, queue_size = 10)
+        self._robot_pub = transport.publisher('/sar/robot_command',
+                transport.RobotCommand, queue_size = 10)
+        self._state_pub = transport.publisher('/sar/game_state',
+                transport.GameState, queue_size = 10)
+
         # Subscribe to messages from opal game.
-        rospy.Subscriber('/sar/opal_action', OpalAction,
+        transport.subscribe('/sar/opal_action', transport.OpalAction,
                 self.on_opal_action_msg)
         # Subscribe to messages about the robot's state.
-        rospy.Subscriber('/sar/robot_state', RobotState, self.on_robot_state_msg)
+        transport.subscribe('/sar/robot_state', transport.RobotState,
+                self.on_robot_state_msg)
         # Subscribe to game commands (commands we are sent to start, pause,
         # and stop the game).
-        rospy.Subscriber('/sar/game_command', GameCommand,
+        transport.subscribe('/sar/game_command', transport.GameCommand,
                 self.on_game_command_msg)
 
 
+    @staticmethod
+    def _get_constants(commands, msg_class):
+        """ Replace the name of each command's message constant in a
+        table of commands with the constant from the message class.
+        """
+        return dict((command, (getattr(msg_class, constant), uses_properties))
+                for command, (constant, uses_properties) in commands.items())
+
+
     def send_opal_command(self, command, properties=None, response=None,
             timeout=None):
         """ Publish opal command message. Optionally, wait for a
         response.
         """
         self._logger.info("Sending opal command: " + command)
-        # Build message.
-        msg = OpalCommand()
-        # Add header.
-        msg.header = Header()
-        msg.header.stamp = rospy.Time.now()
-        # Add appropriate command and properties if there are any.
-        # We check properties for each command individually, since some
-        # require properties, and if there are none, we shouldn't send
-        # the message. We assume any properties provided are in the
-        # correct format for the command.
-        if "RESET" in command:
-            msg.command = OpalCommand.RESET
-        elif "DISABLE_TOUCH" in command:
-            msg.command = OpalCommand.DISABLE_TOUCH
-        elif "ENABLE_TOUCH" in command:
-            msg.command = OpalCommand.ENABLE_TOUCH
-        elif "SIDEKICK_DO" in command:
-            msg.command = OpalCommand.SIDEKICK_DO
-            # Properties: a string with the name of action to do.
-        elif "SIDEKICK_SAY" in command:
-            msg.command = OpalCommand.SIDEKICK_SAY
-            # Properties: a string with the name of audio file to play.
-            if properties:
-                msg.properties = properties
-            else:
-                self._logger.warning("Did not get properties for a "
-                    + "SIDEKICK_SAY command! Not sending empty command.")
-                return
-        elif "LOAD_OBJECT" in command:
-            msg.command = OpalCommand.LOAD_OBJECT
-            # Properties: JSON defining what object to load.
-            if properties:
-                msg.properties = properties
-            else:
-                self._logger.warning("Did not get properties for a "
-                    + "LOAD_OBJECT command! Not sending empty command.")
-                return
-        elif "CLEAR" in command:
-            msg.command = OpalCommand.CLEAR
-            # Properties: optionally, string defining what objects to
-            # remove.
-            if properties:
-                msg.properties = properties
-        elif "MOVE_OBJECT" in command:
-            msg.command = OpalCommand.MOVE_OBJECT
-            # Properties: JSON defining what object to move where.
-            if properties:
-                msg.properties = properties
-            else:
-                self._logger.warning("Did not get properties for a "
-                    + "MOVE_OBJECT command! Not sending empty command.")
-                return
-        elif "HIGHLIGHT" in command:
-            msg.command = OpalCommand.HIGHLIGHT_OBJECT
-            # Properties: a string with name of the object to highlight.
-            if properties:
-                msg.properties = properties
-            else:
-                self._logger.warning("Did not get properties for a "
-                    + "HIGHLIGHT_OBJECT command! Adding null properties.")
-        elif "REQUEST_KEYFRAME" in command:
-            msg.command = OpalCommand.REQUEST_KEYFRAME
-        elif "FADE_SCREEN" in command:
-            msg.command = OpalCommand.FADE_SCREEN
-        elif "UNFADE_SCREEN" in command:
-            msg.command = OpalCommand.UNFADE_SCREEN
-        elif "NEXT_PAGE" in command:
-            msg.command = OpalCommand.NEXT_PAGE
-        elif "PREV_PAGE" in command:
-            msg.command = OpalCommand.PREV_PAGE
-        elif "EXIT" in command:
-            msg.command = OpalCommand.EXIT
-        elif "SET_CORRECT" in command:
-            msg.command = OpalCommand.SET_CORRECT
-            # Properties: JSON listing names of objects that are
-            # correct or incorrect.
-            if properties:
-                msg.properties = properties
-            else:
-                self._logger.warning("Did not get properties for a "
-                    + "SET_CORRECT command! Not sending empty command.")
-                return
-        elif "SHOW_CORRECT" in command:
-            msg.command = OpalCommand.SHOW_CORRECT
-        elif "HIDE_CORRECT" in command:
-            msg.command = OpalCommand.HIDE_CORRECT
-        elif "SETUP_STORY_SCENE" in command:
-            msg.command = OpalCommand.SETUP_STORY_SCENE
-            # Properties: JSON listing scene attributes.
-            if properties:
-                msg.properties = properties
-            else:
-                self._logger.warning("Did not get properties for a "
-                    + "SETUP_STORY_SCENE command! Not sending empty command.")
-                return
-        else:
-            self._logger.warning("Not sending invalid OpalCommand: ", command)
+        msg = self._encode_opal_command(command, properties)
+        if msg is None:
             return
+
+        # If we got a response to wait for and a timeout value, get
+        # ready to wait for it before sending the message, so we don't
+        # miss a response that arrives right away.
+        event = None
+        if response and timeout:
+            event = self._prepare_to_wait(response)
+
         # Send message.
         self._game_pub.publish(msg)
         self._logger.debug(msg)
 
-        # If we got a response to wait for and a timeout value, wait
-        # for a response.
-        if response and timeout:
-            self.wait_for_response(response, timeout)
+        # Wait for the response, if there is one to wait for.
+        if event is not None:
+            self._wait(event, response, timeout)
+
+
+    def send_opal_load_objects(self, objects):
+        """ Load several objects into the Opal game, e.g., all the
+        scenes of a story or all the answer options for a question. Each
+        object is a JSON string with the properties of one object. If the
+        game takes batches, they all go in one LOAD_OBJECT command whose
+        properties are a JSON list of the objects, so a burst of loads
+        doesn't overflow the publisher's queue; otherwise, each object
+        gets its own LOAD_OBJECT command.
+        """
+        if self._batch_opal_loads and len(objects) > 1:
+            try:
+                batch = json.dumps([json.loads(obj) for obj in objects])
+            except ValueError:
+                self._logger.warning("Could not batch objects to load, since "
+                    + "they aren't all valid JSON! Loading them one at a "
+                    + "time.")
+            else:
+                self.send_opal_command("LOAD_OBJECT", batch)
+                return
+        for obj in objects:
+            self.send_opal_command("LOAD_OBJECT", obj)
 
 
     def send_robot_command(self, command, properties=None, response=None,
@@ -198,47 +228,87 @@ class ss_ros():
         response.
         """
         self._logger.info("Sending robot command: " + str(command))
-        # Build message.
-        msg = RobotCommand()
-        # Add header.
-        msg.header = Header()
-        msg.header.stamp = rospy.Time.now()
-        # Add appropriate command.
-        if "SLEEP" in command:
-            msg.command = RobotCommand.SLEEP
-        elif "WAKEUP" in command:
-            msg.command = RobotCommand.WAKEUP
-        elif "DO" in command:
-            msg.command = RobotCommand.DO
-            # DO commands take properties in the form of a string
-            # contianing text to say and/or actions to do. We assume
-            # these are provided in the correct string format.
-            if properties:
-                msg.properties = properties
-            else:
-                self._logger.warning("Did not get properties for a DO command! "
-                        + "Not sending empty command.")
-                return
-        msg.interrupt = False
+        msg = self._encode_robot_command(command, properties)
+        if msg is None:
+            return
+
+        # If we got a response to wait for and a timeout value, get
+        # ready to wait for it before sending the message, so we don't
+        # miss a response that arrives right away.
+        # Timeout should be a datetime.timedelta object.
+        event = None
+        if response and timeout:
+            event = self._prepare_to_wait(response)
+
         # Send message.
         self._robot_pub.publish(msg)
         self._logger.debug(msg)
 
-        # If we got a response to wait for and a timeout value, wait
-        # for a response.
-        # Timeout should be a datetime.timedelta object.
-        if response and timeout:
-            self.wait_for_response(response, timeout)
+        # Wait for the response, if there is one to wait for.
+        if event is not None:
+            self._wait(event, response, timeout)
+
+
+    def _encode_opal_command(self, command, properties=None):
+        """ Build an OpalCommand message for a command. Return None if
+        the command isn't valid or is missing properties it needs.
+        """
+        msg = self._transport.OpalCommand()
+        msg.header.stamp = self._transport.now()
+        if not self._encode(self._opal_commands, msg, "OpalCommand", command,
+                properties):
+            return None
+        return msg
+
+
+    def _encode_robot_command(self, command, properties=None):
+        """ Build a RobotCommand message for a command. Return None if
+        the command isn't valid or is missing properties it needs.
+        """
+        msg = self._transport.RobotCommand()
+        msg.header.stamp = self._transport.now()
+        if not self._encode(self._robot_commands, msg, "RobotCommand", command,
+                properties):
+            return None
+        msg.interrupt = False
+        return msg
+
+
+    def _encode(self, commands, msg, kind, command, properties):
+        """ Fill in a message's command, and its properties if the
+        command uses them, from a table of commands. Return False, after
+        logging why, if the message shouldn't be sent.
+        """
+        try:
+            constant, uses_properties = commands[command]
+        except KeyError:
+            self._logger.warning("Not sending invalid " + kind + ": "
+                + str(command))
+            return False
+        msg.command = constant
+        # We assume any properties provided are in the correct format
+        # for the command.
+        if properties and uses_properties != self.NO_PROPERTIES:
+            msg.properties = properties
+        elif uses_properties == self.REQUIRED:
+            self._logger.warning("Did not get properties for a " + command
+                + " command! Not sending empty command.")
+            return False
+        elif uses_properties == self.EXPECTED:
+            self._logger.warning("Did not get properties for a " + command
+                + " command! Adding null properties.")
+        return True
 
 
     def send_game_state(self, state, performance=None):
         """ Publish a game state message. """
         self._logger.info("Sending game state: " + str(state))
+        GameState = self._transport.GameState
         # Build message.
         msg = GameState()
         # Add header.
-        msg.header = Header()
-        msg.header.stamp = rospy.Time.now()
+        msg.header = self._transport.Header()
+        msg.header.stamp = self._transport.now()
         # Add constant indicating which game we are.
         msg.game = GameState.STORYTELLING
         # Add appropriate state.
@@ -269,6 +339,7 @@ class ss_ros():
         """ Called when we receive GameCommand messages """
         self._logger.info("Received GameCommand message: GAME=" +
                 str(data.game) + ", COMMAND=" + str(data.command))
+        GameCommand = self._transport.GameCommand
         # If the game field doesn't list the constant referring to this
         # game, we can ignore the message.
         if GameCommand.STORYTELLING is not data.game:
@@ -304,8 +375,8 @@ class ss_ros():
         # responses from the user. So we only care whether the action
         # was a PRESS and whether it was on an object that is used as
         # a START button or is a CORRECT or INCORRECT response
-        # object. When we do get one of these messages, set the
-        # relevant flag.
+        # object. When we do get one of these messages, save the
+        # response and set the relevant event.
         if "tap" in data.action:
             # objectName, position
             pass
@@ -313,11 +384,10 @@ class ss_ros():
             # objectName, position
             # Check if START was in the message.
             if "START" in data.message:
-                self.start_response_received = True
                 self._response_received = data.message
+                self._start_event.set()
             # Check if CORRECT was in the message.
             if "CORRECT" in data.message:
-                self._correct_incorrect_response_received = True
                 self._response_received = data.message
                 try:
                     # Assumes answer graphic names follow the pattern
@@ -332,6 +402,9 @@ class ss_ros():
                     self._logger.warning("Tried to get name of touched object "
                             + "that was correct or incorrect, but could not "
                             + "parse it: " + str(data.objectName))
+                # Set the event after saving the touched object, so
+                # anyone waiting gets the whole response.
+                self._correct_incorrect_event.set()
             pass
         elif "release" in data.action:
             # No object
@@ -356,6 +429,12 @@ class ss_ros():
         # whether the robot is in motion or playing sound or not.
         self._robot_speaking = data.is_playing_sound
         self._robot_doing_action = data.doing_action
+        # Let anyone waiting for the robot to finish know whether it is
+        # done speaking and acting.
+        if not self._robot_speaking and not self._robot_doing_action:
+            self._robot_not_speaking_event.set()
+        else:
+            self._robot_not_speaking_event.clear()
         self._logger.info("Received RobotState message: doing_action="
                 + str(data.doing_action) + ", playing_sound="
                 + str(data.is_playing_sound))
@@ -367,53 +446,48 @@ class ss_ros():
         """ Wait for particular user or robot responses for the
         specified amount of time.
         """
-        # Check what response to wait for, set that response received
-        # flag to false.
+        event = self._prepare_to_wait(response)
+        if event is None:
+            return
+        return self._wait(event, response, timeout)
+
+
+    def _prepare_to_wait(self, response):
+        """ Get ready to wait for a response: clear the event for that
+        kind of response, so we only count responses that arrive from
+        now on, and return the event. Return None if we can't wait for
+        that response.
+        """
         # Valid responses to wait for are:
         # START, CORRECT_INCORRECT, ROBOT_NOT_SPEAKING
         if "START" in response:
-            self.start_response_received = False
-            self._waiting_for_start = True
-            self._waiting_for_correct_incorrect = False
-            self._waiting_for_robot_speaking = False
+            event = self._start_event
         elif "CORRECT" in response:
-            self._correct_incorrect_response_received = False
-            self._waiting_for_start = False
-            self._waiting_for_correct_incorrect = True
-            self._waiting_for_robot_speaking = False
+            event = self._correct_incorrect_event
         elif "ROBOT_NOT_SPEAKING" in response:
+            # Assume the robot is going to speak, so we wait for the
+            # next robot state message saying it is done.
             self._robot_speaking = True
-            self._waiting_for_start = False
-            self._waiting_for_correct_incorrect = False
-            self._waiting_for_robot_speaking = True
+            event = self._robot_not_speaking_event
         else:
             self._logger.warning("Told to wait for " + response + " but that " +
                 "isn't one of the allowed responses to wait for!")
-            return
+            return None
+        event.clear()
+        return event
+
 
+    def _wait(self, event, response, timeout):
+        """ Block until the event for a response is set or the timeout
+        (a datetime.timedelta) elapses on our clock. The subscriber
+        callbacks set the event, so we wake up as soon as the response
+        arrives.
+        """
         self._logger.info("waiting for " + response + "...")
-        start_time = datetime.datetime.now()
-        while datetime.datetime.now() - start_time < timeout:
-            time.sleep(0.1)
-            # Check periodically whether we've received the response we
-            # were waiting for, and if so, we're done waiting.
-            if (self._waiting_for_start and self.start_response_received) \
-                    or (self._waiting_for_correct_incorrect and \
-                        self._correct_incorrect_response_received) \
-                    or (self._waiting_for_robot_speaking \
-                    and not self._robot_speaking \
-                    and not self._robot_doing_action):
-                self._logger.info("Got " + response + " response!")
-                # Reset waiting flags
-                self._waiting_for_start = False
-                self._waiting_for_correct_incorrect = False
-                self._waiting_for_robot_speaking = False
-                return self._response_received, self._touched_object
+        if self._clock.wait(event, timeout.total_seconds()):
+            self._logger.info("Got " + response + " response!")
+            return self._response_received, self._touched_object
         # If we don't get the response we were waiting for, we're done
         # waiting and timed out.
-        self._waiting_for_start = False
-        self._waiting_for_correct_incorrect = False
-        self._waiting_for_robot_speaking = False
         self._logger.info("Timed out! Moving on...")
         return "TIMEOUT", ""
-
@@ -0,0 +1,69 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2016 Personal Robots Group
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import rospy # ROS
+from sar_opal_msgs.msg import OpalCommand # ROS msgs to talk to game
+from sar_opal_msgs.msg import OpalAction # ROS msgs for game actions
+from sar_robot_command_msgs.msg import RobotCommand # ROS msgs for robot cmd
+from sar_robot_command_msgs.msg import RobotState # ROS msgs for robot state
+from std_msgs.msg import Header # standard ROS msg header
+from sar_game_command_msgs.msg import GameState # ROS msgs for game state
+from sar_game_command_msgs.msg import GameCommand # ROS msgs for game commands
+
+class ss_rospy_transport():
+    """ Transport for ss_ros that uses ROS: starts our ROS node, and
+    publishes and subscribes to rostopics with the sar_* ROS messages.
+    """
+    Header = Header
+    OpalCommand = OpalCommand
+    OpalAction = OpalAction
+    RobotCommand = RobotCommand
+    RobotState = RobotState
+    GameState = GameState
+    GameCommand = GameCommand
+
+    def __init__(self, node_name="social_story_game"):
+        """ Initialize the ROS node. """
+        # TODO If running on network where DNS does not resolve local
+        # hostnames, get the public IP address of this machine and
+        # export to the environment variable $ROS_IP to set the public
+        # address of this node, so the user doesn't have to remember
+        # to do this before starting the node.
+        rospy.init_node(node_name, anonymous=True)
+                # We could set the ROS log level here if we want:
+                #log_level=rospy.DEBUG)
+                # The rest of our logging is set up in the log config file.
+
+
+    def publisher(self, topic, msg_class, queue_size=None):
+        """ Get a ROS publisher for a rostopic. """
+        return rospy.Publisher(topic, msg_class, queue_size=queue_size)
+
+
+    def subscribe(self, topic, msg_class, callback):
+        """ Subscribe to a rostopic. """
+        return rospy.Subscriber(topic, msg_class, callback)
+
+
+    def now(self):
+        """ Get a ROS time stamp for a message header. """
+        return rospy.Time.now()
@@ -0,0 +1,121 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2016 Personal Robots Group
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import logging # log messages
+import os # for walking the script directory and file paths
+import sqlite3 # the bundle is an SQLite database
+
+class ss_script_bundle():
+    """ Read game scripts from a script bundle: a single file holding all
+    the session scripts, story scripts, and response lists from a game
+    script directory. The bundle is opened once, and each script can be
+    read by name without touching any other files. Scripts are named by
+    their path relative to the game script directory, for example,
+    "session_scripts/demo.txt".
+    """
+
+    def __init__(self, bundle_file):
+        """ Open the bundle """
+        # Set up logger.
+        self._logger = logging.getLogger(__name__)
+
+        # Save the bundle's path and modification time, so cached
+        # scripts from the bundle can be invalidated when it changes.
+        self.path = os.path.abspath(bundle_file)
+        try:
+            self.mtime = os.path.getmtime(self.path)
+        except OSError as e:
+            self._logger.exception("Cannot open script bundle: " + bundle_file)
+            raise IOError(e.errno, e.strerror, bundle_file)
+
+        self._conn = sqlite3.connect(self.path)
+        # Return scripts as byte strings, the same as reading them from
+        # their files would.
+        self._conn.text_factory = str
+        self._logger.info("Opened script bundle " + bundle_file)
+
+
+    def __del__(self):
+        """ Destructor. """
+        # Close the bundle.
+        if hasattr(self, "_conn"):
+            self._conn.close()
+
+
+    def read_lines(self, name):
+        """ Return a list of the lines in the named script. Raise an
+        IOError if there's no script with that name in the bundle.
+        """
+        result = self._conn.execute("""
+            SELECT content
+            FROM scripts
+            WHERE name = (?)
+            """, (name,)).fetchone()
+        if result is None:
+            raise IOError("No script named " + name + " in bundle " +
+                self.path)
+        return result[0].splitlines(True)
+
+
+    def names(self):
+        """ Return a list of the names of all the scripts in the bundle. """
+        return [row[0] for row in self._conn.execute(
+            "SELECT name FROM scripts ORDER BY name")]
+
+
+def build_bundle(script_dir, bundle_file):
+    """ Pack every script in the game script directory (and its
+    subdirectories) into a bundle file. The bundle is written to a
+    temporary file and then moved into place, so a game node that has the
+    old bundle open keeps reading a complete bundle. Return the number of
+    scripts bundled.
+    """
+    temp_file = bundle_file + ".tmp"
+    if os.path.exists(temp_file):
+        os.remove(temp_file)
+    conn = sqlite3.connect(temp_file)
+    conn.execute("""CREATE TABLE scripts (
+            name        text        PRIMARY KEY,
+            content     text        NOT NULL
+            )""")
+
+    count = 0
+    for dirpath, dirnames, filenames in os.walk(script_dir):
+        # Walk the directories in a consistent order.
+        dirnames.sort()
+        for filename in sorted(filenames):
+            if not filename.endswith(".txt"):
+                continue
+            path = os.path.join(dirpath, filename)
+            # Name scripts by their path relative to the script
+            # directory, always using "/" as the separator.
+            name = os.path.relpath(path, script_dir).replace(os.sep, "/")
+            with open(path, "r") as f:
+                content = f.read()
+            conn.execute("INSERT INTO scripts (name, content) VALUES (?, ?)",
+                (name.decode("utf-8") if isinstance(name, str) else name,
+                content.decode("utf-8")))
+            count += 1
+
+    conn.commit()
+    conn.close()
+    os.rename(temp_file, bundle_file)
+    return count
@@ -0,0 +1,169 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2016 Personal Robots Group
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import logging # log messages
+import os # for file modification times and absolute paths
+import threading # for locking the cache
+from collections import OrderedDict # keeps cache entries in LRU order
+
+class ss_script_cache():
+    """ In-memory cache of compiled scripts and response lists, keyed by
+    the file's absolute path and modification time. Scripts are read from
+    disk only the first time they are needed or after they change. When
+    the cache holds more than its maximum size, the least recently used
+    entries are evicted.
+    """
+
+    # Default maximum size of the cache, in bytes of script text.
+    DEFAULT_MAX_SIZE = 4 * 1024 * 1024
+
+    def __init__(self, max_size=DEFAULT_MAX_SIZE):
+        """ Initialize an empty cache """
+        # Set up logger.
+        self._logger = logging.getLogger(__name__)
+
+        # Entries are kept in least to most recently used order. Each
+        # key maps to the file's modification time, the size of the
+        # file's text, and the cached value.
+        self._entries = OrderedDict()
+        self._size = 0
+        self._max_size = max_size
+        # Several threads may load scripts.
+        self._lock = threading.Lock()
+
+        # Counters so we can tell how well the cache is working.
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+
+    def set_max_size(self, max_size):
+        """ Set the maximum size of the cache (in bytes of script text)
+        and evict entries if the cache is now too big.
+        """
+        with self._lock:
+            self._max_size = max_size
+            self._evict()
+
+
+    def get_script(self, filename, compile_script, bundle=None):
+        """ Get a compiled script. If the script isn't cached or has
+        changed on disk, read it and call compile_script with its lines.
+        If a script bundle is given, the script is read from the bundle
+        instead of from its own file.
+        """
+        return self._get("script", filename, compile_script, bundle)
+
+
+    def get_list(self, filename, bundle=None):
+        """ Get the lines of a file (such as a list of robot responses)
+        as a tuple.
+        """
+        return self._get("list", filename, tuple, bundle)
+
+
+    def get_stats(self):
+        """ Return a dict with the cache's hit, miss, and eviction
+        counters, number of entries, and size.
+        """
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses,
+                "evictions": self.evictions, "entries": len(self._entries),
+                "size": self._size}
+
+
+    def clear(self):
+        """ Remove all entries from the cache. """
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+
+    def _get(self, kind, filename, build, bundle=None):
+        """ Get the cached value for a file, or read the file and build
+        the value with the given function if it isn't cached or has
+        changed on disk.
+        """
+        if bundle is not None:
+            # Scripts in a bundle change when the bundle does.
+            path = bundle.path + ":" + filename
+            mtime = bundle.mtime
+        else:
+            path = os.path.abspath(filename)
+            try:
+                mtime = os.path.getmtime(path)
+            except OSError:
+                # We'll get an IOError when we try to open the file.
+                mtime = None
+        key = (kind, path)
+
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None and mtime is not None and entry[0] == mtime:
+                # Put the entry back as the most recently used one.
+                self._entries[key] = entry
+                self.hits += 1
+                return entry[2]
+            if entry is not None:
+                # The file changed since we cached it.
+                self._size -= entry[1]
+            self.misses += 1
+
+        # Read the file outside the lock so other threads can use the
+        # cache meanwhile. Callers deal with IOErrors.
+        if bundle is not None:
+            lines = bundle.read_lines(filename)
+        else:
+            with open(filename, "r") as fh:
+                lines = fh.readlines()
+        value = build(lines)
+        size = sum(len(line) for line in lines)
+
+        # Don't cache a file we couldn't get a modification time for,
+        # since we couldn't tell if it changed.
+        if mtime is not None and size <= self._max_size:
+            with self._lock:
+                old = self._entries.pop(key, None)
+                if old is not None:
+                    self._size -= old[1]
+                self._entries[key] = (mtime, size, value)
+                self._size += size
+                self._evict()
+        return value
+
+
+    def _evict(self):
+        """ Evict least recently used entries until the cache is no
+        bigger than its maximum size. Call with the lock held.
+        """
+        while self._size > self._max_size and self._entries:
+            key, entry = self._entries.popitem(last=False)
+            self._size -= entry[1]
+            self.evictions += 1
+            self._logger.debug("Evicted " + key[1] + " from script cache.")
+
+
+# The cache shared by everything in this process that loads scripts.
+_script_cache = ss_script_cache()
+
+def get_script_cache():
+    """ Get the process-wide script cache. """
+    return _script_cache
@@ -25,22 +25,25 @@
 
 import sys # For getting generic exception info
 import datetime # For getting time deltas for timeouts
-import time # For sleep
 import json # For packing ros message properties
 import random # For picking robot responses and shuffling answer options
 import logging # Log messages
 import Queue # for queuing messages for the main game loop
 from SS_Errors import NoStoryFound # Custom exception when no stories found
 from ss_script_parser import ss_script_parser # Parses scripts
+from ss_script_parser import ss_opcodes # Kinds of script commands
+from ss_script_cache import get_script_cache # Caches response lists
+from ss_script_bundle import ss_script_bundle # Reads bundled scripts
 from ss_personalization_manager import ss_personalization_manager
 from ss_ros import ss_ros # Our ROS connection
+from ss_clock import ss_real_clock # Tells the time
 
 class ss_script_handler():
     """ Social stories script handler parses and deals with script lines. Uses
-    the script parser to get the next line in a script. We keep loading script
-    lines and parsing script lines separate on the offchance that we might want
-    to replace how scripts are stored and accessed (e.g., in a database versus
-    in text files).
+    the script parser to get the next command in a script. We keep loading
+    script lines and parsing script lines separate on the offchance that we
+    might want to replace how scripts are stored and accessed (e.g., in a
+    database versus in text files).
     """
 
     # Constants for script playback:
@@ -51,11 +54,27 @@ class ss_script_handler():
     # moving on to the next script line (in seconds).
     WAIT_TIME = 30
 
+    # Lists of robot responses that ADD lines can load, and the
+    # variables we save each list in.
+    RESPONSE_LISTS = {
+        "INCORRECT_RESPONSES": "_incorrect_responses",
+        "CORRECT_RESPONSES": "_correct_responses",
+        "START_RESPONSES": "_start_responses",
+        "NO_RESPONSES": "_no_responses",
+        "ANSWER_FEEDBACK": "_answer_feedback",
+        "STORY_INTROS": "_story_intros",
+        "STORY_CLOSINGS": "_story_closings",
+        "TIMEOUT_CLOSINGS": "_timeout_closings",
+        "MAX_STORIES_REACHED": "_max_stories_reached"
+        }
+
     def __init__(self, ros_node, session, participant, script_path,
             story_script_path, session_script_path, database, queue,
-            percent_correct_to_level):
+            percent_correct_to_level, script_bundle=None,
+            database_options=None, clock=None):
         """ Save references to ROS connection and logger, get scripts and
-        set up to read script lines
+        set up to read script lines. We tell the time (for pauses and the
+        max game time) with the given clock, or with the real time.
         """
         # Set up logger.
         self._logger = logging.getLogger(__name__)
@@ -64,8 +83,19 @@ class ss_script_handler():
         # Save reference to our ros node so we can publish messages.
         self._ros_node = ros_node
 
-        # Save script paths so we can load scripts later.
-        self._script_path = script_path
+        # Save the clock we tell the time with.
+        self._clock = clock if clock is not None else ss_real_clock()
+
+        # Save script paths so we can load scripts later. If we were
+        # given a script bundle, we load all our scripts from it, and
+        # name them relative to the game script directory the bundle
+        # was made from.
+        if script_bundle is not None:
+            self._bundle = ss_script_bundle(script_bundle)
+            self._script_path = ""
+        else:
+            self._bundle = None
+            self._script_path = script_path
 
         if (story_script_path is None):
             self._story_script_path = ""
@@ -84,16 +114,29 @@ class ss_script_handler():
         # Set up personalization manager so we can get personalized
         # stories for this participant.
         self._personalization_man = ss_personalization_manager(session,
-                participant, database, percent_correct_to_level)
+                participant, database, percent_correct_to_level,
+                database_options, self._clock)
+
+        # Table of the functions that play back each kind of script
+        # command.
+        self._dispatch = {
+            ss_opcodes.STORY: self._do_story,
+            ss_opcodes.STORY_SETUP: self._do_story_setup,
+            ss_opcodes.ROBOT: self._do_robot,
+            ss_opcodes.OPAL: self._do_opal,
+            ss_opcodes.PAUSE: self._do_pause,
+            ss_opcodes.ADD: self._do_add,
+            ss_opcodes.SET: self._do_set,
+            ss_opcodes.WAIT: self._do_wait,
+            ss_opcodes.QUESTION: self._do_question,
+            ss_opcodes.REPEAT: self._do_repeat
+            }
 
         # Set up script parser.
         self._script_parser = ss_script_parser()
         # These are other script parsers we may use later.
         self._story_parser = None
         self._repeat_parser = None
-        # If we have a repeating script, we will need to save its filename so
-        # we can re-load it when we repeat it.
-        self._repeating_script_name = ""
 
         # Get session script from script parser and give to the script
         # parser. Story scripts we will get later from the
@@ -101,7 +144,8 @@ class ss_script_handler():
         try:
             self._script_parser.load_script(self._script_path
                     + self._session_script_path
-                    + self._script_parser.get_session_script(session))
+                    + self._script_parser.get_session_script(session),
+                    self._bundle)
         except IOError:
             self._logger.exception("Script parser could not open session "
                 + "script!")
@@ -147,7 +191,7 @@ class ss_script_handler():
         self._last_response_timeout = None
 
         # Save start time so we can check whether we've run out of time.
-        self._start_time = datetime.datetime.now()
+        self._start_time = self._clock.now()
 
         # Initialize total time paused.
         self._total_time_paused = datetime.timedelta(seconds=0)
@@ -164,22 +208,24 @@ class ss_script_handler():
             # we load new stories or when we are about to start a
             # repeating script over again.
 
-            # Get next line from story script.
+            # Get next command from story script.
             if self._doing_story and self._story_parser is not None:
-                self._logger.debug("Getting next line from story script.")
-                line = self._story_parser.next_line()
-            # If not in a story, get next line from repeating script.
+                self._logger.debug("Getting next command from story script.")
+                command = self._story_parser.next_command()
+            # If not in a story, get next command from repeating script.
             elif self._repeating and self._repeat_parser is not None:
-                self._logger.debug("Getting next line from repeating script.")
-                line = self._repeat_parser.next_line()
-            # If not repeating, get next line from main session script.
+                self._logger.debug("Getting next command from repeating "
+                        + "script.")
+                command = self._repeat_parser.next_command()
+            # If not repeating, get next command from main session script.
             else:
-                self._logger.debug("Getting next line from main session script.")
-                line = self._script_parser.next_line()
+                self._logger.debug("Getting next command from main session "
+                        + "script.")
+                command = self._script_parser.next_command()
 
-        # We didn't read a line!
+        # We didn't get a command!
         # If we get a stop iteration exception, we're at the end of the
-        # file and will stop iterating over lines.
+        # script and will stop iterating over commands.
         except StopIteration as e:
             # If we were doing a story, now we're done, go back to
             # the previous script.
@@ -198,33 +244,24 @@ class ss_script_handler():
                 # the repeating flag to false).
                 if (self._repetitions >= self._max_repetitions) \
                         or self._end_game \
-                        or ((datetime.datetime.now() - self._start_time) \
+                        or ((self._clock.now() - self._start_time) \
                         - self._total_time_paused >= self._max_game_time):
                     self._logger.info("Done repeating!")
                     self._repeating = False
-                # Otherwise, we need to repeat again. Reload the repeating
-                # script.
+                # Otherwise, we need to repeat again. The repeating
+                # script is already compiled, so just go back to its
+                # start.
                 else:
-                    # Create a script parser for the filename provided,
-                    # assume it is in the session_scripts directory.
-                    self._repeat_parser = ss_script_parser()
-                    try:
-                        self._repeat_parser.load_script(self._script_path
-                                + self._session_script_path
-                                + self._repeating_script_name)
-                    except IOError:
-                        self._logger.exception("Script parser could not open "
-                            + "session script to repeat! Skipping REPEAT line.")
-                        sself._repeating = False
-                        return
+                    self._repeat_parser.rewind()
             # Otherwise we're at the end of the main script.
             else:
                 self._logger.info("No more script lines to get!")
                 # Pass on the stop iteration exception, with additional
                 # information about the player's performance during the
-                # game, formatted as a json object.
+                # game, formatted as a json object. There is no
+                # performance for a DEMO session.
                 emotion, tom, order = self._personalization_man. \
-                    get_performance_this_session()
+                    get_performance_this_session() or (None, None, None)
                 performance = {}
                 if emotion is not None:
                     performance["child-emotion-question-accuracy"] = \
@@ -238,309 +275,225 @@ class ss_script_handler():
                 e.performance = json.dumps(performance)
                 raise
 
-        except ValueError:
-            # We may get this exception if we try to get the next line
-            # but the script file is closed. If that happens, something
-            # probably went wrong with ending playback of a story script
-            # or a repeating script. End repeating and end the current
-            # story so we go back to the main session script.
-            if self._doing_story:
-                self._doing_story = False
-            if self._repeating:
-                self._repeating = False
-
         # Oh no got some unexpected error! Raise it again so we can
         # figure out what happened and deal with it during debugging.
         except Exception as e:
             self._logger.exception("Unexpected exception! Error: %s", e)
             raise
 
-        # We got a line: parse it!
+        # We got a command: do it!
         else:
-            # Make sure we got a line before we try parsing it. We
-            # might not get a line if the file has closed or if
-            # next_line has some other problem.
-            if not line:
-                self._logger.warning("[iterate_once] Tried to get next line, "
-                    + "but got None!")
-                return
-
-            # Got a line - print for debugging.
-            self._logger.debug("LINE: " + repr(line))
-
-            # Parse line!
-            # Split on tabs.
-            elements = line.rstrip().split('\t')
-            self._logger.debug("... " + str(len(elements)) + " elements: \n... "
-                    + str(elements))
-
-            if len(elements) < 1:
-                self._logger.info("Line had no elements! Going to next line...")
-                return
-
-            # Do different stuff depending on what the first element is.
-            #########################################################
-            # Some STORY lines have only one part to the command.
-            elif len(elements) == 1:
-                # For STORY lines, play back the next story for this
-                # participant.
-                if "STORY" in elements[0]:
-                    self._logger.debug("STORY")
-                    # If line indicates we need to start a story, do so.
-                    self._doing_story = True
-                    # Create a script parser for the filename provided,
-                    # assuming it is in the story scripts directory.
-                    self._story_parser = ss_script_parser()
-                    try:
-                        self._story_parser.load_script(self._script_path
-                           + self._story_script_path
-                           + self._personalization_man.get_next_story_script())
-                    except IOError:
-                        self._logger.exception("Script parser could not open "
-                                + "story script! Skipping STORY line.")
-                        self._doing_story = False
-                    except AttributeError:
-                        self._logger.exception("Script parser could not open "
-                                + "story script because no script was loaded! "
-                                + "Skipping STORY line.")
-                        self._doing_story = False
-                    except NoStoryFound:
-                        self._logger.exception("Script parser could not get \
-                                the next story script because no script was \
-                                found by the personalization manager! \
-                                Skipping STORY line.")
-                        self._doing_story = False
-
-            # Line has 2+ elements, so check the other commands.
-            #########################################################
-            # For STORY SETUP lines, pick the next story to play so
-            # we can load its graphics and play back the story.
-            elif "STORY" in elements[0] and "SETUP" in elements[1]:
-                self._logger.debug("STORY SETUP")
-                # Pick the next story to play.
-                self._personalization_man.pick_next_story()
-
-            #########################################################
-            # For ROBOT lines, send command to the robot.
-            elif "ROBOT" in elements[0]:
-                self._logger.debug("ROBOT")
-                # Play a randomly selected story intro from the list.
-                if "STORY_INTRO" in elements[1]:
-                    self._ros_node.send_robot_command("DO",
-                        response="ROBOT_NOT_SPEAKING",
-                        timeout=datetime.timedelta(seconds=int(
-                            self.WAIT_TIME)),
-                        properties=self._story_intros[
-                            random.randint(0,len(self._story_intros)-1)])
+            # Got a command - print for debugging.
+            self._logger.debug("LINE: " + repr(command.line))
+            self._dispatch[command.opcode](*command.args)
+
+
+    def _do_story(self):
+        """ STORY: play back the next story for this participant. """
+        self._logger.debug("STORY")
+        # If line indicates we need to start a story, do so.
+        self._doing_story = True
+        # Create a script parser for the filename provided,
+        # assuming it is in the story scripts directory.
+        self._story_parser = ss_script_parser()
+        try:
+            self._story_parser.load_script(self._script_path
+               + self._story_script_path
+               + self._personalization_man.get_next_story_script(),
+               self._bundle)
+        except IOError:
+            self._logger.exception("Script parser could not open "
+                    + "story script! Skipping STORY line.")
+            self._doing_story = False
+        except AttributeError:
+            self._logger.exception("Script parser could not open "
+                    + "story script because no script was loaded! "
+                    + "Skipping STORY line.")
+            self._doing_story = False
+        except NoStoryFound:
+            self._logger.exception("Script parser could not get \
+                    the next story script because no script was \
+                    found by the personalization manager! \
+                    Skipping STORY line.")
+            self._doing_story = False
 
-                # Play a randomly selected story closing from the list.
-                elif "STORY_CLOSING" in elements[1]:
-                    self._ros_node.send_robot_command("DO",
-                        response="ROBOT_NOT_SPEAKING",
-                        timeout=datetime.timedelta(seconds=int(
-                            self.WAIT_TIME)),
-                        properties=self._story_closings[
-                            random.randint(0,len(self._story_closings)-1)])
 
-                # Send a command to the robot, with properties.
-                elif len(elements) > 2:
-                    self._ros_node.send_robot_command(elements[1],
-                        response="ROBOT_NOT_SPEAKING",
-                        timeout=datetime.timedelta(seconds=int(
-                            self.WAIT_TIME)),
-                        properties=elements[2])
+    def _do_story_setup(self):
+        """ STORY SETUP: pick the next story to play so we can load its
+        graphics and play back the story.
+        """
+        self._logger.debug("STORY SETUP")
+        # Pick the next story to play.
+        self._personalization_man.pick_next_story()
+
+
+    def _do_robot(self, robot_command, properties):
+        """ ROBOT: send a command to the robot. """
+        self._logger.debug("ROBOT")
+        # Play a randomly selected story intro from the list.
+        if robot_command == "STORY_INTRO":
+            self._ros_node.send_robot_command("DO",
+                response="ROBOT_NOT_SPEAKING",
+                timeout=datetime.timedelta(seconds=int(
+                    self.WAIT_TIME)),
+                properties=self._story_intros[
+                    random.randint(0,len(self._story_intros)-1)])
+
+        # Play a randomly selected story closing from the list.
+        elif robot_command == "STORY_CLOSING":
+            self._ros_node.send_robot_command("DO",
+                response="ROBOT_NOT_SPEAKING",
+                timeout=datetime.timedelta(seconds=int(
+                    self.WAIT_TIME)),
+                properties=self._story_closings[
+                    random.randint(0,len(self._story_closings)-1)])
+
+        # Send a command to the robot, with properties.
+        elif properties is not None:
+            self._ros_node.send_robot_command(robot_command,
+                response="ROBOT_NOT_SPEAKING",
+                timeout=datetime.timedelta(seconds=int(
+                    self.WAIT_TIME)),
+                properties=properties)
+
+        # Send a command to the robot, without properties.
+        else:
+            self._ros_node.send_robot_command(robot_command, "")
+
+
+    def _do_opal(self, opal_command, properties):
+        """ OPAL: send a command to the Opal game. """
+        self._logger.debug("OPAL")
+        if opal_command == "LOAD_ALL" and properties is not None:
+            # Load all objects listed in file -- the file is
+            # assumed to have properties for one object on each
+            # line.
+            to_load = self._read_list_from_file(
+                    self._script_path + self._session_script_path +
+                    properties)
+            self._ros_node.send_opal_load_objects(to_load)
+
+        # Get the next story and load graphics into game.
+        elif opal_command == "LOAD_STORY":
+            self._load_next_story()
+
+        # Load answers for game.
+        elif opal_command == "LOAD_ANSWERS" and properties is not None:
+            self._load_answers(properties)
+
+        # Send an opal command, with properties.
+        elif properties is not None:
+            self._ros_node.send_opal_command(opal_command, properties)
+
+        # Send an opal command, without properties.
+        else:
+            self._ros_node.send_opal_command(opal_command)
 
-                # Send a command to the robot, without properties.
-                else:
-                    self._ros_node.send_robot_command(elements[1], "")
-
-            #########################################################
-            # For OPAL lines, send command to Opal game
-            elif "OPAL" in elements[0]:
-                self._logger.debug("OPAL")
-                if "LOAD_ALL" in elements[1] and len(elements) >= 3:
-                    # Load all objects listed in file -- the file is
-                    # assumed to have properties for one object on each
-                    # line.
-                    to_load = self._read_list_from_file(
-                            self._script_path + self._session_script_path +
-                            elements[2])
-                    for obj in to_load:
-                        self._ros_node.send_opal_command("LOAD_OBJECT", obj)
-
-                # Get the next story and load graphics into game.
-                elif "LOAD_STORY" in elements[1]:
-                    self._load_next_story()
-
-                # Load answers for game.
-                elif "LOAD_ANSWERS" in elements[1] and len(elements) >= 3:
-                    self._load_answers(elements[2])
-
-                # Send an opal command, with properties.
-                elif len(elements) > 2:
-                    self._ros_node.send_opal_command(elements[1], elements[2])
-
-                # Send an opal command, without properties.
-                else:
-                    self._ros_node.send_opal_command(elements[1])
 
-            #########################################################
-            # For PAUSE lines, sleep for the specified number of
-            # seconds before continuing script playback.
-            elif "PAUSE" in elements[0] and len(elements) >= 2:
-                self._logger.debug("PAUSE")
-                try:
-                    time.sleep(int(elements[1]))
-                except ValueError:
-                    self._logger.exception("Not pausing! PAUSE command was "
-                        + "given an invalid argument (should be an int)!")
-
-            #########################################################
-            # For ADD lines, get a list of robot commands that can be
-            # used in response to particular triggers from the specified
-            # file and save them for later use -- all ADD lines should
-            # have 3 elements.
-            elif "ADD" in elements[0] and len(elements) >= 3:
-                self._logger.debug("ADD")
-                # Read list of responses from the specified file into the
-                # appropriate variable.
-                try:
-                    if "INCORRECT_RESPONSES" in elements[1]:
-                        self._incorrect_responses = self._read_list_from_file(
-                                self._script_path + self._session_script_path +
-                                elements[2])
-                        self._logger.debug("... Got "
-                                + str(len(self._incorrect_responses)))
-                    if "CORRECT_RESPONSES" in elements[1]:
-                        self._correct_responses = self._read_list_from_file(
-                                self._script_path + self._session_script_path +
-                                elements[2])
-                        self._logger.debug("... Got "
-                                + str(len(self._correct_responses)))
-
-                    elif "START_RESPONSES" in elements[1]:
-                        self._start_responses = self._read_list_from_file(
-                                self._script_path + self._session_script_path +
-                                elements[2])
-                        self._logger.debug("... Got "
-                                + str(len(self._start_responses)))
-                    elif "NO_RESPONSES" in elements[1]:
-                        self._no_responses = self._read_list_from_file(
-                                self._script_path + self._session_script_path +
-                                elements[2])
-                        self._logger.debug("... Got "
-                                + str(len(self._no_responses)))
-                    elif "ANSWER_FEEDBACK" in elements[1]:
-                        self._answer_feedback = self._read_list_from_file(
-                                self._script_path + self._session_script_path +
-                                elements[2])
-                        self._logger.debug("... Got "
-                                + str(len(self._answer_feedback)))
-                    elif "STORY_INTROS" in elements[1]:
-                        self._story_intros = self._read_list_from_file(
-                                self._script_path + self._session_script_path +
-                                elements[2])
-                        self._logger.debug("... Got "
-                                + str(len(self._story_intros)))
-                    elif "STORY_CLOSINGS" in elements[1]:
-                        self._story_closings = self._read_list_from_file(
-                                self._script_path + self._session_script_path +
-                                elements[2])
-                        self._logger.debug("... Got "
-                                + str(len(self._story_closings)))
-                    elif "TIMEOUT_CLOSINGS" in elements[1]:
-                        self._timeout_closings = self._read_list_from_file(
-                                self._script_path + self._session_script_path +
-                                elements[2])
-                        self._logger.debug("Got "
-                                + str(len(self._timeout_closings)))
-                    elif "MAX_STORIES_REACHED" in elements[1]:
-                        self._max_stories_reached = self._read_list_from_file(
-                                self._script_path + self._session_script_path +
-                                elements[2])
-                        self._logger.debug("... Got "
-                                + str(len(self._max_stories_reached)))
-                except IOError:
-                    self._logger.exception("Failed to add responses!")
-                else:
-                    self._logger.info("Added " + elements[1])
-
-            #########################################################
-            # For SET lines, set the specified constant.
-            elif "SET" in elements[0] and len(elements) >= 3:
-                self._logger.debug("SET")
-                if "MAX_INCORRECT_RESPONSES" in elements[1]:
-                    self._max_incorrect_responses = int(elements[2])
-                    self._logger.info("Set MAX_INCORRECT_RESPONSES to " +
-                            elements[2])
-                elif "MAX_GAME_TIME" in elements[1]:
-                    self._max_game_time = datetime.timedelta(minutes=
-                            int(elements[2]))
-                    self._logger.info("Set MAX_GAME_TIME to " + elements[2])
-                elif "MAX_STORIES" in elements[1]:
-                    self._max_stories = int(elements[2])
-                    self._logger.info("Set MAX_STORIES to " + elements[2])
-
-            #########################################################
-            # For WAIT lines, wait for the specified user response,
-            # or for a timeout.
-            elif "WAIT" in elements[0] and len(elements) >= 3:
-                self._logger.debug("WAIT")
-                self.wait_for_response(elements[1], int(elements[2]))
-
-            #########################################################
-            # For QUESTION lines, save the question type and question number
-            # for later use.
-            elif "QUESTION" in elements[0] and len(elements) >= 3:
-                self._current_question_type = elements[1]
-                self._current_question_num = int(elements[2])
-                self._logger.info("Current question: type " + elements[1]
-                        + ", num " + elements[2])
-
-            #########################################################
-            # For REPEAT lines, repeat lines in the specified script
-            # file the specified number of times.
-            elif "REPEAT" in elements[0] and len(elements) >= 3:
-                self._logger.debug("REPEAT")
-                self._repeating = True
-                self._repetitions = 0
-                # Create a script parser for the filename provided,
-                # assume it is in the session_scripts directory.
-                self._repeat_parser = ss_script_parser()
-                self._repeating_script_name = elements[2]
-                try:
-                    self._repeat_parser.load_script(self._script_path
-                            + self._session_script_path
-                            + elements[2])
-                except IOError:
-                    self._logger.exception("Script parser could not open "
-                        + "session script to repeat! Skipping REPEAT line.")
-                    self._repeating = False
-                    return
+    def _do_pause(self, seconds):
+        """ PAUSE: sleep for the specified number of seconds before
+        continuing script playback.
+        """
+        self._logger.debug("PAUSE")
+        self._clock.sleep(seconds)
 
-                # Figure out how many times we should repeat the script.
-                if "MAX_STORIES" in elements[1]:
-                    try:
-                        self._max_repetitions = self._max_stories
-                    except AttributeError:
-                        self._logger.exception("Tried to set MAX_REPETITIONS to"
-                                + " MAX_STORIES, but MAX_STORIES has not been "
-                                + "set . Setting to 1 repetition instead.")
-                        self._max_repetitions = 1
-                else:
-                    self._max_repetitions = int(elements[1])
-                self._logger.debug("Going to repeat " + elements[2] + " " +
-                        str(self._max_repetitions) + " time(s).")
+
+    def _do_add(self, list_name, filename):
+        """ ADD: get a list of robot commands that can be used in
+        response to particular triggers from the specified file and save
+        them for later use.
+        """
+        self._logger.debug("ADD")
+        # Find which variable the list should be saved in.
+        try:
+            attribute = self.RESPONSE_LISTS[list_name]
+        except KeyError:
+            self._logger.warning("Not adding " + list_name + " -- that isn't "
+                + "one of the lists we can add!")
+            return
+        # Read list of responses from the specified file into the
+        # appropriate variable.
+        try:
+            responses = self._read_list_from_file(self._script_path
+                    + self._session_script_path + filename)
+        except IOError:
+            self._logger.exception("Failed to add responses!")
+        else:
+            setattr(self, attribute, responses)
+            self._logger.debug("... Got " + str(len(responses)))
+            self._logger.info("Added " + list_name)
+
+
+    def _do_set(self, name, value):
+        """ SET: set the specified constant. """
+        self._logger.debug("SET")
+        if name == "MAX_INCORRECT_RESPONSES":
+            self._max_incorrect_responses = value
+        elif name == "MAX_GAME_TIME":
+            self._max_game_time = datetime.timedelta(minutes=value)
+        elif name == "MAX_STORIES":
+            self._max_stories = value
+        else:
+            self._logger.warning("Not setting " + name + " -- that isn't one "
+                + "of the constants we can set!")
+            return
+        self._logger.info("Set " + name + " to " + str(value))
+
+
+    def _do_wait(self, response_to_get, timeout):
+        """ WAIT: wait for the specified user response, or for a
+        timeout.
+        """
+        self._logger.debug("WAIT")
+        self.wait_for_response(response_to_get, timeout)
+
+
+    def _do_question(self, question_type, question_num):
+        """ QUESTION: save the question type and question number for
+        later use.
+        """
+        self._current_question_type = question_type
+        self._current_question_num = question_num
+        self._logger.info("Current question: type " + question_type
+                + ", num " + str(question_num))
+
+
+    def _do_repeat(self, times, script):
+        """ REPEAT: repeat the commands in the specified script file the
+        specified number of times.
+        """
+        self._logger.debug("REPEAT")
+        self._repeating = True
+        self._repetitions = 0
+        # Create a script parser for the filename provided,
+        # assume it is in the session_scripts directory.
+        self._repeat_parser = ss_script_parser()
+        try:
+            self._repeat_parser.load_script(self._script_path
+                    + self._session_script_path
+                    + script, self._bundle)
+        except IOError:
+            self._logger.exception("Script parser could not open "
+                + "session script to repeat! Skipping REPEAT line.")
+            self._repeating = False
+            return
+
+        # Figure out how many times we should repeat the script.
+        if times == "MAX_STORIES":
+            self._max_repetitions = self._max_stories
+        else:
+            self._max_repetitions = times
+        self._logger.debug("Going to repeat " + script + " " +
+                str(self._max_repetitions) + " time(s).")
 
 
     def _read_list_from_file(self, filename):
         """ Read a list of robot responses from a file, return a list
-        of the lines from the file
+        of the lines from the file. The list comes from the script cache
+        if the file was read before and hasn't changed since.
         """
-        # Open script for reading.
         try:
-            fh = open(filename, "r")
-            return fh.readlines()
+            return get_script_cache().get_list(filename, self._bundle)
         except IOError as e:
             self._logger.exception("Cannot open file: " + filename)
             # Pass exception up so anyone trying to add a response list
@@ -654,7 +607,7 @@ class ss_script_handler():
                         properties=self._answer_feedback[random.randint(0,
                             len(self._answer_feedback)-1)])
                     # Pause after speaking before hiding correct again
-                    time.sleep(self.ANSWER_FEEDBACK_PAUSE_TIME)
+                    self._clock.sleep(self.ANSWER_FEEDBACK_PAUSE_TIME)
                     self._ros_node.send_opal_command("HIDE_CORRECT")
                 except AttributeError:
                     self._logger.exception("Could not play a correct "
@@ -696,7 +649,7 @@ class ss_script_handler():
                         properties=self._answer_feedback[random.randint(0,
                             len(self._answer_feedback)-1)])
                     # Pause after speaking before hiding correct again.
-                    time.sleep(self.ANSWER_FEEDBACK_PAUSE_TIME)
+                    self._clock.sleep(self.ANSWER_FEEDBACK_PAUSE_TIME)
                     self._ros_node.send_opal_command("HIDE_CORRECT")
                 except AttributeError:
                     self._logger.exception("Could not play robot's answer"
@@ -754,6 +707,16 @@ class ss_script_handler():
         # or repeat a repeating script, this flag will be used to skip
         # back to the main session script, to the end of the game.
         self._end_game = True
+        # Make sure the responses recorded so far are saved now, in
+        # case the game is stopped before it reaches the end.
+        self._personalization_man.flush_responses()
+
+
+    def close(self):
+        """ Done with the game: make sure the participant's progress is
+        saved to the database.
+        """
+        self._personalization_man.close()
 
 
     def set_start_level(self, level):
@@ -769,7 +732,7 @@ class ss_script_handler():
         whether we have reached the max game time, we don't include
         time spent paused.
         """
-        self._pause_start_time = datetime.datetime.now()
+        self._pause_start_time = self._clock.now()
 
 
     def resume_game_timer(self):
@@ -782,7 +745,7 @@ class ss_script_handler():
         # add the same pause length multiple times to our total pause
         # time.
         if self._pause_start_time is not None:
-            self._total_time_paused += datetime.datetime.now() \
+            self._total_time_paused += self._clock.now() \
                - self._pause_start_time
         # Reset pause start time.
         self._pause_start_time = None
@@ -809,7 +772,8 @@ class ss_script_handler():
         # Shuffle answers to display them in a random order.
         random.shuffle(answers)
 
-        # Load in the graphic for each answer.
+        # Load in the graphic for each answer, all at once.
+        to_load = []
         for answer in answers:
             toload = {}
             # Remove whitespace from name before using it.
@@ -818,7 +782,8 @@ class ss_script_handler():
             toload["slot"] = answers.index(answer) + 1
             toload["draggable"] = False
             toload["isAnswerSlot"] = True
-            self._ros_node.send_opal_command("LOAD_OBJECT", json.dumps(toload))
+            to_load.append(json.dumps(toload))
+        self._ros_node.send_opal_load_objects(to_load)
 
 
     def _load_next_story(self):
@@ -830,7 +795,7 @@ class ss_script_handler():
         # were told to load one -- instead, play error message from
         # robot saying we have to be done now.
         if self._stories_told >= self._max_stories \
-            or ((datetime.datetime.now() - self._start_time) \
+            or ((self._clock.now() - self._start_time) \
             - self._total_time_paused >= self._max_game_time) or self._end_game:
             self._logger.info("We were told to load another story, but we've "
                     + "already played the maximum number of stories or we ran"
@@ -873,7 +838,8 @@ class ss_script_handler():
         setup["numAnswers"] = num_answers
         self._ros_node.send_opal_command("SETUP_STORY_SCENE", json.dumps(setup))
 
-        # Load the scene graphics.
+        # Load the scene graphics, all at once.
+        to_load = []
         for scene in scenes:
             toload = {}
             toload["name"] = "scenes/" + scene
@@ -883,7 +849,8 @@ class ss_script_handler():
                 toload["correctSlot"] = scenes.index(scene) + 1
             toload["draggable"] = False if in_order else True
             toload["isAnswerSlot"] = False
-            self._ros_node.send_opal_command("LOAD_OBJECT", json.dumps(toload))
+            to_load.append(json.dumps(toload))
+        self._ros_node.send_opal_load_objects(to_load)
 
         # Tell the personalization manager that we loaded the story so
         # it can keep track of which stories have been played.
@@ -23,10 +23,34 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 import logging # log messages
+from collections import namedtuple # for compiled script commands
+from ss_script_cache import get_script_cache # caches compiled scripts
+
+class ss_opcodes():
+    """ Opcodes for the commands that can appear on a script line. """
+    STORY = 0
+    STORY_SETUP = 1
+    ROBOT = 2
+    OPAL = 3
+    PAUSE = 4
+    ADD = 5
+    SET = 6
+    WAIT = 7
+    QUESTION = 8
+    REPEAT = 9
+
+
+# A compiled script line: the opcode, a tuple of the line's arguments
+# (with numbers already converted to ints), and the original line, which
+# we keep for log messages.
+ss_command = namedtuple("ss_command", ["opcode", "args", "line"])
+
 
 class ss_script_parser():
     """ Determine which session scripts to load, load them, and provide the
-    next line in the script file on request.
+    next command in the script on request. Scripts are compiled into a list
+    of commands once, when they are loaded, so playing them back (or
+    playing them again) doesn't require parsing the text again.
     """
 
     def __init__(self):
@@ -35,6 +59,20 @@ class ss_script_parser():
         self._logger = logging.getLogger(__name__)
         self._logger.info("Setting up script parser...")
 
+        # Table of the functions that compile each kind of script line,
+        # keyed by the first element of the line.
+        self._compilers = {
+            "STORY": self._compile_story,
+            "ROBOT": self._compile_send,
+            "OPAL": self._compile_send,
+            "PAUSE": self._compile_pause,
+            "ADD": self._compile_add,
+            "SET": self._compile_int_arg,
+            "WAIT": self._compile_int_arg,
+            "QUESTION": self._compile_int_arg,
+            "REPEAT": self._compile_repeat
+            }
+
 
     def get_session_script(self, session):
         """ Get scripts for the specified session """
@@ -74,42 +112,150 @@ class ss_script_parser():
             return "session-general.txt"
 
 
-    def load_script(self, script):
-        """ Set up to load script """
-        # Open script for reading.
+    def load_script(self, script, bundle=None):
+        """ Load a script and compile it into a list of commands. The
+        compiled script comes from the script cache if the script was
+        loaded before and hasn't changed since. If a script bundle is
+        given, the script is read from the bundle.
+        """
         try:
-            self._fh = open(script, "r")
+            self._commands = get_script_cache().get_script(script,
+                    self.compile_script, bundle)
         except IOError as e:
             self._logger.exception("Cannot open script: " + str(script))
             # Pass exception up so anyone trying to load a script
             # knows it didn't work.
             raise
         else:
-            # Log that we opened a script.
+            # Log that we loaded a script.
             self._logger.info("Opened " + str(script))
+            # Start at the beginning of the script.
+            self._next = 0
+
+
+    def compile_script(self, lines):
+        """ Compile a script's lines into a tuple of commands. Lines
+        that are blank or that can't be parsed are skipped.
+        """
+        commands = []
+        for line in lines:
+            command = self.compile_line(line)
+            if command is not None:
+                commands.append(command)
+        return tuple(commands)
+
+
+    def compile_line(self, line):
+        """ Compile one script line into a command. Return None if the
+        line is blank or can't be parsed.
+        """
+        # Split on tabs.
+        elements = line.rstrip().split('\t')
+
+        # Skip blank lines.
+        if elements[0].strip() == "":
+            return None
+
+        # Get the function that compiles this kind of line. The first
+        # element has to match a command exactly.
+        try:
+            compiler = self._compilers[elements[0].strip()]
+        except KeyError:
+            self._logger.warning("Skipping script line with unknown "
+                + "command: " + repr(line))
+            return None
+
+        try:
+            command = compiler(elements)
+        except ValueError:
+            self._logger.warning("Skipping script line with an invalid "
+                + "argument (should be an int): " + repr(line))
+            return None
+
+        if command is None:
+            self._logger.warning("Skipping script line with the wrong "
+                + "number of arguments: " + repr(line))
+            return None
+        opcode, args = command
+        return ss_command(opcode, args, line)
 
 
-    def next_line(self):
-        """ Get the next line in the script """
-        # Read and return next line in script file.
+    def _compile_story(self, elements):
+        """ STORY lines have no arguments; STORY SETUP lines have one. """
+        if len(elements) == 1:
+            return ss_opcodes.STORY, ()
+        elif elements[1] == "SETUP":
+            return ss_opcodes.STORY_SETUP, ()
+
+
+    def _compile_send(self, elements):
+        """ ROBOT and OPAL lines have a command and, optionally,
+        properties to send with it.
+        """
+        if len(elements) >= 2:
+            opcode = ss_opcodes.ROBOT if elements[0].strip() == "ROBOT" \
+                else ss_opcodes.OPAL
+            return opcode, (elements[1],
+                elements[2] if len(elements) > 2 else None)
+
+
+    def _compile_pause(self, elements):
+        """ PAUSE lines have the number of seconds to pause for. """
+        if len(elements) >= 2:
+            return ss_opcodes.PAUSE, (int(elements[1]),)
+
+
+    def _compile_add(self, elements):
+        """ ADD lines have a list name and the file to read it from. """
+        if len(elements) >= 3:
+            return ss_opcodes.ADD, (elements[1], elements[2])
+
+
+    def _compile_int_arg(self, elements):
+        """ SET, WAIT, and QUESTION lines have a name (the constant to
+        set, response to wait for, or question type) and an int (the
+        value, timeout, or question number).
+        """
+        if len(elements) >= 3:
+            opcode = {"SET": ss_opcodes.SET,
+                    "WAIT": ss_opcodes.WAIT,
+                    "QUESTION": ss_opcodes.QUESTION}[elements[0].strip()]
+            return opcode, (elements[1], int(elements[2]))
+
+
+    def _compile_repeat(self, elements):
+        """ REPEAT lines have the number of times to repeat (an int or
+        the name of a constant, such as MAX_STORIES) and the script to
+        repeat.
+        """
+        if len(elements) >= 3:
+            times = elements[1] if elements[1] == "MAX_STORIES" \
+                else int(elements[1])
+            return ss_opcodes.REPEAT, (times, elements[2])
+
+
+    def next_command(self):
+        """ Get the next command in the script """
         try:
-            return self._fh.next()
+            command = self._commands[self._next]
 
-        # May get attribute error if file handle does not exist because no
-        # script was loaded.
+        # May get attribute error if no script was loaded.
         except AttributeError:
-            self._logger.exception("Cannot get next line -- no script loaded!")
+            self._logger.exception("Cannot get next command -- no script "
+                + "loaded!")
             raise
 
-        except ValueError:
-            self._logger.exception("Cannot get next line -- script file is "
-                + "closed!")
-            raise
+        except IndexError:
+            self._logger.info("At end of script!")
+            # Tell whoever is playing the script that we're done.
+            raise StopIteration
+
+        self._next += 1
+        return command
 
-        except StopIteration:
-            self._logger.exception("At end of script file!")
-            # Close the script file now that we're done.
-            self._fh.close()
-            # Pass on the stop iteration exception.
-            raise
 
+    def rewind(self):
+        """ Go back to the start of the loaded script so it can be
+        played again without loading it again.
+        """
+        self._next = 0
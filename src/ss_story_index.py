@@ -0,0 +1,83 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2016 Personal Robots Group
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+class ss_story_index():
+    """ Index for picking new stories, built from the story catalog. For
+    each level, it maps each emotion to the set of stories that have a
+    question at that level with that emotion as the target response.
+    Sets of stories are bitsets: Python ints with bit n set if the story
+    with id n is in the set. So finding the first story with any of
+    several emotions that a participant hasn't played is a few bitwise
+    operations, however many stories there are.
+    """
+
+    def __init__(self, catalog):
+        """ Build the index from a story catalog. """
+        # Every story in the catalog.
+        self._all_stories = story_set(catalog.story_names)
+        # Level to emotion to stories.
+        self._emotion_stories = {}
+        for question_id, story_id, level, question_type, target_response \
+                in catalog.questions:
+            emotions = self._emotion_stories.setdefault(level, {})
+            emotions[target_response] = emotions.get(target_response, 0) \
+                | (1 << story_id)
+
+
+    def get_all_stories(self):
+        """ Get the set of all the stories in the catalog. """
+        return self._all_stories
+
+
+    def get_stories_with_emotions(self, emotions, level):
+        """ Get the set of stories that have at least one of the emotions
+        as a target response at the given level.
+        """
+        level_emotions = self._emotion_stories.get(level, {})
+        stories = 0
+        for emotion in emotions:
+            stories |= level_emotions.get(emotion, 0)
+        return stories
+
+
+    def get_first_unplayed(self, played, emotions, level):
+        """ Given the set of stories a participant has played, get the
+        id of the unplayed story with the lowest id that has at least
+        one of the emotions at the given level. If no unplayed story has
+        any of the emotions, get the unplayed story with the lowest id,
+        at any level. If every story has been played, return None.
+        """
+        candidates = self.get_stories_with_emotions(emotions, level) & ~played
+        if not candidates:
+            candidates = self._all_stories & ~played
+        if not candidates:
+            return None
+        # Get the lowest set bit.
+        return (candidates & -candidates).bit_length() - 1
+
+
+def story_set(story_ids):
+    """ Make a set of stories (a bitset) from a list of story ids. """
+    stories = 0
+    for story_id in story_ids:
+        stories |= 1 << story_id
+    return stories
@@ -0,0 +1,377 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2016 Personal Robots Group
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import collections # messages waiting for a subscriber
+import logging # log messages
+import threading # a delivery thread for each subscriber
+import time # message time stamps
+
+# A transport is how ss_ros talks to the rest of the system. Each
+# transport has the message classes ss_ros uses as attributes (Header,
+# OpalCommand, OpalAction, RobotCommand, RobotState, GameState, and
+# GameCommand), plus:
+#   publisher(topic, msg_class, queue_size): get an object with a
+#       publish(msg) method for a topic.
+#   subscribe(topic, msg_class, callback): call callback(msg) with each
+#       message published to a topic.
+#   now(): get a time stamp for a message header.
+# ss_rospy_transport uses ROS. ss_local_transport, below, passes plain
+# message structs around in this process, so a game can run without
+# roscore or the sar_* message packages.
+
+
+class _message():
+    """ Base class for plain message structs that stand in for ROS
+    messages: each struct has the same fields and constants as the ROS
+    message it stands in for. The constants' values only need to be
+    consistent in this process, since these messages never leave it.
+    """
+    # The message's fields and their default values, in order. If a
+    # default is callable, it is called to make each message's value.
+    FIELDS = ()
+
+    def __init__(self, **kwargs):
+        for name, default in self.FIELDS:
+            if name in kwargs:
+                setattr(self, name, kwargs.pop(name))
+            else:
+                setattr(self, name, default() if callable(default)
+                    else default)
+        if kwargs:
+            raise AttributeError("%s has no fields %s" % (
+                self.__class__.__name__, ", ".join(sorted(kwargs))))
+
+    def __eq__(self, other):
+        return self.__class__ is other.__class__ and all(getattr(self,
+            name) == getattr(other, name) for name, default in self.FIELDS)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return "%s(%s)" % (self.__class__.__name__, ", ".join("%s=%r" % (
+            name, getattr(self, name)) for name, default in self.FIELDS))
+
+
+class Header(_message):
+    """ Stands in for std_msgs/Header. """
+    FIELDS = (("seq", 0), ("stamp", 0.0), ("frame_id", ""))
+
+
+class OpalCommand(_message):
+    """ Stands in for sar_opal_msgs/OpalCommand. """
+    RESET = 0
+    DISABLE_TOUCH = 1
+    ENABLE_TOUCH = 2
+    SIDEKICK_DO = 3
+    SIDEKICK_SAY = 4
+    LOAD_OBJECT = 5
+    CLEAR = 6
+    MOVE_OBJECT = 7
+    HIGHLIGHT_OBJECT = 8
+    REQUEST_KEYFRAME = 9
+    FADE_SCREEN = 10
+    UNFADE_SCREEN = 11
+    NEXT_PAGE = 12
+    PREV_PAGE = 13
+    EXIT = 14
+    SET_CORRECT = 15
+    SHOW_CORRECT = 16
+    HIDE_CORRECT = 17
+    SETUP_STORY_SCENE = 18
+    FIELDS = (("header", Header), ("command", 0), ("properties", ""))
+
+
+class OpalAction(_message):
+    """ Stands in for sar_opal_msgs/OpalAction. """
+    FIELDS = (("header", Header), ("action", ""), ("message", ""),
+        ("objectName", ""), ("position", list), ("objectTwoName", ""),
+        ("positionTwo", list))
+
+
+class RobotCommand(_message):
+    """ Stands in for sar_robot_command_msgs/RobotCommand. """
+    SLEEP = 0
+    WAKEUP = 1
+    DO = 2
+    FIELDS = (("header", Header), ("command", 0), ("properties", ""),
+        ("interrupt", False))
+
+
+class RobotState(_message):
+    """ Stands in for sar_robot_command_msgs/RobotState. """
+    FIELDS = (("header", Header), ("doing_action", False),
+        ("is_playing_sound", False))
+
+
+class GameState(_message):
+    """ Stands in for sar_game_command_msgs/GameState. """
+    STORYTELLING = 1
+    START = 0
+    IN_PROGRESS = 1
+    PAUSED = 2
+    USER_TIMEOUT = 3
+    END = 4
+    READY = 5
+    FIELDS = (("header", Header), ("game", 0), ("state", 0),
+        ("performance", ""))
+
+
+class GameCommand(_message):
+    """ Stands in for sar_game_command_msgs/GameCommand. """
+    STORYTELLING = 1
+    START = 0
+    PAUSE = 1
+    CONTINUE = 2
+    END = 3
+    WAIT_FOR_RESPONSE = 4
+    SKIP_RESPONSE = 5
+    FIELDS = (("header", Header), ("game", 0), ("command", 0),
+        ("level", 0))
+
+
+class ss_local_bus():
+    """ Passes messages between publishers and subscribers in this
+    process, the way ROS topics do between nodes. Each subscriber gets
+    its messages in order on its own thread. As with rospy, a publisher
+    with a queue size drops the oldest message waiting for a subscriber
+    when that subscriber is too far behind.
+    """
+
+    def __init__(self):
+        """ Set up a bus with no subscribers. """
+        self._logger = logging.getLogger(__name__)
+        self._lock = threading.Lock()
+        # Subscribers to each topic.
+        self._subscribers = collections.defaultdict(list)
+        self._closed = False
+        # How many messages are waiting for or being handled by a
+        # subscriber, so we can tell when the bus is idle.
+        self._pending = 0
+        self._idle = threading.Condition()
+
+
+    def publisher(self, topic, queue_size=None):
+        """ Get a publisher for a topic. """
+        return _local_publisher(self, topic, queue_size)
+
+
+    def subscribe(self, topic, callback):
+        """ Call the callback with each message published to the topic,
+        on a new thread.
+        """
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("Can't subscribe to a closed bus!")
+            subscriber = _local_subscriber(self, topic, callback)
+            self._subscribers[topic].append(subscriber)
+        return subscriber
+
+
+    def publish(self, topic, msg, queue_size=None):
+        """ Give a message to each subscriber to the topic. """
+        with self._lock:
+            subscribers = list(self._subscribers[topic])
+        for subscriber in subscribers:
+            self._add_pending(1)
+            if subscriber.put(msg, queue_size):
+                self._add_pending(-1)
+                self._logger.warning("Subscriber to " + topic + " is too "
+                    + "far behind! Dropped the oldest message.")
+
+
+    def get_num_subscribers(self, topic):
+        """ Get how many subscribers a topic has. """
+        with self._lock:
+            return len(self._subscribers[topic])
+
+
+    def wait_until_idle(self, timeout=None):
+        """ Wait until every message published so far, and every
+        message published while handling those, has been handled.
+        Return False if the timeout (in seconds) elapses first.
+        """
+        end = None if timeout is None else time.time() + timeout
+        with self._idle:
+            while self._pending > 0:
+                if end is None:
+                    self._idle.wait()
+                elif end <= time.time():
+                    return False
+                else:
+                    self._idle.wait(end - time.time())
+            return True
+
+
+    def close(self):
+        """ Stop delivering messages and stop the subscriber threads. """
+        with self._lock:
+            self._closed = True
+            subscribers = [subscriber for topic_subscribers in
+                self._subscribers.values() for subscriber in
+                topic_subscribers]
+            self._subscribers.clear()
+        for subscriber in subscribers:
+            self._add_pending(-subscriber.close())
+
+
+    def _add_pending(self, count):
+        """ Count messages waiting for or being handled by a subscriber.
+        A subscriber handling a message counts any messages it publishes
+        before it finishes with that message, so the count only drops to
+        zero when everything has been handled.
+        """
+        with self._idle:
+            self._pending += count
+            if self._pending <= 0:
+                self._idle.notify_all()
+
+
+class _local_publisher():
+    """ Publishes messages to one topic on an ss_local_bus. """
+
+    def __init__(self, bus, topic, queue_size):
+        self._bus = bus
+        self._topic = topic
+        self._queue_size = queue_size
+
+
+    def publish(self, msg):
+        """ Give a message to each subscriber to the topic. """
+        self._bus.publish(self._topic, msg, self._queue_size)
+
+
+    def get_num_connections(self):
+        """ Get how many subscribers the topic has, like rospy's
+        Publisher.get_num_connections.
+        """
+        return self._bus.get_num_subscribers(self._topic)
+
+
+class _local_subscriber():
+    """ Delivers messages for one subscription on an ss_local_bus, in
+    order, on its own thread.
+    """
+
+    def __init__(self, bus, topic, callback):
+        self._logger = logging.getLogger(__name__)
+        self._bus = bus
+        self._topic = topic
+        self._callback = callback
+        # Messages waiting to be delivered.
+        self._messages = collections.deque()
+        self._condition = threading.Condition()
+        self._closed = False
+        self.dropped = 0
+        self._thread = threading.Thread(target=self._deliver,
+            name="subscriber " + topic)
+        self._thread.daemon = True
+        self._thread.start()
+
+
+    def put(self, msg, queue_size=None):
+        """ Queue a message for delivery. Return True if a message was
+        dropped: the oldest waiting message, to make room, or this one,
+        if the subscriber is closed.
+        """
+        with self._condition:
+            if self._closed:
+                return True
+            dropped = False
+            if queue_size and len(self._messages) >= queue_size:
+                self._messages.popleft()
+                self.dropped += 1
+                dropped = True
+            self._messages.append(msg)
+            self._condition.notify()
+            return dropped
+
+
+    def close(self):
+        """ Drop any waiting messages and stop the delivery thread.
+        Return how many messages were dropped.
+        """
+        with self._condition:
+            self._closed = True
+            dropped = len(self._messages)
+            self._messages.clear()
+            self._condition.notify()
+        if self._thread is not threading.current_thread():
+            self._thread.join()
+        return dropped
+
+
+    def _deliver(self):
+        """ Call the callback with each message, in order, until the
+        subscriber is closed.
+        """
+        while True:
+            with self._condition:
+                while not self._messages and not self._closed:
+                    self._condition.wait()
+                if self._closed:
+                    return
+                msg = self._messages.popleft()
+            try:
+                self._callback(msg)
+            except Exception:
+                # Like rospy, keep delivering messages after a callback
+                # fails.
+                self._logger.exception("Error in callback for "
+                    + self._topic)
+            finally:
+                self._bus._add_pending(-1)
+
+
+class ss_local_transport():
+    """ Transport for ss_ros that passes plain message structs around
+    an in-process bus instead of using ROS, so the game can run
+    headless, e.g., in tests, load tests, and simulations. Whatever
+    stands in for the tablet, the robot, and the game command node
+    shares the bus.
+    """
+    Header = Header
+    OpalCommand = OpalCommand
+    OpalAction = OpalAction
+    RobotCommand = RobotCommand
+    RobotState = RobotState
+    GameState = GameState
+    GameCommand = GameCommand
+
+    def __init__(self, bus=None):
+        """ Use the given bus, or a new one. """
+        self.bus = bus if bus is not None else ss_local_bus()
+
+
+    def publisher(self, topic, msg_class, queue_size=None):
+        """ Get a publisher for a topic. """
+        return self.bus.publisher(topic, queue_size)
+
+
+    def subscribe(self, topic, msg_class, callback):
+        """ Call the callback with each message published to a topic. """
+        return self.bus.subscribe(topic, callback)
+
+
+    def now(self):
+        """ Get a time stamp for a message header. """
+        return time.time()
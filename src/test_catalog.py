@@ -0,0 +1,90 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2016 Personal Robots Group
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import unittest
+import os
+import shutil
+import sqlite3
+import tempfile
+from ss_init_db import create_tables
+from ss_catalog import ss_catalog, get_catalog
+
+class test_catalog(unittest.TestCase):
+
+    def setUp(self):
+        # Make a database with a small catalog.
+        self.dir = tempfile.mkdtemp()
+        self.database = os.path.join(self.dir, "test.db")
+        self.conn = sqlite3.connect(self.database)
+        create_tables(self.conn)
+        self.conn.execute("INSERT INTO levels VALUES (1, 3, 1)")
+        self.conn.execute("INSERT INTO levels VALUES (5, 3, 0)")
+        self.conn.execute("INSERT INTO stories (story_name) VALUES ('s1')")
+        self.conn.execute("INSERT INTO stories (story_name) VALUES ('s2')")
+        for graphic in ["s2-b-p", "s2-a-p"]:
+            self.conn.execute("INSERT INTO graphics (story_id, level, "
+                + "scene_num, graphic) VALUES (2, 1, 1, ?)", (graphic,))
+        self.conn.execute("INSERT INTO questions (story_id, question_num, "
+            + "question_type, target_response, level) VALUES "
+            + "(2, 1, 'emotion', 'sad', 1)")
+        self.conn.execute("INSERT INTO responses_in_question VALUES "
+            + "(1, 'sad')")
+        self.conn.commit()
+
+
+    def tearDown(self):
+        self.conn.close()
+        shutil.rmtree(self.dir)
+
+
+    def test_lookups(self):
+        catalog = ss_catalog(self.conn)
+        self.assertEqual(catalog.get_story_id("s2"), 2)
+        self.assertIsNone(catalog.get_story_id("s3"))
+        self.assertEqual(catalog.get_level_info(1), (3, True))
+        self.assertEqual(catalog.get_level_info(5), (3, False))
+        self.assertIsNone(catalog.get_level_info(2))
+        # Graphics are in the order they were added.
+        self.assertEqual(catalog.get_graphics("s2", 1), ["s2-b-p", "s2-a-p"])
+        self.assertIsNone(catalog.get_graphics("s1", 1))
+        self.assertIsNone(catalog.get_graphics("s3", 1))
+        self.assertEqual(catalog.get_question_id("s2", 1, "emotion", 1), 1)
+        self.assertIsNone(catalog.get_question_id("s2", 1, "order", 1))
+        self.assertEqual(catalog.answer_options, { 1: ["sad"] })
+
+
+    def test_get_catalog(self):
+        # The catalog is loaded once and shared.
+        catalog = get_catalog(self.conn, self.database)
+        self.assertIs(get_catalog(self.conn, self.database), catalog)
+
+        # When the catalog version changes, the catalog is reloaded.
+        self.conn.execute("INSERT INTO stories (story_name) VALUES ('s3')")
+        self.conn.execute("UPDATE catalog_version SET version = version + 1")
+        self.conn.commit()
+        new_catalog = get_catalog(self.conn, self.database)
+        self.assertIsNot(new_catalog, catalog)
+        self.assertEqual(new_catalog.get_story_id("s3"), 3)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,125 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2016 Personal Robots Group
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import unittest
+import datetime
+import threading
+from ss_clock import ss_real_clock, ss_virtual_clock, ss_event
+
+class test_clock(unittest.TestCase):
+
+    def setUp(self):
+        self.start = datetime.datetime(2016, 5, 1, 12, 0, 0)
+        self.clock = ss_virtual_clock(self.start)
+
+
+    def elapsed(self):
+        return (self.clock.now() - self.start).total_seconds()
+
+
+    def test_sleep(self):
+        # Sleeping moves virtual time forward right away.
+        self.clock.sleep(600)
+        self.assertEqual(self.elapsed(), 600)
+        self.clock.sleep(0.5)
+        self.assertEqual(self.elapsed(), 600.5)
+
+
+    def test_wait(self):
+        # Waiting for an event that is never set times out.
+        event = threading.Event()
+        self.assertFalse(self.clock.wait(event, 10))
+        self.assertEqual(self.elapsed(), 10)
+
+        # Waiting for an event that is already set doesn't take any
+        # time.
+        event.set()
+        self.assertTrue(self.clock.wait(event, 10))
+        self.assertEqual(self.elapsed(), 10)
+
+
+    def test_call_later(self):
+        # Timers go off in order while someone waits, and time jumps to
+        # each one.
+        calls = []
+        event = threading.Event()
+        self.clock.call_later(3, lambda: calls.append(("b", self.elapsed())))
+        self.clock.call_later(1, lambda: calls.append(("a", self.elapsed())))
+        self.clock.call_later(5, event.set)
+        cancelled = self.clock.call_later(2, lambda: calls.append("c"))
+        cancelled.cancel()
+        late = self.clock.call_later(30, lambda: calls.append("d"))
+        self.assertEqual(calls, [])
+        self.assertTrue(self.clock.wait(event, 10))
+        self.assertEqual(calls, [("a", 1), ("b", 3)])
+        self.assertEqual(self.elapsed(), 5)
+
+        # The late timer goes off in a later wait.
+        self.clock.sleep(30)
+        self.assertEqual(calls, [("a", 1), ("b", 3), "d"])
+        self.assertEqual(self.elapsed(), 35)
+
+
+    def test_wait_until_idle(self):
+        # Before time moves, the clock lets the rest of the simulation
+        # catch up, which may set the event.
+        event = threading.Event()
+        clock = ss_virtual_clock(self.start, wait_until_idle=event.set)
+        self.assertTrue(clock.wait(event, 10))
+        self.assertEqual(clock.now(), self.start)
+
+
+    def test_real_clock(self):
+        clock = ss_real_clock()
+        event = threading.Event()
+        clock.call_later(0.01, event.set)
+        self.assertTrue(clock.wait(event, 5))
+        # Timing out doesn't leave the event set.
+        event = threading.Event()
+        self.assertFalse(clock.wait(event, 0.01))
+        self.assertFalse(event.is_set())
+        self.assertTrue(clock.now() > datetime.datetime(2016, 1, 1))
+
+
+    def test_event(self):
+        clock = ss_real_clock()
+        event = ss_event()
+        self.assertFalse(clock.wait(event, 0.01))
+        self.assertFalse(event.is_set())
+        # Setting the event wakes up a wait right away.
+        timer = threading.Timer(0.01, event.set)
+        timer.start()
+        self.assertTrue(clock.wait(event, 5))
+        timer.join()
+        # It stays set until it's cleared, however many times it's set.
+        event.set()
+        self.assertTrue(clock.wait(event, 0))
+        event.clear()
+        self.assertFalse(clock.wait(event, 0))
+        # The virtual clock waits for it too.
+        event.set()
+        self.assertTrue(self.clock.wait(event, 10))
+        self.assertEqual(self.elapsed(), 0)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
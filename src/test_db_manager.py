@@ -25,18 +25,36 @@
 
 import unittest
 import mock
+import datetime
 import random
+import os
+import shutil
+import sqlite3
+import tempfile
 from mock import Mock
 from ss_db_manager import ss_db_manager
+from ss_clock import ss_virtual_clock
+from ss_init_db import create_tables, create_progress_tables
 
 class test_db_manager(unittest.TestCase):
 
     def setUp(self):
-        self.dbm = ss_db_manager("ss_test_no_participant_data.db")
+        # A database with no stories or participant data in it.
+        self.dir = tempfile.mkdtemp()
+        database = os.path.join(self.dir, "test.db")
+        conn = sqlite3.connect(database)
+        create_tables(conn)
+        conn.close()
+        self.dbm = ss_db_manager(database)
         #self.dbm2 = ss_db_manager("ss_test_with_participant_data.db")
         #TODO add second database with participant data
 
 
+    def tearDown(self):
+        self.dbm.close()
+        shutil.rmtree(self.dir)
+
+
     def test_get_most_recent_level(self):
         # Test different participant and session values.
         # If there is no participant data, we should always get None.
@@ -66,6 +84,13 @@ class test_db_manager(unittest.TestCase):
             "ToM"))
 
 
+    def test_get_response_counts(self):
+        # If there is no participant data, we should get no counts.
+        self.assertEqual(self.dbm.get_response_counts("p234", [2]), {})
+        self.assertEqual(self.dbm.get_response_counts("p234", [1, 2, 3]), {})
+        self.assertEqual(self.dbm.get_response_counts("", []), {})
+
+
     def test_get_most_recent_incorrect_emotions(self):
         # If there is no participant data, we should get an empty list.
         self.assertEqual(
@@ -298,6 +323,11 @@ class test_db_manager(unittest.TestCase):
         m = Mock()
         self.dbm._cursor = m
         m.execute.side_effect = Exception
+        # Some lookups are answered from the in-memory catalog.
+        c = Mock()
+        self.dbm._catalog = c
+        c.get_level_info.side_effect = Exception
+        c.get_graphics.side_effect = Exception
 
         with self.assertRaises(Exception):
             self.dbm.get_most_recent_level("p023", 1)
@@ -307,6 +337,9 @@ class test_db_manager(unittest.TestCase):
         with self.assertRaises(Exception):
             self.dbm.get_percent_correct_responses("p023", 1, "emotion")
 
+        with self.assertRaises(Exception):
+            self.dbm.get_response_counts("p023", [1, 2])
+
         with self.assertRaises(Exception):
             self.dbm.get_most_recent_incorrect_emotions("p023", 1)
 
@@ -321,3 +354,185 @@ class test_db_manager(unittest.TestCase):
 
         with self.assertRaises(Exception):
             self.dbm.get_graphics("story-ki2", 4)
+
+
+    def test_group_commit(self):
+        # Make a small database with one story and question.
+        temp_dir = tempfile.mkdtemp()
+        try:
+            database = os.path.join(temp_dir, "test.db")
+            conn = sqlite3.connect(database)
+            create_tables(conn)
+            conn.execute("INSERT INTO levels VALUES (1, 3, 1)")
+            conn.execute("INSERT INTO stories (story_name) VALUES ('s')")
+            conn.execute("INSERT INTO questions (story_id, question_num, "
+                + "question_type, target_response, level) VALUES "
+                + "(1, 1, 'emotion', 'sad', 1)")
+            conn.commit()
+
+            def count_responses():
+                return conn.execute("SELECT COUNT(*) FROM responses"
+                    ).fetchone()[0]
+
+            # With group commit at story boundaries, responses aren't
+            # committed until the next story or a flush.
+            dbm = ss_db_manager(database, {"durability": "story"})
+            self.assertEqual(dbm._cursor.execute("PRAGMA journal_mode"
+                ).fetchone()[0], "wal")
+            first_id = dbm.record_story_played("p1", 1, 1, "s")
+            dbm.record_response("p1", 1, 1, "s", 1, "emotion", "sad")
+            self.assertEqual(count_responses(), 0)
+            # But they're already used when we check performance.
+            self.assertEqual(dbm.get_percent_correct_responses("p1", 1), 1.0)
+            self.assertEqual(dbm.get_response_counts("p1", [1, 2]),
+                { 1: { "emotion": (1, 1) } })
+            second_id = dbm.record_story_played("p1", 1, 1, "s")
+            self.assertEqual(count_responses(), 1)
+            dbm.record_response("p1", 1, 1, "s", 1, "emotion", "happy")
+            dbm.close()
+            self.assertEqual(count_responses(), 2)
+            # Responses are recorded for the story played most recently.
+            self.assertEqual(conn.execute("SELECT stories_played_id FROM "
+                + "responses ORDER BY id").fetchall(),
+                [(first_id,), (second_id,)])
+
+            # By default, every response is committed right away.
+            dbm = ss_db_manager(database)
+            dbm.record_response("p1", 1, 1, "s", 1, "emotion", "sad")
+            self.assertEqual(count_responses(), 3)
+            dbm.close()
+            conn.close()
+
+            # Bad options are rejected.
+            with self.assertRaises(ValueError):
+                ss_db_manager(database, {"synchronous": "sometimes"})
+        finally:
+            shutil.rmtree(temp_dir)
+
+
+    def test_story_played_time(self):
+        # Stories played are timestamped with the game's clock, so
+        # simulated sessions record simulated time.
+        temp_dir = tempfile.mkdtemp()
+        try:
+            database = os.path.join(temp_dir, "test.db")
+            conn = sqlite3.connect(database)
+            create_tables(conn)
+            conn.execute("INSERT INTO stories (story_name) VALUES ('s')")
+            conn.commit()
+            clock = ss_virtual_clock(datetime.datetime(2030, 1, 2, 3, 4, 5))
+            dbm = ss_db_manager(database, clock=clock)
+            dbm.record_story_played("p1", 1, 1, "s")
+            clock.sleep(60)
+            dbm.record_story_played("p1", 2, 1, "s")
+            dbm.close()
+            end = clock.utcnow()
+            start = end - datetime.timedelta(seconds=60)
+            self.assertEqual([row[0] for row in conn.execute("SELECT time "
+                + "FROM stories_played ORDER BY id")], [
+                start.strftime("%Y-%m-%d %H:%M:%S"),
+                end.strftime("%Y-%m-%d %H:%M:%S")])
+            self.assertEqual(start.year, 2030)
+            conn.close()
+        finally:
+            shutil.rmtree(temp_dir)
+
+
+    def test_catalog_database(self):
+        # Keep the catalog and participant progress in separate files.
+        temp_dir = tempfile.mkdtemp()
+        try:
+            catalog = os.path.join(temp_dir, "catalog.db")
+            progress = os.path.join(temp_dir, "progress.db")
+            conn = sqlite3.connect(catalog)
+            create_tables(conn)
+            conn.execute("INSERT INTO levels VALUES (1, 3, 1)")
+            conn.execute("INSERT INTO stories (story_name) VALUES ('s')")
+            conn.execute("INSERT INTO questions (story_id, question_num, "
+                + "question_type, target_response, level) VALUES "
+                + "(1, 1, 'emotion', 'sad', 1)")
+            conn.commit()
+            conn.close()
+            conn = sqlite3.connect(progress)
+            create_progress_tables(conn)
+            conn.close()
+
+            dbm = ss_db_manager(progress, {"catalog_database": catalog})
+            dbm.record_story_played("p1", 1, 1, "s")
+            dbm.record_response("p1", 1, 1, "s", 1, "emotion", "sad")
+            # The session_performance trigger works across the files.
+            self.assertEqual(dbm.get_response_counts("p1", [1]),
+                { 1: { "emotion": (1, 1) } })
+            self.assertEqual(dbm.get_percent_correct_responses("p1", 1), 1.0)
+            # The catalog can't be changed through the game.
+            with self.assertRaises(sqlite3.OperationalError):
+                dbm._cursor.execute("INSERT INTO catalog.stories "
+                    + "(story_name) VALUES ('t')")
+
+            # Replace the catalog file with one that has another story.
+            # It's attached at the next story boundary.
+            new_catalog = catalog + ".new"
+            shutil.copy(catalog, new_catalog)
+            conn = sqlite3.connect(new_catalog)
+            conn.execute("INSERT INTO stories (story_name) VALUES ('t')")
+            conn.execute("UPDATE catalog_version SET version = version + 1")
+            conn.commit()
+            conn.close()
+            os.rename(new_catalog, catalog)
+            dbm.record_story_played("p1", 1, 1, "t")
+            dbm.record_response("p1", 1, 1, "s", 1, "emotion", "happy")
+            self.assertEqual(dbm.get_response_counts("p1", [1]),
+                { 1: { "emotion": (1, 2) } })
+            dbm.close()
+
+            # A database with its own catalog can't use a separate one.
+            with self.assertRaises(sqlite3.OperationalError):
+                ss_db_manager(catalog, {"catalog_database": catalog})
+        finally:
+            shutil.rmtree(temp_dir)
+
+
+    def test_memory_catalog(self):
+        # Make a small database with one story and question.
+        temp_dir = tempfile.mkdtemp()
+        try:
+            database = os.path.join(temp_dir, "test.db")
+            conn = sqlite3.connect(database)
+            create_tables(conn)
+            conn.execute("INSERT INTO levels VALUES (1, 3, 1)")
+            conn.execute("INSERT INTO stories (story_name) VALUES ('s')")
+            conn.execute("INSERT INTO questions (story_id, question_num, "
+                + "question_type, target_response, level) VALUES "
+                + "(1, 1, 'emotion', 'sad', 1)")
+            conn.commit()
+
+            dbm = ss_db_manager(database, {"memory_catalog": True})
+            self.assertEqual(dbm._cursor.execute("SELECT target_response "
+                + "FROM temp.questions").fetchall(), [("sad",)])
+            self.assertEqual(sorted(row[0] for row in dbm._cursor.execute(
+                "SELECT name FROM temp.sqlite_master WHERE type = 'index' "
+                + "AND sql IS NOT NULL")), ["graphics_story_level",
+                "questions_level_target", "questions_story_level"])
+            dbm.record_story_played("p1", 1, 1, "s")
+            dbm.record_response("p1", 1, 1, "s", 1, "emotion", "sad")
+            self.assertEqual(dbm.get_percent_correct_responses("p1", 1), 1.0)
+            self.assertEqual(dbm.get_most_recent_incorrect_emotions("p1", 1),
+                [])
+            # Progress is written to the database file.
+            self.assertEqual(conn.execute("SELECT COUNT(*) FROM responses"
+                ).fetchone()[0], 1)
+
+            # When the catalog changes, the copy is updated at the next
+            # story boundary.
+            conn.execute("UPDATE questions SET target_response = 'happy'")
+            conn.execute("UPDATE catalog_version SET version = version + 1")
+            conn.commit()
+            dbm.record_story_played("p1", 1, 1, "s")
+            self.assertEqual(dbm._cursor.execute("SELECT target_response "
+                + "FROM temp.questions").fetchall(), [("happy",)])
+            self.assertEqual(dbm.get_most_recent_incorrect_emotions("p1", 1),
+                ["sad"])
+            dbm.close()
+            conn.close()
+        finally:
+            shutil.rmtree(temp_dir)
@@ -26,6 +26,7 @@
 import unittest
 import mock
 import random
+from mock import Mock
 from ss_game_node import ss_game_node
 
 class test_game_node(unittest.TestCase):
@@ -61,5 +62,34 @@ class test_game_node(unittest.TestCase):
         pass
 
 
+    def test_status_timer(self):
+        # A tick from a status timer that was cancelled, arriving after
+        # the game paused and started a new timer, doesn't start a third.
+        timers = []
+        def call_later(seconds, callback):
+            timer = Mock()
+            timers.append((timer, callback))
+            return timer
+        clock = Mock()
+        clock.call_later.side_effect = call_later
+        gn = ss_game_node(log_config=None, clock=clock)
+        gn._ros_ss = Mock()
+        def iterate_once():
+            if len(script_handler.iterate_once.mock_calls) > 1:
+                raise StopIteration()
+            # The first timer was cancelled when the game started, but
+            # its tick arrives after we pause.
+            gn._queue.put("PAUSE")
+            timers[0][1]()
+            gn._queue.put("CONTINUE")
+        script_handler = Mock()
+        script_handler.iterate_once.side_effect = iterate_once
+        gn._queue.put("START")
+        gn.run_game(script_handler)
+        self.assertEqual(len(timers), 2)
+        for timer, callback in timers:
+            timer.cancel.assert_called_with()
+
+
 if __name__ == '__main__':
     unittest.main(verbosity=2)
@@ -0,0 +1,82 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2016 Personal Robots Group
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import unittest
+import logging
+from ss_headless_session import run_session
+
+class test_headless_session(unittest.TestCase):
+
+    # These tests play the demo session, so they need to run from the
+    # src/ directory, where the demo config file is.
+
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+
+
+    def tearDown(self):
+        logging.disable(logging.NOTSET)
+
+
+    def test_demo_session(self):
+        # A child who gets everything right touches start once and
+        # answers each of the demo story's four questions once.
+        finished, real, game, stats = run_session(-1, "DEMO",
+            virtual_time=True, correct_rate=1, seed=1)
+        self.assertTrue(finished)
+        self.assertEqual(stats["start_touches"], 1)
+        self.assertEqual(stats["correct_touches"], 4)
+        self.assertEqual(stats["incorrect_touches"], 0)
+        self.assertEqual(stats["timeouts"], 0)
+        # The PAUSE lines in the demo scripts add up to 9 seconds, and
+        # the game pauses after answer feedback too, all in virtual
+        # time.
+        self.assertTrue(game > 9)
+        self.assertTrue(real < game)
+
+
+    def test_deterministic(self):
+        # With a seed, a session in virtual time plays out the same way
+        # each time, even though the robot may finish asking before the
+        # question reaches the tablet.
+        results = [run_session(-1, "DEMO", virtual_time=True, seed=2,
+            seconds_per_word=0.3) for i in range(5)]
+        for finished, real, game, stats in results:
+            self.assertTrue(finished)
+            self.assertEqual(stats["timeouts"], 0)
+            self.assertEqual(game, results[0][2])
+            self.assertEqual(stats, results[0][3])
+
+
+    def test_timeouts(self):
+        # A child who takes longer to answer than the game waits times
+        # out on each question; the game command node skips each one
+        # and the session still finishes.
+        finished, real, game, stats = run_session(-1, "DEMO",
+            virtual_time=True, response_seconds=20, seed=1)
+        self.assertTrue(finished)
+        self.assertEqual(stats["timeouts"], 4)
+        self.assertEqual(stats["correct_touches"], 0)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,158 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2016 Personal Robots Group
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import unittest
+import os
+import shutil
+import sqlite3
+import tempfile
+from ss_init_db import create_tables, create_progress_tables
+from ss_migrate_db import migrate, get_schema_version, MIGRATIONS
+from ss_migrate_db import rebuild_session_performance
+
+class test_migrate_db(unittest.TestCase):
+
+    def setUp(self):
+        self.conn = sqlite3.connect(":memory:")
+
+
+    def tearDown(self):
+        self.conn.close()
+
+
+    def get_indexes(self):
+        return sorted(row[0] for row in self.conn.execute("SELECT name FROM "
+            + "sqlite_master WHERE type = 'index' AND sql IS NOT NULL"))
+
+
+    def test_new_database(self):
+        # New databases are created at the current schema version.
+        create_tables(self.conn)
+        self.assertEqual(get_schema_version(self.conn), len(MIGRATIONS))
+        self.assertIn("stories_played_participant_session",
+            self.get_indexes())
+
+
+    def test_migrate(self):
+        # Make a database like an old one: all the tables, but none of
+        # the migrations, and some progress already recorded.
+        create_tables(self.conn)
+        for index in self.get_indexes():
+            self.conn.execute("DROP INDEX " + index)
+        self.conn.execute("DROP TRIGGER session_performance_insert_response")
+        self.conn.execute("DROP TABLE session_performance")
+        self.conn.execute("DROP TABLE catalog_version")
+        self.conn.execute("DROP TABLE story_hashes")
+        self.conn.execute("PRAGMA user_version = 0")
+        self.add_responses(["sad", "happy", "sad"])
+
+        self.assertEqual(migrate(self.conn), len(MIGRATIONS))
+        self.assertEqual(get_schema_version(self.conn), len(MIGRATIONS))
+        self.assertIn("responses_stories_played", self.get_indexes())
+        # Data is kept, and the performance summary is filled in from
+        # the responses that were already there.
+        self.assertEqual(self.conn.execute("SELECT story_name FROM stories")
+            .fetchall(), [("a",)])
+        self.assertEqual(self.get_performance(), [("p1", 1, "emotion", 2, 3)])
+
+        # Migrating again changes nothing.
+        indexes = self.get_indexes()
+        self.assertEqual(migrate(self.conn), len(MIGRATIONS))
+        self.assertEqual(self.get_indexes(), indexes)
+
+
+    def test_session_performance(self):
+        # The summary is updated as responses are recorded.
+        create_tables(self.conn)
+        self.add_responses(["sad", "happy", None])
+        self.assertEqual(self.get_performance(), [("p1", 1, "emotion", 1, 2)])
+        self.add_responses(["sad"])
+        self.assertEqual(self.get_performance(), [("p1", 1, "emotion", 2, 3)])
+
+        # Rebuilding it gives the same counts.
+        self.conn.execute("UPDATE session_performance SET total = 100")
+        rebuild_session_performance(self.conn)
+        self.assertEqual(self.get_performance(), [("p1", 1, "emotion", 2, 3)])
+
+
+    def test_rebuild_progress_database(self):
+        # A progress database's questions are in its catalog database.
+        temp_dir = tempfile.mkdtemp()
+        try:
+            catalog = os.path.join(temp_dir, "catalog.db")
+            catalog_conn = sqlite3.connect(catalog)
+            create_tables(catalog_conn)
+            catalog_conn.execute("INSERT INTO stories (story_name) VALUES "
+                + "('a')")
+            catalog_conn.execute("INSERT INTO questions (story_id, "
+                + "question_num, question_type, target_response, level) "
+                + "VALUES (1, 1, 'emotion', 'sad', 1)")
+            catalog_conn.commit()
+            catalog_conn.close()
+            create_progress_tables(self.conn)
+            self.conn.execute("INSERT INTO stories_played (participant, "
+                + "session, level, story_id) VALUES ('p1', 1, 1, 1)")
+            self.conn.executemany("INSERT INTO responses (stories_played_id, "
+                + "questions_id, response) VALUES (1, 1, ?)",
+                [("sad",), ("happy",), ("sad",)])
+            self.conn.commit()
+
+            rebuild_session_performance(self.conn, catalog)
+            self.assertEqual(self.get_performance(),
+                [("p1", 1, "emotion", 2, 3)])
+            # The catalog is detached again.
+            self.assertEqual([row[1] for row in self.conn.execute(
+                "PRAGMA database_list")], ["main"])
+        finally:
+            shutil.rmtree(temp_dir)
+
+
+    def add_responses(self, responses):
+        # Record responses to a question whose target response is
+        # "sad", for participant p1 in session 1.
+        if not self.conn.execute("SELECT * FROM stories").fetchall():
+            self.conn.execute("INSERT INTO stories (story_name) VALUES ('a')")
+            self.conn.execute("INSERT INTO questions (story_id, question_num, "
+                + "question_type, target_response, level) VALUES "
+                + "(1, 1, 'emotion', 'sad', 1)")
+            self.conn.execute("INSERT INTO stories_played (participant, "
+                + "session, level, story_id) VALUES ('p1', 1, 1, 1)")
+        for response in responses:
+            self.conn.execute("INSERT INTO responses (stories_played_id, "
+                + "questions_id, response) VALUES (1, 1, ?)", (response,))
+        self.conn.commit()
+
+
+    def get_performance(self):
+        return self.conn.execute("SELECT participant, session, question_type, "
+            + "correct, total FROM session_performance").fetchall()
+
+
+    def test_newer_database(self):
+        # We can't migrate a database newer than we know about.
+        self.conn.execute("PRAGMA user_version = %d" % (len(MIGRATIONS) + 1))
+        with self.assertRaises(ValueError):
+            migrate(self.conn)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
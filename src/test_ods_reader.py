@@ -0,0 +1,97 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2016 Personal Robots Group
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import unittest
+import os
+import shutil
+import tempfile
+import zipfile
+from ss_ods_reader import iter_rows
+
+# A spreadsheet with two sheets. The first has a header row and a row
+# with a number, repeated cells, a comment, spaces, and a line break.
+CONTENT = """<?xml version="1.0" encoding="UTF-8"?>
+<office:document-content
+    xmlns:office="urn:oasis:names:tc:opendocument:xmlns:office:1.0"
+    xmlns:table="urn:oasis:names:tc:opendocument:xmlns:table:1.0"
+    xmlns:text="urn:oasis:names:tc:opendocument:xmlns:text:1.0">
+<office:body><office:spreadsheet>
+<table:table table:name="Story-A">
+  <table:table-row>
+    <table:table-cell office:value-type="string"><text:p>Level</text:p>
+    </table:table-cell>
+    <table:table-cell office:value-type="string"><text:p>Story</text:p>
+    </table:table-cell>
+    <table:table-cell table:number-columns-repeated="1000"/>
+  </table:table-row>
+  <table:table-row>
+    <table:table-cell office:value-type="float" office:value="1">
+      <text:p>1</text:p></table:table-cell>
+    <table:table-cell office:value-type="string">
+      <office:annotation><text:p>A comment</text:p></office:annotation>
+      <text:p>Sam<text:s text:c="2"/>went <text:span>out</text:span>.</text:p>
+      <text:p>The end.</text:p>
+    </table:table-cell>
+    <table:table-cell table:number-columns-repeated="2"/>
+    <table:table-cell office:value-type="string"
+        table:number-columns-repeated="2"><text:p>x</text:p>
+    </table:table-cell>
+  </table:table-row>
+</table:table>
+<table:table table:name="Story-B">
+  <table:table-row>
+    <table:table-cell office:value-type="float" office:value="2.5">
+      <text:p>2.5</text:p></table:table-cell>
+  </table:table-row>
+</table:table>
+</office:spreadsheet></office:body>
+</office:document-content>
+"""
+
+class test_ods_reader(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.ods = os.path.join(self.dir, "test.ods")
+        with zipfile.ZipFile(self.ods, "w") as archive:
+            archive.writestr("content.xml", CONTENT)
+
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+
+    def test_iter_rows(self):
+        self.assertEqual(list(iter_rows(self.ods)), [
+            ("Story-A", ["Level", "Story"]),
+            ("Story-A", [1, "Sam  went out.\nThe end.", "", "", "x", "x"]),
+            ("Story-B", [2.5]),
+            ])
+
+
+    def test_keep_sheet(self):
+        self.assertEqual(list(iter_rows(self.ods, lambda index: index == 1)),
+            [("Story-B", [2.5])])
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -25,27 +25,45 @@
 
 import unittest
 import mock
+import os
 import random
+import shutil
+import sqlite3
+import tempfile
 from mock import Mock, patch
 from ss_personalization_manager import ss_personalization_manager
 from SS_Errors import NoStoryFound
+from ss_init_db import create_tables
 
 class test_personalization_manager(unittest.TestCase):
     # TODO test for different participants, sessions, including DEMO!
 
+    def setUp(self):
+        # A database with no stories or participant data in it.
+        self.dir = tempfile.mkdtemp()
+        self.database = os.path.join(self.dir, "test.db")
+        conn = sqlite3.connect(self.database)
+        create_tables(conn)
+        conn.close()
+
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+
     def setup_demo(self):
         # Set up to test a demo session, with no participant data in
         # the database yet.
         #args: session, participant, database, percent_correct_to_level
-        self.pm = ss_personalization_manager(-1, "DEMO",
-                "ss_test_no_participant_data.db", 0.75)
+        self.pm = ss_personalization_manager(-1, "DEMO", self.database,
+                0.75)
 
         # Mock the database manager for a participant who has no data
         # in the database yet.
         m = Mock()
         self.pm._db_man = m
         m.get_most_recent_level.return_value = None
-        m.get_percent_correct_responses.return_value = None
+        m.get_response_counts.return_value = {}
         m.get_most_recent_incorrect_emotions.return_value = []
         m.get_next_new_story.return_value = "story-fo1"
         m.get_next_review_story.return_value = None
@@ -59,14 +77,14 @@ class test_personalization_manager(unittest.TestCase):
 
         #args: session, participant, database, percent_correct_to_level
         self.pm = ss_personalization_manager(session, participant,
-                "ss_test_no_participant_data.db", 0.75)
+                self.database, 0.75)
 
         # Mock the database manager for a participant who has no data
         # in the database yet.
         m = Mock()
         self.pm._db_man = m
         m.get_most_recent_level.return_value = None
-        m.get_percent_correct_responses.return_value = None
+        m.get_response_counts.return_value = {}
         m.get_most_recent_incorrect_emotions.return_value = []
         m.get_next_new_story.return_value = "story-fo1"
         m.get_next_review_story.return_value = None
@@ -98,9 +116,10 @@ class test_personalization_manager(unittest.TestCase):
 
         # Last level played was...
         last_level = [1,4,10]
-        # Percent questions correct were... None = no questions
-        # answered, 1 = all questions correct, 0.75 = 75% correct, etc.
-        percent_questions_correct = [None, 1, 0.75, 0.74, -0.03]
+        # Questions correct were... None = no questions answered,
+        # (4, 4) = all questions correct, (3, 4) = 75% correct, etc.
+        # Counts for every question type are added up.
+        questions_correct = [None, (4, 4), (3, 4), (74, 100), (0, 4)]
         # Then we expect to play at level...
         expected_level = [
             (1, 2, 2, 1, 1),
@@ -113,9 +132,15 @@ class test_personalization_manager(unittest.TestCase):
             dbm.get_most_recent_level.return_value = last_level[i]
 
             # Test for each percentage of questions correct.
-            for j in range(0, len(percent_questions_correct)):
-                dbm.get_percent_correct_responses.return_value = \
-                    percent_questions_correct[j]
+            for j in range(0, len(questions_correct)):
+                if questions_correct[j] is None:
+                    dbm.get_response_counts.return_value = {}
+                else:
+                    correct, total = questions_correct[j]
+                    # Split the counts between two question types.
+                    dbm.get_response_counts.return_value = { 0: {
+                        "emotion": (correct - correct // 2, total - total // 2),
+                        "order": (correct // 2, total // 2) } }
                 self.assertEqual(self.pm.get_level_for_session(),
                     expected_level[i][j])
 
@@ -146,13 +171,19 @@ class test_personalization_manager(unittest.TestCase):
                 (1, None, None),
                 (None, None, 1),
                 (None, 1, None),
-                (0.4, -1, 5),
+                (0.4, 0.25, 0.8),
                 ]
 
         for pd in performance_data:
-            dbm.get_percent_correct_responses.side_effect = [ pd[0], pd[1],
-                pd[2] ]
+            # Make up counts that give the performance for each question
+            # type that was answered.
+            counts = {}
+            for question_type, p in zip(["emotion", "ToM", "order"], pd):
+                if p is not None:
+                    counts[question_type] = (int(p * 20), 20)
+            dbm.get_response_counts.return_value = { 1: counts }
             self.assertEqual(self.pm.get_performance_this_session(), pd)
+            dbm.get_response_counts.assert_called_with("P001", [1])
 
 
     @patch("ss_personalization_manager.ss_personalization_manager."
@@ -274,7 +305,26 @@ class test_personalization_manager(unittest.TestCase):
 
 
     def test_record_story_loaded(self):
-        pass
+        # With responses written behind and committed once per story,
+        # loading the next story commits the last one's responses
+        # instead of waiting for the recorder's write lock.
+        conn = sqlite3.connect(self.database)
+        conn.execute("INSERT INTO levels VALUES (1, 3, 1)")
+        conn.execute("INSERT INTO stories (story_name) VALUES ('s')")
+        conn.execute("INSERT INTO questions (story_id, question_num, "
+            + "question_type, target_response, level) VALUES "
+            + "(1, 1, 'emotion', 'sad', 1)")
+        conn.commit()
+        self.pm = ss_personalization_manager(1, "P1", self.database, 0.8,
+            {"durability": "story"})
+        self.pm._current_story = "s"
+        self.pm.record_story_loaded()
+        self.pm.record_user_response(1, "emotion", "sad")
+        self.pm.record_story_loaded()
+        self.assertEqual(conn.execute("SELECT COUNT(*) FROM responses"
+            ).fetchone()[0], 1)
+        self.pm.close()
+        conn.close()
 
 
     def test_record_user_response(self):
@@ -0,0 +1,229 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2016 Personal Robots Group
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import unittest
+import os
+import shutil
+import sqlite3
+import tempfile
+from ss_init_db import create_tables, create_progress_tables
+from ss_process_story_ods import write_catalog, build_catalog, check_catalog
+from ss_process_story_ods import swap_catalog
+from ss_process_story_ods import _process_workbook, _merge_parts
+from ss_catalog import CATALOG_TABLES
+
+class test_process_story_ods(unittest.TestCase):
+
+    def setUp(self):
+        self.conn = sqlite3.connect(":memory:")
+        create_tables(self.conn)
+
+
+    def tearDown(self):
+        self.conn.close()
+
+
+    def make_story(self, name, targets, content_hash):
+        # A processed story with one emotion question per target
+        # response, all at level 1, and one graphic.
+        return {
+            "name": name,
+            "questions": [(1, num + 1, "emotion", target, [target, "happy"])
+                for num, target in enumerate(targets)],
+            "graphics": [(1, 1, name + "-a-p.png")],
+            "hash": content_hash,
+            }
+
+
+    def get_questions(self):
+        return self.conn.execute("SELECT id, story_id, question_num, "
+            + "target_response FROM questions ORDER BY id").fetchall()
+
+
+    def get_version(self):
+        return self.conn.execute("SELECT version FROM catalog_version"
+            ).fetchone()[0]
+
+
+    def test_write_catalog(self):
+        status = write_catalog(self.conn, [self.make_story("a", ["sad"], "1"),
+            self.make_story("b", ["mad", "sad"], "2")], False)
+        self.assertEqual(status.items(), [("a", "added"), ("b", "added")])
+        self.assertEqual(self.get_questions(), [(1, 1, 1, "sad"),
+            (2, 2, 1, "mad"), (3, 2, 2, "sad")])
+        self.assertEqual(self.conn.execute("SELECT COUNT(*) FROM "
+            + "responses_in_question").fetchone()[0], 6)
+        self.assertEqual(self.get_version(), 1)
+
+        # Unchanged stories are skipped, and nothing is written.
+        status = write_catalog(self.conn, [self.make_story("a", ["sad"], "1"),
+            self.make_story("b", ["mad", "sad"], "2")], False)
+        self.assertEqual(status.items(), [("a", "skipped"), ("b", "skipped")])
+        self.assertEqual(self.get_version(), 1)
+
+        # A response was recorded to a question that is then removed.
+        self.conn.execute("INSERT INTO stories_played (participant, session, "
+            + "level, story_id) VALUES ('p1', 1, 1, 2)")
+        self.conn.execute("INSERT INTO responses (stories_played_id, "
+            + "questions_id, response) VALUES (1, 3, 'sad')")
+
+        # Changed stories keep the ids of the questions they still have,
+        # and new questions get ids that were never used.
+        status = write_catalog(self.conn, [self.make_story("b", ["sad"], "3"),
+            self.make_story("c", ["happy"], "4")], False)
+        self.assertEqual(status.items(), [("b", "updated"), ("c", "added")])
+        self.assertEqual(self.get_questions(), [(1, 1, 1, "sad"),
+            (2, 2, 1, "sad"), (4, 3, 1, "happy")])
+        self.assertEqual(self.conn.execute("SELECT questions_id, response "
+            + "FROM responses_in_question WHERE questions_id = 2").fetchall(),
+            [(2, "sad"), (2, "happy")])
+        self.assertEqual(self.conn.execute("SELECT story_id, graphic FROM "
+            + "graphics ORDER BY story_id").fetchall(), [(1, "a-a-p.png"),
+            (2, "b-a-p.png"), (3, "c-a-p.png")])
+        self.assertEqual(self.get_version(), 2)
+
+
+    def test_swap_catalog(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            database = os.path.join(temp_dir, "test.db")
+            side_file = database + ".new-catalog"
+            conn = sqlite3.connect(database)
+            create_tables(conn)
+            write_catalog(conn, [self.make_story("a", ["sad"], "1")]
+                + [self.make_story(name, ["happy"], "4") for name in "cde"],
+                False)
+            conn.execute("INSERT INTO stories_played (participant, session, "
+                + "level, story_id) VALUES ('p1', 1, 1, 1)")
+            conn.execute("INSERT INTO responses (stories_played_id, "
+                + "questions_id, response) VALUES (1, 1, 'sad')")
+            conn.commit()
+
+            # The new catalog is built on the side; the database doesn't
+            # change until it is swapped in.
+            status = build_catalog(conn, side_file, [self.make_story("a",
+                ["mad"], "2"), self.make_story("b", ["sad"], "3")], False)
+            self.assertEqual(status.items(), [("a", "updated"),
+                ("b", "added")])
+            self.assertEqual(self.get_catalog(conn)[0], (1, 1, "sad"))
+            self.assertEqual(check_catalog(side_file), [])
+            unchanged = conn.execute("SELECT rowid FROM graphics WHERE "
+                + "story_id = 2").fetchall()
+            swap_catalog(conn, side_file)
+            self.assertEqual(self.get_catalog(conn), [(1, 1, "mad"),
+                (2, 2, "happy"), (3, 3, "happy"), (4, 4, "happy"),
+                (5, 5, "sad")])
+            # The database's catalog is the same as the new one, but
+            # only the changed stories' rows were copied.
+            self.assertSameCatalog(conn, side_file)
+            self.assertEqual(conn.execute("SELECT rowid FROM graphics WHERE "
+                + "story_id = 2").fetchall(), unchanged)
+            self.assertEqual(conn.execute("SELECT version FROM "
+                + "catalog_version").fetchone()[0], 2)
+            # Progress is kept.
+            self.assertEqual(conn.execute("SELECT questions_id, response "
+                + "FROM responses").fetchall(), [(1, "sad")])
+
+            # When most stories changed, the whole catalog is copied.
+            build_catalog(conn, side_file, [self.make_story(name, ["mad"],
+                "5") for name in "abcde"], False)
+            swap_catalog(conn, side_file)
+            self.assertSameCatalog(conn, side_file)
+            self.assertEqual(conn.execute("SELECT version FROM "
+                + "catalog_version").fetchone()[0], 3)
+
+            # Problems with the new catalog are found.
+            side_conn = sqlite3.connect(side_file)
+            side_conn.execute("INSERT INTO graphics (story_id, level, "
+                + "scene_num, graphic) VALUES (9, 1, 1, 'x')")
+            side_conn.commit()
+            side_conn.close()
+            self.assertEqual(len(check_catalog(side_file)), 1)
+            conn.close()
+        finally:
+            shutil.rmtree(temp_dir)
+
+
+    def test_split_catalog(self):
+        # With a separate catalog database, responses are recorded in a
+        # progress database, so that's where the used question ids are.
+        temp_dir = tempfile.mkdtemp()
+        try:
+            catalog = os.path.join(temp_dir, "catalog.db")
+            progress = os.path.join(temp_dir, "progress.db")
+            side_file = catalog + ".new-catalog"
+            conn = sqlite3.connect(catalog)
+            create_tables(conn)
+            write_catalog(conn, [self.make_story("a", ["sad", "mad"], "1")],
+                False)
+            progress_conn = sqlite3.connect(progress)
+            create_progress_tables(progress_conn)
+            progress_conn.execute("INSERT INTO stories_played (participant, "
+                + "session, level, story_id) VALUES ('p1', 1, 1, 1)")
+            progress_conn.execute("INSERT INTO responses (stories_played_id, "
+                + "questions_id, response) VALUES (1, 2, 'mad')")
+            progress_conn.commit()
+            progress_conn.close()
+
+            # Question 2 is removed, but it has a response, so the new
+            # story's question doesn't reuse its id.
+            build_catalog(conn, side_file, [self.make_story("a", ["sad"],
+                "2"), self.make_story("b", ["happy"], "3")], False,
+                [progress])
+            side_conn = sqlite3.connect(side_file)
+            self.assertEqual(self.get_catalog(side_conn), [(1, 1, "sad"),
+                (3, 2, "happy")])
+            side_conn.close()
+            conn.close()
+        finally:
+            shutil.rmtree(temp_dir)
+
+
+    def test_process_workbook_parts(self):
+        # Splitting a spreadsheet into parts, even more parts than it has
+        # sheets, gives the same stories in the same order.
+        ods = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+            "..", "source_ods", "story-test-set.ods")
+        stories = _process_workbook((ods, False, 0, 1))
+        self.assertEqual([story["name"] for story in stories],
+            ["story-cf1", "story-cf2"])
+        for parts in [2, 3]:
+            self.assertEqual(_merge_parts([_process_workbook((ods, False,
+                part, parts)) for part in range(parts)]), stories)
+
+
+    def assertSameCatalog(self, conn, side_file):
+        side_conn = sqlite3.connect(side_file)
+        for table in CATALOG_TABLES:
+            query = "SELECT * FROM " + table + " ORDER BY 1, 2"
+            self.assertEqual(conn.execute(query).fetchall(),
+                side_conn.execute(query).fetchall())
+        side_conn.close()
+
+
+    def get_catalog(self, conn):
+        return conn.execute("SELECT id, story_id, target_response FROM "
+            + "questions ORDER BY id").fetchall()
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
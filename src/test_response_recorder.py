@@ -0,0 +1,122 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2016 Personal Robots Group
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import unittest
+import os
+import shutil
+import sqlite3
+import tempfile
+from ss_init_db import create_tables
+from ss_db_manager import ss_db_manager
+from ss_response_recorder import ss_response_recorder
+
+class test_response_recorder(unittest.TestCase):
+
+    def setUp(self):
+        # Make a database with one story and question, and a story
+        # played to record responses for.
+        self.dir = tempfile.mkdtemp()
+        self.database = os.path.join(self.dir, "test.db")
+        self.conn = sqlite3.connect(self.database)
+        create_tables(self.conn)
+        self.conn.execute("INSERT INTO levels VALUES (1, 3, 1)")
+        self.conn.execute("INSERT INTO stories (story_name) VALUES ('s')")
+        self.conn.execute("INSERT INTO questions (story_id, question_num, "
+            + "question_type, target_response, level) VALUES "
+            + "(1, 1, 'emotion', 'sad', 1)")
+        self.conn.commit()
+        self.dbm = ss_db_manager(self.database)
+        self.dbm.record_story_played("p1", 1, 1, "s")
+        self.ids = self.dbm.get_response_ids("p1", 1, 1, "s", 1, "emotion")
+
+
+    def tearDown(self):
+        self.dbm.close()
+        self.conn.close()
+        shutil.rmtree(self.dir)
+
+
+    def count_responses(self):
+        return self.conn.execute("SELECT COUNT(*) FROM responses"
+            ).fetchone()[0]
+
+
+    def test_record(self):
+        recorder = ss_response_recorder(self.database)
+        for response in ["sad", "happy", "sad"]:
+            recorder.record(self.ids[0], self.ids[1], response)
+        # After a flush, the responses are written and the game sees
+        # them in the session_performance summary.
+        recorder.flush()
+        self.assertEqual(self.count_responses(), 3)
+        self.assertEqual(self.dbm.get_response_counts("p1", [1]),
+            { 1: { "emotion": (2, 3) } })
+        stats = recorder.get_stats()
+        self.assertEqual(stats["queue_depth"], 0)
+        self.assertEqual(stats["recorded"], 3)
+        self.assertEqual(stats["written"], 3)
+        self.assertTrue(1 <= stats["batches"] <= 3)
+
+        # Closing writes anything still queued.
+        recorder.record(self.ids[0], self.ids[1], "angry")
+        recorder.close()
+        self.assertEqual(self.count_responses(), 4)
+        # Closing again does nothing.
+        recorder.close()
+
+
+    def test_group_commit(self):
+        # With group commit, a flush still commits the responses.
+        recorder = ss_response_recorder(self.database,
+            {"durability": "story"})
+        recorder.record(self.ids[0], self.ids[1], "sad")
+        recorder.flush()
+        self.assertEqual(self.count_responses(), 1)
+        recorder.close()
+
+
+    def test_full_queue(self):
+        # When the queue is full, recording waits for the writer instead
+        # of dropping responses.
+        recorder = ss_response_recorder(self.database, queue_size=1)
+        for i in range(0, 50):
+            recorder.record(self.ids[0], self.ids[1], "sad")
+        recorder.close()
+        self.assertEqual(self.count_responses(), 50)
+        self.assertTrue(recorder.get_stats()["max_queue_depth"] <= 1)
+
+
+    def test_failed_write(self):
+        # A batch that can't be written is counted, and later responses
+        # are still written.
+        recorder = ss_response_recorder(self.database)
+        recorder.record(None, self.ids[1], "sad")
+        recorder.flush()
+        recorder.record(self.ids[0], self.ids[1], "sad")
+        recorder.close()
+        self.assertEqual(self.count_responses(), 1)
+        self.assertEqual(recorder.get_stats()["failed"], 1)
+        self.assertEqual(recorder.get_stats()["written"], 1)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
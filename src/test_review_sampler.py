@@ -0,0 +1,84 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2016 Personal Robots Group
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import unittest
+from ss_review_sampler import ss_review_sampler
+from ss_story_index import story_set
+
+class test_review_sampler(unittest.TestCase):
+
+    def setUp(self):
+        self.sampler = ss_review_sampler(seed=1)
+        # In session 3, p1 played stories 1, 2, and 5 in earlier
+        # sessions.
+        self.sampler.load("p1", 3, [
+            (1, 2, "2016-01-01 10:00:00"),
+            (2, 1, "2016-01-02 10:00:00"),
+            (5, 1, "2016-01-01 10:00:00"),
+            ])
+
+
+    def test_is_loaded(self):
+        self.assertTrue(self.sampler.is_loaded("p1", 3))
+        self.assertFalse(self.sampler.is_loaded("p1", 4))
+        self.assertFalse(self.sampler.is_loaded("p2", 3))
+
+
+    def test_pick(self):
+        # Only stories that were played and are in the set are picked.
+        self.assertIsNone(self.sampler.pick("p1", story_set([3, 4])))
+        self.assertEqual(self.sampler.pick("p1", story_set([2, 3])), 2)
+        picks = set(self.sampler.pick("p1", story_set([1, 2, 3, 5]))
+            for i in range(0, 50))
+        self.assertEqual(picks, set([1, 2, 5]))
+
+        # Picks are the same for the same seed.
+        sampler = ss_review_sampler(seed=1)
+        sampler.load("p1", 3, [(1, 1, "t"), (2, 1, "t"), (5, 1, "t")])
+        other = ss_review_sampler(seed=1)
+        other.load("p1", 3, [(1, 1, "t"), (2, 1, "t"), (5, 1, "t")])
+        self.assertEqual(
+            [sampler.pick("p1", story_set([1, 2, 5])) for i in range(0, 20)],
+            [other.pick("p1", story_set([1, 2, 5])) for i in range(0, 20)])
+
+
+    def test_get_least_reviewed(self):
+        # Stories 2 and 5 were played once; 5 less recently.
+        all_stories = story_set(range(1, 6))
+        self.assertEqual(self.sampler.get_least_reviewed("p1", all_stories), 5)
+        self.assertEqual(self.sampler.get_least_reviewed("p1",
+            story_set([1, 2])), 2)
+        self.assertIsNone(self.sampler.get_least_reviewed("p1",
+            story_set([3])))
+
+        # Plays in the current session don't count; plays in other
+        # sessions do.
+        self.sampler.record_play("p1", 3, 5, "2016-01-03 10:00:00")
+        self.assertEqual(self.sampler.get_least_reviewed("p1", all_stories), 5)
+        self.sampler.record_play("p1", 2, 5, "2016-01-03 10:00:00")
+        self.assertEqual(self.sampler.get_least_reviewed("p1", all_stories), 2)
+        self.sampler.record_play("p1", 2, 4, "2016-01-03 10:00:00")
+        self.assertEqual(self.sampler.pick("p1", story_set([4])), 4)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
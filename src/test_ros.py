@@ -0,0 +1,138 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2016 Personal Robots Group
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import unittest
+import datetime
+import json
+import Queue
+from ss_ros import ss_ros
+from ss_transport import ss_local_transport
+
+class test_ros(unittest.TestCase):
+
+    def setUp(self):
+        # Run ss_ros over an in-process bus, and listen to everything it
+        # sends.
+        self.transport = ss_local_transport()
+        self.queue = Queue.Queue()
+        self.ros = ss_ros(self.queue, transport=self.transport)
+        self.sent = []
+        for topic, msg_class in [("/sar/opal_command",
+                self.transport.OpalCommand), ("/sar/robot_command",
+                self.transport.RobotCommand), ("/sar/game_state",
+                self.transport.GameState)]:
+            self.transport.subscribe(topic, msg_class, self.sent.append)
+
+
+    def tearDown(self):
+        self.transport.bus.close()
+
+
+    def get_sent(self):
+        self.assertTrue(self.transport.bus.wait_until_idle(5))
+        sent = self.sent[:]
+        del self.sent[:]
+        return sent
+
+
+    def test_send_commands(self):
+        OpalCommand = self.transport.OpalCommand
+        RobotCommand = self.transport.RobotCommand
+        self.ros.send_opal_command("HIGHLIGHT", "scene1")
+        self.ros.send_opal_command("CLEAR")
+        self.ros.send_robot_command("DO", "Hello!")
+        sent = self.get_sent()
+        self.assertEqual([(msg.command, msg.properties) for msg in sent],
+            [(OpalCommand.HIGHLIGHT_OBJECT, "scene1"), (OpalCommand.CLEAR,
+                ""), (RobotCommand.DO, "Hello!")])
+
+        # Commands that aren't valid or are missing properties they need
+        # aren't sent.
+        self.ros.send_opal_command("UNKNOWN")
+        self.ros.send_opal_command("LOAD_OBJECT")
+        self.ros.send_robot_command("DO")
+        self.assertEqual(self.get_sent(), [])
+
+        self.ros.send_game_state("READY")
+        sent = self.get_sent()
+        self.assertEqual(sent[0].state, self.transport.GameState.READY)
+
+
+    def test_load_objects(self):
+        OpalCommand = self.transport.OpalCommand
+        objects = ['{"name": "a"}', '{"name": "b"}']
+        # By default, each object gets its own command.
+        self.ros.send_opal_load_objects(objects)
+        self.assertEqual([(msg.command, msg.properties) for msg in
+            self.get_sent()], [(OpalCommand.LOAD_OBJECT, obj) for obj in
+            objects])
+
+        # When the game takes batches, they all go in one command.
+        batching = ss_ros(Queue.Queue(), True, self.transport)
+        batching.send_opal_load_objects(objects)
+        sent = self.get_sent()
+        self.assertEqual(len(sent), 1)
+        self.assertEqual(json.loads(sent[0].properties), [{"name": "a"},
+            {"name": "b"}])
+
+
+    def test_game_commands(self):
+        GameCommand = self.transport.GameCommand
+        publisher = self.transport.publisher("/sar/game_command", GameCommand)
+        publisher.publish(GameCommand(game=GameCommand.STORYTELLING,
+            command=GameCommand.START, level=3))
+        publisher.publish(GameCommand(game=GameCommand.STORYTELLING + 1,
+            command=GameCommand.PAUSE))
+        publisher.publish(GameCommand(game=GameCommand.STORYTELLING,
+            command=GameCommand.END))
+        self.assertTrue(self.transport.bus.wait_until_idle(5))
+        self.assertEqual(self.queue.get(False), "START\t3")
+        self.assertEqual(self.queue.get(False), "END")
+        self.assertTrue(self.queue.empty())
+
+
+    def test_wait_for_response(self):
+        OpalAction = self.transport.OpalAction
+        publisher = self.transport.publisher("/sar/opal_action", OpalAction)
+
+        # A press that arrives while we wait is the response.
+        event = self.ros._prepare_to_wait("CORRECT_INCORRECT")
+        publisher.publish(OpalAction(action="press", message="CORRECT",
+            objectName="lisa_sad"))
+        self.assertEqual(self.ros._wait(event, "CORRECT_INCORRECT",
+            datetime.timedelta(seconds=5)), ("CORRECT", "sad"))
+
+        # Without one, we time out.
+        self.assertEqual(self.ros.wait_for_response("START",
+            datetime.timedelta(seconds=0.01)), ("TIMEOUT", ""))
+
+        # The robot is done speaking once it says it isn't playing
+        # sound or doing an action.
+        RobotState = self.transport.RobotState
+        event = self.ros._prepare_to_wait("ROBOT_NOT_SPEAKING")
+        self.transport.publisher("/sar/robot_state", RobotState).publish(
+            RobotState(is_playing_sound=False, doing_action=False))
+        self.assertTrue(event.wait(5))
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,141 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2016 Personal Robots Group
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import unittest
+import os
+import shutil
+import tempfile
+from ss_script_cache import ss_script_cache
+from ss_script_bundle import ss_script_bundle, build_bundle
+
+class test_script_cache(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = ss_script_cache()
+        self.dir = tempfile.mkdtemp()
+
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+
+    def write_file(self, name, text, mtime=None):
+        # Write a file in the temporary directory, optionally setting
+        # its modification time.
+        filename = os.path.join(self.dir, name)
+        with open(filename, "w") as f:
+            f.write(text)
+        if mtime is not None:
+            os.utime(filename, (mtime, mtime))
+        return filename
+
+
+    def test_get_script(self):
+        filename = self.write_file("a.txt", "PAUSE\t1\nSTORY\n", 1000)
+        compiled = []
+        def compile_script(lines):
+            compiled.append(lines)
+            return tuple(lines)
+
+        # The first time, the script is read and compiled.
+        self.assertEqual(self.cache.get_script(filename, compile_script),
+            ("PAUSE\t1\n", "STORY\n"))
+        self.assertEqual(len(compiled), 1)
+        self.assertEqual(self.cache.misses, 1)
+
+        # After that, we get the cached script.
+        self.cache.get_script(filename, compile_script)
+        self.assertEqual(len(compiled), 1)
+        self.assertEqual(self.cache.hits, 1)
+
+        # If the file changes, we read and compile it again.
+        self.write_file("a.txt", "STORY\n", 2000)
+        self.assertEqual(self.cache.get_script(filename, compile_script),
+            ("STORY\n",))
+        self.assertEqual(len(compiled), 2)
+        self.assertEqual(self.cache.misses, 2)
+
+
+    def test_get_list(self):
+        filename = self.write_file("list.txt", "one\ntwo\n")
+        self.assertEqual(self.cache.get_list(filename), ("one\n", "two\n"))
+        self.assertEqual(self.cache.get_list(filename), ("one\n", "two\n"))
+        self.assertEqual(self.cache.get_stats()["hits"], 1)
+
+        # Missing files raise an IOError.
+        with self.assertRaises(IOError):
+            self.cache.get_list(os.path.join(self.dir, "missing.txt"))
+
+
+    def test_eviction(self):
+        # Each file is 10 bytes, so the cache can hold two of them.
+        self.cache.set_max_size(20)
+        a = self.write_file("a.txt", "0123456789")
+        b = self.write_file("b.txt", "0123456789")
+        c = self.write_file("c.txt", "0123456789")
+        self.cache.get_list(a)
+        self.cache.get_list(b)
+        # Use a, so b is the least recently used.
+        self.cache.get_list(a)
+        self.cache.get_list(c)
+        self.assertEqual(self.cache.evictions, 1)
+        self.assertEqual(self.cache.get_stats()["entries"], 2)
+
+        # a and c are still cached; b has to be read again.
+        hits = self.cache.hits
+        self.cache.get_list(a)
+        self.cache.get_list(c)
+        self.assertEqual(self.cache.hits, hits + 2)
+        self.cache.get_list(b)
+        self.assertEqual(self.cache.hits, hits + 2)
+
+        # Shrinking the cache evicts entries.
+        self.cache.set_max_size(0)
+        self.assertEqual(self.cache.get_stats()["entries"], 0)
+        self.assertEqual(self.cache.get_stats()["size"], 0)
+
+
+    def test_bundle(self):
+        os.mkdir(os.path.join(self.dir, "session_scripts"))
+        self.write_file("session_scripts/demo.txt", "PAUSE\t1\nSTORY\n")
+        self.write_file("list.txt", "one\ntwo\n")
+        self.write_file("notes.md", "not a script")
+        bundle_file = os.path.join(self.dir, "scripts.bundle")
+        self.assertEqual(build_bundle(self.dir, bundle_file), 2)
+
+        bundle = ss_script_bundle(bundle_file)
+        self.assertEqual(bundle.names(), ["list.txt",
+            "session_scripts/demo.txt"])
+        self.assertEqual(self.cache.get_script("session_scripts/demo.txt",
+            tuple, bundle), ("PAUSE\t1\n", "STORY\n"))
+        self.assertEqual(self.cache.get_list("list.txt", bundle),
+            ("one\n", "two\n"))
+        self.cache.get_list("list.txt", bundle)
+        self.assertEqual(self.cache.hits, 1)
+
+        # Scripts that aren't in the bundle raise an IOError.
+        with self.assertRaises(IOError):
+            self.cache.get_list("missing.txt", bundle)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
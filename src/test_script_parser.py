@@ -28,6 +28,7 @@ import mock
 import random
 from mock import Mock
 from ss_script_parser import ss_script_parser
+from ss_script_parser import ss_opcodes
 
 class test_script_parser(unittest.TestCase):
 
@@ -55,47 +56,73 @@ class test_script_parser(unittest.TestCase):
             self.sp.get_session_script(-5)
 
 
-    @mock.patch("__builtin__.open", create=True, autospec=True)
+    @mock.patch("__builtin__.open", create=True)
     def test_load_script(self, mock_open):
-        value = random.randint(-1000,1000)
-        mock_open.side_effect = [ IOError, value ]
+        mock_open.side_effect = [ IOError,
+            mock.mock_open(read_data="PAUSE\t1\nSTORY\n")() ]
 
         # Get IOError when we try to load a non-existent script.
         with self.assertRaises(IOError):
             self.sp.load_script("demo.txt")
 
-        # Get file handle when we try to load an existent script.
+        # Get compiled commands when we try to load an existent script.
         self.sp.load_script("demo.txt")
-        self.assertEqual(self.sp._fh, value)
-
-
-    def test_next_line(self):
-        # Set up mock iterator for the file handle that returns lines
-        # from the file.
-        value = str(random.randint(-1000,1000))
-        m = Mock()
-        self.sp._fh = m
-        m.next.side_effect = [
-                value,
-                AttributeError,
-                ValueError,
-                StopIteration ]
-
-        # A line is returned.
-        self.assertEqual(self.sp.next_line(), value)
-
-        # Check each error type:
-        # No script file loaded.
+        self.assertEqual([c.opcode for c in self.sp._commands],
+            [ss_opcodes.PAUSE, ss_opcodes.STORY])
+
+
+    def test_compile_line(self):
+        # Each kind of line compiles to its opcode and arguments, with
+        # numbers converted to ints.
+        lines = [
+            ("STORY", ss_opcodes.STORY, ()),
+            ("STORY\tSETUP", ss_opcodes.STORY_SETUP, ()),
+            ("ROBOT\tDO\t\"Hi!\"\n", ss_opcodes.ROBOT, ("DO", "\"Hi!\"")),
+            ("ROBOT\tSLEEP", ss_opcodes.ROBOT, ("SLEEP", None)),
+            ("OPAL\tCLEAR\tANSWERS", ss_opcodes.OPAL, ("CLEAR", "ANSWERS")),
+            ("PAUSE\t2", ss_opcodes.PAUSE, (2,)),
+            ("ADD\tINCORRECT_RESPONSES\tx.txt", ss_opcodes.ADD,
+                ("INCORRECT_RESPONSES", "x.txt")),
+            ("SET\tMAX_STORIES\t3", ss_opcodes.SET, ("MAX_STORIES", 3)),
+            ("WAIT\tCORRECT_INCORRECT\t10", ss_opcodes.WAIT,
+                ("CORRECT_INCORRECT", 10)),
+            ("QUESTION\temotion\t1", ss_opcodes.QUESTION, ("emotion", 1)),
+            ("REPEAT\tMAX_STORIES\ts.txt", ss_opcodes.REPEAT,
+                ("MAX_STORIES", "s.txt")),
+            ("REPEAT\t4\ts.txt", ss_opcodes.REPEAT, (4, "s.txt")),
+            ]
+        for line, opcode, args in lines:
+            command = self.sp.compile_line(line)
+            self.assertEqual(command.opcode, opcode)
+            self.assertEqual(command.args, args)
+            self.assertEqual(command.line, line)
+
+        # Blank lines, unknown commands, lines with invalid numbers, and
+        # lines missing arguments are skipped.
+        for line in ["", "\n", "ROBOTS\tDO\thi", "PAUSE\tfive",
+                "SET\tMAX_STORIES", "STORY\tNOTSETUP", "WAIT\tSTART\tx",
+                "OPAL"]:
+            self.assertIsNone(self.sp.compile_line(line))
+
+
+    def test_next_command(self):
+        # No script loaded.
         with self.assertRaises(AttributeError):
-            self.sp.next_line()
+            self.sp.next_command()
 
-        # Script file closed.
-        with self.assertRaises(ValueError):
-            self.sp.next_line()
+        # Commands are returned in order.
+        self.sp._commands = self.sp.compile_script(["STORY", "PAUSE\t1"])
+        self.sp._next = 0
+        self.assertEqual(self.sp.next_command().opcode, ss_opcodes.STORY)
+        self.assertEqual(self.sp.next_command().opcode, ss_opcodes.PAUSE)
 
-        # End of script file.
+        # End of script.
         with self.assertRaises(StopIteration):
-            self.sp.next_line()
+            self.sp.next_command()
+
+        # After rewinding, we can play the script again.
+        self.sp.rewind()
+        self.assertEqual(self.sp.next_command().opcode, ss_opcodes.STORY)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,70 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2016 Personal Robots Group
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import unittest
+from mock import Mock
+from ss_story_index import ss_story_index, story_set
+
+class test_story_index(unittest.TestCase):
+
+    def setUp(self):
+        # Stories 1-4. At level 1, story 2 has sad and happy questions,
+        # story 3 has a sad question, and story 4 an angry question.
+        catalog = Mock()
+        catalog.story_names = { 1: "s1", 2: "s2", 3: "s3", 4: "s4" }
+        catalog.questions = [
+            (1, 2, 1, "emotion", "sad"),
+            (2, 2, 1, "emotion", "happy"),
+            (3, 3, 1, "emotion", "sad"),
+            (4, 4, 1, "emotion", "angry"),
+            (5, 1, 2, "emotion", "sad"),
+            ]
+        self.index = ss_story_index(catalog)
+
+
+    def test_get_first_unplayed(self):
+        # The first story with one of the emotions at the level.
+        self.assertEqual(self.index.get_first_unplayed(0, ["sad"], 1), 2)
+        self.assertEqual(self.index.get_first_unplayed(0, ["angry", "happy"],
+            1), 2)
+        self.assertEqual(self.index.get_first_unplayed(0, ["angry"], 1), 4)
+        self.assertEqual(self.index.get_first_unplayed(0, ["sad"], 2), 1)
+
+        # Played stories are skipped.
+        self.assertEqual(self.index.get_first_unplayed(story_set([2]),
+            ["sad"], 1), 3)
+
+        # If no unplayed story has the emotions, we get the first
+        # unplayed story at any level.
+        self.assertEqual(self.index.get_first_unplayed(0, [], 1), 1)
+        self.assertEqual(self.index.get_first_unplayed(0, ["bored"], 1), 1)
+        self.assertEqual(self.index.get_first_unplayed(0, ["sad"], 7), 1)
+        self.assertEqual(self.index.get_first_unplayed(story_set([1, 2, 3]),
+            ["sad"], 1), 4)
+
+        # If every story has been played, we get nothing.
+        self.assertIsNone(self.index.get_first_unplayed(
+            story_set([1, 2, 3, 4]), ["sad"], 1))
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
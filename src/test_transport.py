@@ -0,0 +1,137 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2016 Personal Robots Group
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import unittest
+import threading
+from ss_transport import ss_local_bus, ss_local_transport, OpalCommand
+
+class test_transport(unittest.TestCase):
+
+    def setUp(self):
+        self.bus = ss_local_bus()
+
+
+    def tearDown(self):
+        self.bus.close()
+
+
+    def test_messages(self):
+        # Fields get defaults, and each message gets its own header.
+        msg = OpalCommand()
+        self.assertEqual(msg.command, 0)
+        self.assertEqual(msg.properties, "")
+        self.assertIsNot(msg.header, OpalCommand().header)
+        self.assertEqual(OpalCommand(command=OpalCommand.CLEAR),
+            OpalCommand(command=OpalCommand.CLEAR))
+        self.assertNotEqual(OpalCommand(command=OpalCommand.CLEAR),
+            OpalCommand(command=OpalCommand.RESET))
+        with self.assertRaises(AttributeError):
+            OpalCommand(nonsense=1)
+
+
+    def test_publish(self):
+        # Each subscriber gets every message on the topic, in order.
+        first = []
+        second = []
+        other = []
+        self.bus.subscribe("/topic", first.append)
+        self.bus.subscribe("/topic", second.append)
+        self.bus.subscribe("/other", other.append)
+        publisher = self.bus.publisher("/topic")
+        self.assertEqual(publisher.get_num_connections(), 2)
+        for i in range(0, 100):
+            publisher.publish(i)
+        self.assertTrue(self.bus.wait_until_idle(5))
+        self.assertEqual(first, range(0, 100))
+        self.assertEqual(second, range(0, 100))
+        self.assertEqual(other, [])
+
+
+    def test_callback_error(self):
+        # A callback that fails doesn't stop later messages.
+        received = []
+        def callback(msg):
+            if msg == 1:
+                raise ValueError("bad message")
+            received.append(msg)
+        self.bus.subscribe("/topic", callback)
+        publisher = self.bus.publisher("/topic")
+        for i in range(0, 3):
+            publisher.publish(i)
+        self.assertTrue(self.bus.wait_until_idle(5))
+        self.assertEqual(received, [0, 2])
+
+
+    def test_queue_size(self):
+        # A subscriber that is too far behind loses the oldest messages
+        # waiting for it.
+        received = []
+        handling = threading.Event()
+        go = threading.Event()
+        def callback(msg):
+            handling.set()
+            go.wait(5)
+            received.append(msg)
+        subscriber = self.bus.subscribe("/topic", callback)
+        publisher = self.bus.publisher("/topic", queue_size=2)
+        publisher.publish(0)
+        self.assertTrue(handling.wait(5))
+        for i in range(1, 5):
+            publisher.publish(i)
+        go.set()
+        self.assertTrue(self.bus.wait_until_idle(5))
+        self.assertEqual(received, [0, 3, 4])
+        self.assertEqual(subscriber.dropped, 2)
+
+
+    def test_wait_until_idle(self):
+        # Waiting for the bus includes messages published by callbacks.
+        received = []
+        go = threading.Event()
+        relay = self.bus.publisher("/relayed")
+        def callback(msg):
+            go.wait(5)
+            relay.publish(msg)
+        self.bus.subscribe("/topic", callback)
+        self.bus.subscribe("/relayed", received.append)
+        self.bus.publisher("/topic").publish("hi")
+        self.assertFalse(self.bus.wait_until_idle(0.05))
+        go.set()
+        self.assertTrue(self.bus.wait_until_idle(5))
+        self.assertEqual(received, ["hi"])
+
+
+    def test_transport(self):
+        transport = ss_local_transport(self.bus)
+        received = []
+        transport.subscribe("/sar/opal_command", transport.OpalCommand,
+            received.append)
+        msg = transport.OpalCommand(command=transport.OpalCommand.RESET)
+        msg.header.stamp = transport.now()
+        transport.publisher("/sar/opal_command", transport.OpalCommand,
+            10).publish(msg)
+        self.assertTrue(self.bus.wait_until_idle(5))
+        self.assertEqual(received, [msg])
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)